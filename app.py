@@ -1,14 +1,30 @@
-from flask import Flask, Blueprint, render_template, request, jsonify, send_file
+import startup
+# Import the app modules one at a time so the startup report shows what each costs
+startup.timed_imports('flask', 'flask_socketio', 'applog', 'database', 'metrics', 'sqltrace', 'compress', 'contributions', 'auth',
+                      'dashboard', 'tts', 'grammar', 'broker', 'eventbus', 'collab', 'autosave', 'notebooks', 'groups')
+from flask import Flask, Blueprint, Response, render_template, request, jsonify
 from flask_socketio import SocketIO, join_room, leave_room, emit
-from config import SECRET_KEY, DEBUG, DATABASE
-from database import get_db, close_connection, init_db
+from config import SECRET_KEY, DEBUG, DATABASE, CONTRIBUTIONS_WRITE_BEHIND, WARM_UP_ON_START, LOG_EDIT_SAMPLE
+import applog
+import database
+from database import get_db, get_read_db, close_connection, close_pools, init_db, visible_note
+from contributions import contributions_writer
+from grammar import grammar_service
+from broker import event_broker
+from eventbus import event_bus, BusClientManager, on_invalidate
+from collab import documents, StaleRevision, InvalidOperation
+import metrics
+import sqltrace
+import compress
+from metrics import registry
+from autosave import autosave
 from auth import auth_bp, login_required, current_user
 from dashboard import dashboard_bp
 from notebooks import notebook_bp
 from groups import group_bp
+import atexit
 import os
-import pyttsx3
-from tempfile import NamedTemporaryFile
+from tts import tts_pool, TTSBusy, SpeechStream, send_audio
 
 # -----------------------------
 # Help Blueprint
@@ -32,7 +48,7 @@ chatbot_bp = Blueprint('chatbot', __name__, template_folder='templates')
 def chatbot_page():
     """Render chatbot page with all notebooks available."""
     user = current_user()
-    db = get_db()
+    db = get_read_db()
     notebooks = db.execute(
         'SELECT id, title FROM notebooks WHERE owner_id=? ORDER BY created_at DESC',
         (user['id'],)
@@ -52,7 +68,19 @@ app.config.update(
     DATABASE=DATABASE
 )
 
-socketio = SocketIO(app, cors_allowed_origins="*")
+# With a cross-process event bus, Socket.IO room emits travel over it too,
+# so handle_edit reaches editors connected to any worker
+socketio_options = {'client_manager': BusClientManager(event_bus)} if event_bus.cross_process else {}
+socketio = SocketIO(app, cors_allowed_origins="*", **socketio_options)
+
+# Wait for speech jobs, pooled connections, contribution flushes and SSE events
+# cooperatively (the SSE wait blocks a real thread just fine); stop the speech workers on exit
+tts_pool.sleep = socketio.sleep
+database.sleep = socketio.sleep
+contributions_writer.sleep = socketio.sleep
+if socketio.async_mode != 'threading':
+    event_broker.sleep = socketio.sleep
+atexit.register(tts_pool.shutdown)
 
 # -----------------------------
 # Blueprint Registration
@@ -64,34 +92,186 @@ app.register_blueprint(group_bp)
 app.register_blueprint(help_bp)
 app.register_blueprint(chatbot_bp)
 
+# -----------------------------
+# Logging and Metrics
+# -----------------------------
+# Request ids for log correlation; records are written by a background thread
+applog.init_app(app)
+log = applog.get_logger('app')
+
+# Per-endpoint latency, in-flight requests and SQL statements, served at /metrics
+metrics.init_app(app)
+# Opt-in (SQL_TRACE=1): statement report per request in X-SQL-Trace and the log
+sqltrace.init_app(app)
+# gzip/deflate/br for HTML, JSON and SSE responses; compressed static files are cached
+compress.init_app(app)
+
+SOCKETIO_CONNECTIONS = registry.gauge('notebridge_socketio_connections', 'Connected Socket.IO clients.')
+LIVE_EDITS = registry.counter('notebridge_live_edits_total', 'Live-edit operations accepted.')
+LIVE_EDIT_DELIVERIES = registry.counter(
+    'notebridge_live_edit_deliveries_total', 'Live-edit operations sent to the other editors of a note.')
+registry.collect('notebridge_live_documents', 'Notes open for live editing.', 'gauge',
+                 lambda: documents.stats()['documents'])
+registry.collect('notebridge_autosave_dirty_notes', 'Live-edited notes not written yet.', 'gauge',
+                 lambda: autosave.stats()['dirty_notes'])
+registry.collect('notebridge_sse_subscribers', 'Open SSE streams.', 'gauge', event_broker.subscriber_count)
+registry.collect('notebridge_sse_events_total', 'Note events fanned out to SSE subscribers.', 'counter',
+                 lambda: event_broker.published)
+registry.collect('notebridge_sse_evicted_total', 'SSE subscribers dropped for falling behind.', 'counter',
+                 lambda: event_broker.evicted)
+registry.collect('notebridge_log_dropped_total', 'Log records dropped because the log queue was full.',
+                 'counter', applog.dropped)
+registry.collect('notebridge_event_bus_messages_total', 'Event bus messages by direction.', 'counter',
+                 lambda: {'published': event_bus.published, 'received': event_bus.received}, ('direction',))
+
 # -----------------------------
 # Database Management
 # -----------------------------
 app.teardown_appcontext(close_connection)
+atexit.register(close_pools)
 
-# Initialize DB if it doesn’t exist
-if not os.path.exists(DATABASE):
+# Group-commit contributions off the request thread (stopped before the pools close)
+if CONTRIBUTIONS_WRITE_BEHIND:
+    contributions_writer.start()
+    atexit.register(contributions_writer.stop)
+
+# Live-edited notes are written behind; the final flush runs before the writer stops
+autosave.start()
+atexit.register(autosave.stop)
+
+# Grammar workers write corrected notes through the pool, so stop them first too
+atexit.register(grammar_service.stop)
+
+# Receive note events published by the other workers
+if event_bus.cross_process:
+    event_broker.continue_after(event_bus.last_id())
+event_bus.start()
+atexit.register(event_bus.stop)
+
+# Initialize DB if it doesn’t exist. An existing file is only upgraded by
+# `flask --app app upgrade-db` or when the server is started with python app.py,
+# so importing the app (tests, benchmarks, WSGI servers) never rewrites it.
+def upgrade_db():
+    """Create missing tables and apply pending migrations to DATABASE."""
     with app.app_context():
-        db = get_db()
-        init_db(db)
-        print("Database initialized successfully.")
+        init_db(get_db())
+
+if not os.path.exists(DATABASE):
+    upgrade_db()
+    print("Database initialized successfully.")
+
+@app.cli.command('upgrade-db')
+def upgrade_db_command():
+    """Apply pending schema migrations."""
+    upgrade_db()
 
 # -----------------------------
 # Socket.IO Events
 # -----------------------------
+def _note_id(data):
+    try:
+        return int((data or {}).get('note_id'))
+    except (TypeError, ValueError):
+        return None
+
+def _load_content(db, note_id):
+    row = db.execute('SELECT content FROM notes WHERE id=?', (note_id,)).fetchone()
+    return (row['content'] if row else None) or ''
+
+def _open_document(note_id, user_id):
+    """Join the live document of a note, loading it from the database if nobody is editing it."""
+    return documents.join(note_id, request.sid, lambda: _load_content(get_read_db(), note_id), user_id)
+
+def _may_open(note_id):
+    """The socket's user, if they are logged in and may read the note."""
+    user = current_user()
+    if user is None or visible_note(get_read_db(), note_id, user['id']) is None:
+        return None
+    return user
+
+def _reload_documents(note_ids):
+    """The notes were written directly: reload their live copies and resync the editors."""
+    for note_id in note_ids:
+        doc = documents.get(note_id)
+        if doc is None:
+            continue
+        # Runs on the bus listener too, outside any app context
+        db = database.get_pool(readonly=True).acquire()
+        try:
+            doc.reset(_load_content(db, note_id))
+        finally:
+            db.close()
+        socketio.emit('resync', doc.snapshot(), room=f"note_{note_id}")
+
+on_invalidate('document', _reload_documents)
+
 @socketio.on('join_note')
 def handle_join(data):
-    note_id = data.get('note_id')
+    note_id = _note_id(data)
+    if not note_id:
+        return
+    user = _may_open(note_id)
+    if user is None:
+        log.warning('Refused note join', note_id=note_id)
+        emit('denied', {'note_id': note_id})
+        return
+    join_room(f"note_{note_id}")
+    log.debug('Joined note', note_id=note_id)
+    emit('doc', _open_document(note_id, user['id']).snapshot())
+    emit('status', {'msg': f'Joined note {note_id}'}, room=f"note_{note_id}")
+
+# When the last editor leaves, the note is saved right away instead of after the debounce
+@socketio.on('leave_note')
+def handle_leave(data):
+    note_id = _note_id(data)
     if note_id:
-        join_room(f"note_{note_id}")
-        print(f"User joined note {note_id}")
-        emit('status', {'msg': f'Joined note {note_id}'}, room=f"note_{note_id}")
+        leave_room(f"note_{note_id}")
+        if documents.leave(note_id, request.sid) is not None:
+            autosave.flush_note(note_id)
+
+@socketio.on('connect')
+def handle_connect(auth=None):
+    SOCKETIO_CONNECTIONS.inc()
+
+@socketio.on('disconnect')
+def handle_disconnect():
+    SOCKETIO_CONNECTIONS.dec()
+    for doc in documents.disconnect(request.sid):
+        autosave.flush_note(doc.note_id)
 
 @socketio.on('edit')
 def handle_edit(data):
-    note_id = data.get('note_id')
-    if note_id:
-        emit('update', data, room=f"note_{note_id}", include_self=False)
+    """
+    Apply one operation {note_id, rev, op} to the live note (see collab.py),
+    acknowledge it to the sender and send the rebased operation to the others.
+    """
+    note_id = _note_id(data)
+    if not note_id:
+        return
+    # Only sessions that passed the join check may edit, as the user they joined as
+    user_id = documents.editor_of(note_id, request.sid)
+    doc = documents.get(note_id)
+    if user_id is None or doc is None:
+        log.warning('Refused edit from a session that has not joined the note', note_id=note_id)
+        emit('denied', {'note_id': note_id})
+        return
+    try:
+        rev, op = doc.receive(data.get('rev'), data.get('op'))
+    except (StaleRevision, InvalidOperation) as e:
+        log.warning('Rejected edit', note_id=note_id, error=str(e))
+        emit('resync', doc.snapshot())
+        return
+    autosave.mark_dirty(doc, user_id)
+    LIVE_EDITS.inc()
+    # The sessions in the room other than the sender (those connected to
+    # this worker; the manager does not know the other workers' rooms)
+    room = f"note_{note_id}"
+    LIVE_EDIT_DELIVERIES.inc(sum(1 for sid, _ in socketio.server.manager.get_participants('/', room)
+                                 if sid != request.sid))
+    if log.sample('edit', LOG_EDIT_SAMPLE):
+        log.info('Edit applied', note_id=note_id, rev=rev, sampled=f'1/{LOG_EDIT_SAMPLE}')
+    emit('ack', {'note_id': note_id, 'rev': rev})
+    emit('update', {'note_id': note_id, 'rev': rev, 'op': op}, room=room, include_self=False)
 
 # -----------------------------
 # Text-to-Speech Route
@@ -99,43 +279,58 @@ def handle_edit(data):
 @app.route('/note/<int:note_id>/speak', methods=['POST'])
 @login_required
 def speak_note(note_id):
-    db = get_db()
+    db = get_read_db()
     note = db.execute("SELECT title, content FROM notes WHERE id=?", (note_id,)).fetchone()
     if not note:
         return jsonify({"error": "Note not found"}), 404
 
     data = request.get_json() or {}
     voice_type = data.get("voice", "male")
+    text = note['content'] or "This note is empty."
 
-    engine = pyttsx3.init()
-    voices = engine.getProperty('voices')
-
-    selected_voice = None
-    for v in voices:
-        if voice_type == "female" and "female" in v.name.lower():
-            selected_voice = v.id
-            break
-        elif voice_type == "male" and "male" in v.name.lower():
-            selected_voice = v.id
-            break
-    if selected_voice:
-        engine.setProperty('voice', selected_voice)
+    try:
+        tmp_path = tts_pool.synthesize(text, voice=voice_type, suffix=".wav")
+    except TTSBusy:
+        return jsonify({"error": "Speech service busy, try again shortly"}), 503
+    except TimeoutError:
+        return jsonify({"error": "Speech synthesis timed out"}), 504
+    except Exception as e:
+        log.error('Speech synthesis failed', note_id=note_id, error=str(e))
+        return jsonify({"error": "Failed to generate audio"}), 500
 
-    engine.setProperty('rate', 170)
+    return send_audio(tmp_path, 'audio/wav')
 
-    tmp_file = NamedTemporaryFile(delete=False, suffix=".wav")
-    tmp_path = tmp_file.name
-    tmp_file.close()
+@app.route('/note/<int:note_id>/speak/stream', methods=['GET'])
+@login_required
+def stream_note_speech(note_id):
+    """Stream a note as WAV audio, synthesized sentence by sentence."""
+    db = get_read_db()
+    note = db.execute("SELECT content FROM notes WHERE id=?", (note_id,)).fetchone()
+    if not note:
+        return jsonify({"error": "Note not found"}), 404
 
     text = note['content'] or "This note is empty."
-    engine.save_to_file(text, tmp_path)
-    engine.runAndWait()
-
-    return send_file(tmp_path, mimetype='audio/wav', as_attachment=False)
+    try:
+        stream = SpeechStream(tts_pool, text, voice=request.args.get("voice", "male"))
+    except TTSBusy:
+        return jsonify({"error": "Speech service busy, try again shortly"}), 503
+    return Response(stream, mimetype='audio/wav', headers={'Cache-Control': 'no-store'})
 
 # -----------------------------
 # Run the App
 # -----------------------------
 if __name__ == '__main__':
+    with startup.timed('schema upgrade', 'init'):
+        upgrade_db()
+    # Spawn the TTS workers up front so the first audio request does not pay for it
+    try:
+        with startup.timed('tts workers', 'init'):
+            tts_pool.start()
+    except Exception as e:
+        log.warning('Text-to-speech workers unavailable', error=str(e))
+    # Build heavy NLP resources (LanguageTool, ...) before traffic arrives
+    if WARM_UP_ON_START:
+        startup.warm_up()
+    startup.print_report()
     print('Starting NoteBridge on http://127.0.0.1:5000')
     socketio.run(app, host='0.0.0.0', port=5000, debug=DEBUG)
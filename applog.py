@@ -0,0 +1,187 @@
+import atexit
+import datetime
+import json
+import logging
+import queue
+import sys
+import threading
+import uuid
+from logging.handlers import QueueHandler, QueueListener
+from flask import g, has_request_context, request
+from config import LOG_LEVEL, LOG_FORMAT, LOG_QUEUE_SIZE
+
+# -----------------------------
+# Structured, queue-backed logging
+# -----------------------------
+# Modules log through get_logger(name) with the message plus keyword fields:
+#     log.info('Note added', notebook_id=3, chars=120)
+# The calling thread only stamps the record (level check, request id) and
+# puts it on a bounded queue; a listener thread formats it and writes it to
+# stdout, as text or one JSON object per line (LOG_FORMAT). When the queue is
+# full the record is dropped and counted rather than blocking the request.
+ROOT = 'notebridge'
+REQUEST_ID_HEADER = 'X-Request-ID'
+
+# Attributes every LogRecord has; anything else on a record is not a field
+_RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def _request_id():
+    if not has_request_context():
+        return None
+    rid = g.get('request_id')
+    if rid is None:
+        # Socket.IO events run in a request context of their own; the session id ties them together
+        rid = getattr(request, 'sid', None)
+    return rid
+
+
+class _ContextFilter(logging.Filter):
+    """Runs in the logging thread: attaches the request id before the record is queued."""
+
+    def filter(self, record):
+        record.request_id = _request_id()
+        return True
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    def __init__(self, q):
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Leave formatting to the listener thread; callers pass plain values,
+        # so msg % args is still correct when it gets there
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _fields(record):
+    return {k: v for k, v in vars(record).items() if k not in _RESERVED and k != 'request_id'}
+
+
+class TextFormatter(logging.Formatter):
+    """2026-01-31T12:00:00.123Z INFO notebooks [req] Message key=value ..."""
+
+    def format(self, record):
+        ts = datetime.datetime.utcfromtimestamp(record.created).isoformat(timespec='milliseconds') + 'Z'
+        parts = [ts, record.levelname, record.name[len(ROOT) + 1:] or ROOT]
+        if record.request_id:
+            parts.append(f'[{record.request_id}]')
+        parts.append(record.getMessage())
+        parts += [f'{k}={v}' for k, v in _fields(record).items()]
+        line = ' '.join(parts)
+        if record.exc_info:
+            line += '\n' + self.formatException(record.exc_info)
+        return line
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.datetime.utcfromtimestamp(record.created).isoformat(timespec='milliseconds') + 'Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        if record.request_id:
+            entry['request_id'] = record.request_id
+        entry.update(_fields(record))
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class StructuredLogger(logging.LoggerAdapter):
+    """Logger taking fields as keyword arguments, with 1-in-N sampling for very frequent events."""
+
+    def __init__(self, logger):
+        super().__init__(logger, {})
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def process(self, msg, kwargs):
+        fields = {k: kwargs.pop(k) for k in list(kwargs)
+                  if k not in ('exc_info', 'stack_info', 'stacklevel', 'extra')}
+        kwargs['extra'] = {**kwargs.get('extra', {}), **fields}
+        return msg, kwargs
+
+    def sample(self, key, every):
+        """True for the first and then every every-th call with key; log only then."""
+        if every <= 1:
+            return True
+        with self._lock:
+            n = self._counts.get(key, 0)
+            self._counts[key] = n + 1
+        return n % every == 0
+
+
+# -----------------------------
+# Setup
+# -----------------------------
+log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+queue_handler = _NonBlockingQueueHandler(log_queue)
+queue_handler.addFilter(_ContextFilter())
+output_handler = logging.StreamHandler(sys.stdout)
+output_handler.setFormatter(JSONFormatter() if LOG_FORMAT == 'json' else TextFormatter())
+_listener = QueueListener(log_queue, output_handler, respect_handler_level=True)
+_started = False
+_root = logging.getLogger(ROOT)
+_root.setLevel(LOG_LEVEL)
+_root.propagate = False
+_root.addHandler(queue_handler)
+
+
+def get_logger(name):
+    """Structured logger for a module, e.g. get_logger('notebooks')."""
+    return StructuredLogger(logging.getLogger(f'{ROOT}.{name}'))
+
+
+def start():
+    """Start the writer thread (no-op if running); records queued before it are written then."""
+    global _started
+    if not _started:
+        _listener.start()
+        _started = True
+        atexit.register(stop)
+
+
+def stop():
+    """Write everything still queued and stop the writer thread."""
+    global _started
+    if _started:
+        _listener.stop()
+        _started = False
+
+
+def flush():
+    """Block until every record queued so far was written."""
+    if _started:
+        log_queue.join()
+
+
+def dropped():
+    return queue_handler.dropped
+
+
+def _assign_request_id():
+    rid = request.headers.get(REQUEST_ID_HEADER, '')
+    g.request_id = rid[:64] if rid.isprintable() and rid else uuid.uuid4().hex[:16]
+
+
+def _echo_request_id(response):
+    if g.get('request_id'):
+        response.headers[REQUEST_ID_HEADER] = g.request_id
+    return response
+
+
+def init_app(app):
+    """Give every request an id (taken from X-Request-ID if sent) for its log records and response."""
+    app.before_request(_assign_request_id)
+    app.after_request(_echo_request_id)
+    start()
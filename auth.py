@@ -1,17 +1,55 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session
+from flask import Blueprint, render_template, request, redirect, url_for, session, g
 from werkzeug.security import generate_password_hash, check_password_hash
-from database import get_db
+from database import get_db, get_read_db
+from config import AUTH_VERSION_TTL
 import datetime
+import time
 from functools import wraps
 
 auth_bp = Blueprint('auth', __name__, template_folder='templates')
+
+# user_id -> (session_version, fetched_at); lets a worker trust session snapshots
+# without touching the database on every request. A trigger bumps the version
+# whenever a users row changes, so an edited or deleted user is reloaded (or
+# logged out) within AUTH_VERSION_TTL.
+_user_versions = {}
+
+def _user_version(user_id):
+    """Current session_version of a user, re-read at most every AUTH_VERSION_TTL seconds."""
+    cached = _user_versions.get(user_id)
+    if cached and time.monotonic() - cached[1] < AUTH_VERSION_TTL:
+        return cached[0]
+    row = get_read_db().execute('SELECT session_version FROM users WHERE id=?', (user_id,)).fetchone()
+    version = row['session_version'] if row else None
+    _user_versions[user_id] = (version, time.monotonic())
+    return version
+
+def _remember_user(row):
+    """Store a signed snapshot of the user in the session and return it."""
+    user = {'id': row['id'], 'username': row['username'], 'full_name': row['full_name']}
+    session['user'] = dict(user, v=row['session_version'])
+    _user_versions[row['id']] = (row['session_version'], time.monotonic())
+    return user
+
 # definitions for login_required and current_user
 def current_user():
+    """The logged-in user (or None), resolved at most once per request."""
+    if '_current_user' not in g:
+        g._current_user = _load_current_user()
+    return g._current_user
+
+def _load_current_user():
     uid = session.get('user_id')
     if not uid:
         return None
-    db = get_db()
-    return db.execute('SELECT id, username, full_name FROM users WHERE id=?', (uid,)).fetchone()
+    snapshot = session.get('user')
+    if snapshot and snapshot.get('id') == uid and snapshot.get('v') == _user_version(uid):
+        return {'id': uid, 'username': snapshot['username'], 'full_name': snapshot['full_name']}
+    db = get_read_db()
+    row = db.execute(
+        'SELECT id, username, full_name, session_version FROM users WHERE id=?', (uid,)
+    ).fetchone()
+    return _remember_user(row) if row else None
 
 def login_required(f):
     @wraps(f)
@@ -53,10 +91,11 @@ def login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
-        db = get_db()
+        db = get_read_db()
         user = db.execute('SELECT * FROM users WHERE username=?', (username,)).fetchone()
         if user and check_password_hash(user['password_hash'], password):
             session['user_id'] = user['id']
+            _remember_user(user)
             return redirect(url_for('dashboard.dashboard'))  
         return 'Invalid credentials', 400
     return render_template('login.html')
@@ -0,0 +1,187 @@
+import datetime
+import threading
+import time
+import database
+from summaries import invalidate_summary
+from revisions import record_revision
+from applog import get_logger
+from config import AUTOSAVE_DEBOUNCE_MS, AUTOSAVE_MAX_DELAY_MS
+
+log = get_logger('autosave')
+
+# -----------------------------
+# Write-behind autosave of live-edited notes
+# -----------------------------
+class _Dirty:
+    __slots__ = ('doc', 'user_id', 'first_edit', 'last_edit', 'edits')
+
+    def __init__(self, doc, user_id, now):
+        self.doc = doc
+        self.user_id = user_id
+        self.first_edit = now
+        self.last_edit = now
+        self.edits = 0
+
+
+class AutosaveBuffer:
+    """
+    Holds the notes changed through live editing (collab.NoteDocument) and
+    writes each one's latest text once edits pause for debounce_ms, or at
+    the latest max_delay_ms after its first unsaved edit. Any number of
+    operations in between become a single UPDATE, which only applies if the
+    stored text is still the one the document last saw (see
+    collab.invalidate_document for writes made around it).
+    """
+
+    def __init__(self, debounce_ms=AUTOSAVE_DEBOUNCE_MS, max_delay_ms=AUTOSAVE_MAX_DELAY_MS):
+        self.debounce = debounce_ms / 1000
+        self.max_delay = max_delay_ms / 1000
+        self._dirty = {}                 # note_id -> _Dirty
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.flushes = 0
+        self.notes_written = 0
+        self.edits_coalesced = 0
+        self.failed = 0
+        self.conflicts = 0
+        self.last_flush_lag_ms = 0.0
+        self.max_flush_lag_ms = 0.0
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start the debounce thread (no-op if already running)."""
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='autosave', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the debounce thread and write every note still unsaved."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def mark_dirty(self, doc, user_id=None):
+        """Record that doc changed; user_id is credited in the contributions log."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._dirty.get(doc.note_id)
+            if entry is None:
+                entry = self._dirty[doc.note_id] = _Dirty(doc, user_id, now)
+            entry.last_edit = now
+            entry.edits += 1
+            if user_id is not None:
+                entry.user_id = user_id
+
+    def flush_note(self, note_id):
+        """Write one note now, e.g. when its last editor left."""
+        with self._lock:
+            entry = self._dirty.pop(note_id, None)
+        if entry is not None:
+            self._write([entry])
+
+    def flush(self):
+        """Write every unsaved note now."""
+        with self._lock:
+            entries = list(self._dirty.values())
+            self._dirty.clear()
+        if entries:
+            self._write(entries)
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            oldest = min((e.first_edit for e in self._dirty.values()), default=None)
+            dirty = len(self._dirty)
+        return {
+            'dirty_notes': dirty,
+            'oldest_unsaved_ms': round((now - oldest) * 1000, 1) if oldest is not None else 0.0,
+            'flushes': self.flushes,
+            'notes_written': self.notes_written,
+            'edits_coalesced': self.edits_coalesced,
+            'failed': self.failed,
+            'conflicts': self.conflicts,
+            'last_flush_lag_ms': round(self.last_flush_lag_ms, 1),
+            'max_flush_lag_ms': round(self.max_flush_lag_ms, 1),
+        }
+
+    def _due(self, now):
+        with self._lock:
+            due = [note_id for note_id, e in self._dirty.items()
+                   if now - e.last_edit >= self.debounce or now - e.first_edit >= self.max_delay]
+            return [self._dirty.pop(note_id) for note_id in due]
+
+    def _run(self):
+        interval = min(self.debounce, self.max_delay) / 4
+        while not self._stop.wait(interval):
+            entries = self._due(time.monotonic())
+            if entries:
+                self._write(entries)
+
+    def _write(self, entries):
+        with self._write_lock:
+            states = [(e, e.doc.save_state()) for e in entries]
+            now = datetime.datetime.utcnow()
+            db = None
+            written = []
+            try:
+                db = database.get_pool().acquire()
+                db.execute('BEGIN IMMEDIATE')
+                notebook_ids = set()
+                for entry, (base, content) in states:
+                    note_id = entry.doc.note_id
+                    if content == base:
+                        continue           # unchanged
+                    # Compare-and-set: only over the text the document was based on
+                    cur = db.execute('UPDATE notes SET content=?, updated_at=? WHERE id=? AND content=?',
+                                     (content, now.isoformat(), note_id, base))
+                    if cur.rowcount == 0:
+                        # Deleted, or written directly; the document reloads when that write is announced
+                        self.conflicts += 1
+                        log.warning('Autosave skipped, note changed underneath', note_id=note_id)
+                        continue
+                    notebook_id = db.execute('SELECT notebook_id FROM notes WHERE id=?', (note_id,)).fetchone()[0]
+                    record_revision(db, note_id, base, content, user_id=entry.user_id, timestamp=now.isoformat())
+                    notebook_ids.add(notebook_id)
+                    # Inline: it commits (or rolls back) with the note it describes
+                    database.record_contribution(db, note_id, entry.user_id, 'Edited note',
+                                                 f"Live edit ({entry.edits} changes)", now.isoformat(' ', 'seconds'))
+                    written.append((entry, base, content))
+                db.commit()
+            except Exception as e:
+                self.failed += len(entries)
+                log.error('Autosave failed', notes=len(entries), error=str(e))
+                if db is not None and db.in_transaction:
+                    db.rollback()
+                # Keep them dirty so the next round retries
+                with self._lock:
+                    for entry in entries:
+                        self._dirty.setdefault(entry.doc.note_id, entry)
+                return
+            finally:
+                if db is not None:
+                    db.close()
+
+            for entry, base, content in written:
+                entry.doc.mark_saved(base, content)
+            for notebook_id in notebook_ids:
+                invalidate_summary(notebook_id)
+            self.flushes += 1
+            # Only rows actually updated; unchanged and conflicting notes wrote nothing
+            if written:
+                lag = (time.monotonic() - min(entry.first_edit for entry, _, _ in written)) * 1000
+                self.notes_written += len(written)
+                self.edits_coalesced += sum(entry.edits for entry, _, _ in written)
+                self.last_flush_lag_ms = lag
+                self.max_flush_lag_ms = max(self.max_flush_lag_ms, lag)
+
+
+autosave = AutosaveBuffer()
@@ -0,0 +1,437 @@
+"""
+Load and latency benchmark of the NoteBridge routes.
+
+Seeds a synthetic dataset into a temporary database, drives the real routes
+through the Flask test client (one logged-in client per thread) and the live
+update paths through Socket.IO and SSE clients, then reports p50/p95/p99
+latency, throughput and SQL statements per request.
+
+    python bench_app.py                                  # default scale
+    python bench_app.py --scale 4 --requests 400         # bigger dataset, more samples
+    python bench_app.py --save bench_baseline.json       # record a baseline
+    python bench_app.py --baseline bench_baseline.json   # compare; exit 1 on regressions
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from werkzeug.security import generate_password_hash
+from app import app, socketio
+import database
+from database import get_db, init_db
+from contributions import contributions_writer
+from autosave import autosave
+from broker import event_broker
+from notebooks import notify_notebook_change
+from bench_summarizer import synthetic_text
+
+PASSWORD = 'bench'
+# Words synthetic_text() writes, used as search queries and tags
+TERMS = ('lecture', 'theorem', 'formula', 'exam', 'model', 'research', 'student', 'summary', 'voice', 'proof')
+
+# -----------------------------
+# Synthetic dataset
+# -----------------------------
+# Per unit of --scale; users and groups scale, the per-user shape does not
+SCALE = {
+    'users': 50,
+    'groups': 10,
+    'notebooks_per_user': 4,
+    'notes_per_notebook': 10,
+    'comments_per_note': 3,
+    'contributions_per_note': 5,
+    'tags_per_note': 2,
+    'note_kb': 2,
+}
+
+
+def seed(db, scale=1.0, rng_seed=0):
+    """
+    Fill an empty database; returns {user_id: {'notebooks': [...], 'notes': [...]}}
+    for the routes to pick from. Half the notebooks are shared, and every user
+    is in one or two groups, so dashboards and feeds see other users' data.
+    """
+    rng = random.Random(rng_seed)
+    n_users = max(2, int(SCALE['users'] * scale))
+    n_groups = max(1, int(SCALE['groups'] * scale))
+    now = datetime.datetime.utcnow()
+
+    def ts(days_ago):
+        return (now - datetime.timedelta(days=days_ago)).isoformat(' ', 'seconds')
+
+    password_hash = generate_password_hash(PASSWORD)
+    db.executemany(
+        'INSERT INTO users (username, password_hash, full_name, created_at) VALUES (?, ?, ?, ?)',
+        [(f'bench{i}', password_hash, f'Bench User {i}', ts(365)) for i in range(n_users)]
+    )
+    user_ids = [row[0] for row in db.execute('SELECT id FROM users ORDER BY id')]
+    db.executemany(
+        'INSERT INTO groups (name, description, created_at) VALUES (?, ?, ?)',
+        [(f'Study group {i}', 'Synthetic benchmark group', ts(300)) for i in range(n_groups)]
+    )
+    group_ids = [row[0] for row in db.execute('SELECT id FROM groups ORDER BY id')]
+    db.executemany(
+        'INSERT INTO group_members (group_id, user_id, role, joined_at) VALUES (?, ?, ?, ?)',
+        [(group_id, user_id, 'member', ts(200))
+         for user_id in user_ids
+         for group_id in rng.sample(group_ids, min(len(group_ids), rng.randint(1, 2)))]
+    )
+
+    dataset = {user_id: {'notebooks': [], 'notes': []} for user_id in user_ids}
+    note_mb = SCALE['note_kb'] / 1024
+    for user_id in user_ids:
+        for n in range(SCALE['notebooks_per_user']):
+            cur = db.execute(
+                'INSERT INTO notebooks (owner_id, title, description, created_at, is_shared) VALUES (?, ?, ?, ?, ?)',
+                (user_id, f'Notebook {n} of user {user_id}', 'Synthetic', ts(rng.uniform(0, 180)), n % 2)
+            )
+            notebook_id = cur.lastrowid
+            dataset[user_id]['notebooks'].append(notebook_id)
+            for k in range(SCALE['notes_per_notebook']):
+                created = rng.uniform(0, 180)
+                cur = db.execute(
+                    '''
+                    INSERT INTO notes (notebook_id, title, content, created_by, created_at, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ''',
+                    (notebook_id, f'Note {k}', synthetic_text(note_mb, seed=rng.random()), user_id,
+                     ts(created), ts(created / 2))
+                )
+                note_id = cur.lastrowid
+                dataset[user_id]['notes'].append(note_id)
+                db.executemany(
+                    'INSERT INTO comments (note_id, user_id, content, timestamp) VALUES (?, ?, ?, ?)',
+                    [(note_id, rng.choice(user_ids), 'Synthetic comment', ts(rng.uniform(0, created)))
+                     for _ in range(SCALE['comments_per_note'])]
+                )
+                db.executemany(
+                    'INSERT INTO contributions (note_id, user_id, action, detail, timestamp) VALUES (?, ?, ?, ?, ?)',
+                    [(note_id, user_id, 'Edited note', f'Title: Note {k}', ts(rng.uniform(0, created)))
+                     for _ in range(SCALE['contributions_per_note'])]
+                )
+                db.executemany(
+                    'INSERT INTO tags (note_id, tag) VALUES (?, ?)',
+                    [(note_id, tag) for tag in rng.sample(TERMS, SCALE['tags_per_note'])]
+                )
+    db.commit()
+    return dataset
+
+
+# -----------------------------
+# SQL statements per request
+# -----------------------------
+# Statements run through pooled connections are reported to the thread running
+# them, so a request thread's count is exactly the statements of its requests.
+# Like metrics.py this counts what the app executes, not the FTS5 shadow-table
+# and trigger statements SQLite runs underneath.
+_counter = threading.local()
+
+
+@database.on_statement
+def _count_statement(sql, seconds):
+    _counter.queries = getattr(_counter, 'queries', 0) + 1
+
+
+def _queries():
+    return getattr(_counter, 'queries', 0)
+
+
+# -----------------------------
+# Measurement
+# -----------------------------
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, max(0, math.ceil(p / 100 * len(sorted_values)) - 1))]
+
+
+def summarize_samples(latencies_ms, queries, wall_s, errors=0):
+    latencies_ms = sorted(latencies_ms)
+    return {
+        'n': len(latencies_ms),
+        'p50_ms': round(percentile(latencies_ms, 50), 2),
+        'p95_ms': round(percentile(latencies_ms, 95), 2),
+        'p99_ms': round(percentile(latencies_ms, 99), 2),
+        'max_ms': round(latencies_ms[-1], 2) if latencies_ms else 0.0,
+        'throughput_rps': round(len(latencies_ms) / wall_s, 1) if wall_s > 0 else 0.0,
+        'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+        'errors': errors,
+    }
+
+
+def _login(client, user_id):
+    resp = client.post('/login', data={'username': f'bench{user_id - 1}', 'password': PASSWORD})
+    if resp.status_code != 302:
+        raise RuntimeError(f'login of bench user {user_id} failed ({resp.status_code})')
+    return client
+
+
+# Each route: name -> fn(client, mine, rng, step) returning the response.
+# mine is the client user's {'notebooks', 'notes'} from seed().
+ROUTES = {
+    'dashboard': lambda c, mine, rng, i: c.get('/dashboard'),
+    'view_note': lambda c, mine, rng, i: c.get(f"/notebook/note/{rng.choice(mine['notes'])}"),
+    'search_notebooks': lambda c, mine, rng, i: c.get(
+        f"/notebook/search_notebooks?query={rng.choice(TERMS)}+{rng.choice(TERMS)}"),
+    'summarize_notebook': lambda c, mine, rng, i: c.get(f"/notebook/{rng.choice(mine['notebooks'])}/summarize"),
+    'create_note': lambda c, mine, rng, i: c.post('/notebook/note/create', data={
+        'notebook_id': str(rng.choice(mine['notebooks'])), 'title': f'Bench note {i}',
+        'content': synthetic_text(SCALE['note_kb'] / 1024, seed=rng.random())}),
+    'update_note': lambda c, mine, rng, i: c.put(f"/notebook/note/{mine['notes'][i % len(mine['notes'])]}", json={
+        'content': synthetic_text(SCALE['note_kb'] / 1024, seed=i) + f' Revision {i}.'}),
+    'contributions': lambda c, mine, rng, i: c.get('/notebook/contributions?limit=50'),
+}
+
+
+def bench_route(name, clients, dataset, requests, warmup):
+    """Run one route from every client in parallel; requests is the total over all clients."""
+    fn = ROUTES[name]
+    per_client = max(1, requests // len(clients))
+    latencies, queries, errors = [], [], []
+    lock = threading.Lock()
+    start_line = threading.Barrier(len(clients) + 1)
+
+    def worker(user_id, client, seed_):
+        rng = random.Random(seed_)
+        mine = dataset[user_id]
+        for i in range(warmup):
+            fn(client, mine, rng, -1 - i)
+        mine_lat, mine_q, mine_err = [], [], 0
+        start_line.wait()
+        for i in range(per_client):
+            before = _queries()
+            t0 = time.perf_counter()
+            resp = fn(client, mine, rng, i)
+            mine_lat.append((time.perf_counter() - t0) * 1000)
+            mine_q.append(_queries() - before)
+            mine_err += resp.status_code >= 400
+            resp.close()
+        with lock:
+            latencies.extend(mine_lat)
+            queries.extend(mine_q)
+            errors.append(mine_err)
+
+    threads = [threading.Thread(target=worker, args=(user_id, client, n), daemon=True)
+               for n, (user_id, client) in enumerate(clients)]
+    for t in threads:
+        t.start()
+    start_line.wait()
+    t0 = time.perf_counter()
+    for t in threads:
+        t.join()
+    return summarize_samples(latencies, queries, time.perf_counter() - t0, sum(errors))
+
+
+def bench_socketio_fanout(client, note_id, editors, rounds):
+    """
+    editors Socket.IO clients edit one note in turn; a round lasts from the
+    edit until every other editor has received the rebased operation.
+    """
+    clients = [socketio.test_client(app, flask_test_client=client) for _ in range(editors)]
+    try:
+        for c in clients:
+            c.emit('join_note', {'note_id': note_id})
+        length = len(next(m for m in clients[0].get_received() if m['name'] == 'doc')['args'][0]['content'])
+        for c in clients[1:]:
+            c.get_received()
+        latencies, missed = [], 0
+        t_start = time.perf_counter()
+        for rev in range(rounds):
+            sender = clients[rev % editors]
+            t0 = time.perf_counter()
+            sender.emit('edit', {'note_id': note_id, 'rev': rev, 'op': [length, 'x']})
+            for c in clients:
+                got = c.get_received()
+                if c is not sender and not any(m['name'] == 'update' for m in got):
+                    missed += 1
+            latencies.append((time.perf_counter() - t0) * 1000)
+            length += 1
+        return summarize_samples(latencies, [], time.perf_counter() - t_start, missed)
+    finally:
+        for c in clients:
+            c.disconnect()
+
+
+def bench_sse_fanout(client, notebook_id, subscribers, events, timeout=30):
+    """
+    subscribers clients stream /notebook/<id>/subscribe; every event published
+    is timed from notify_notebook_change to its arrival at each stream.
+    """
+    cookie = client.get_cookie('session')
+    sent, received = {}, []
+    lock = threading.Lock()
+
+    def reader():
+        c = app.test_client()
+        c.set_cookie('session', cookie.value)
+        resp = c.get(f'/notebook/{notebook_id}/subscribe', buffered=False)
+        got = 0
+        try:
+            for chunk in resp.response:
+                for line in (chunk.decode() if isinstance(chunk, bytes) else chunk).splitlines():
+                    if line.startswith('data: '):
+                        seq = json.loads(line[6:]).get('seq')
+                        with lock:
+                            received.append((seq, time.perf_counter()))
+                        got += 1
+                if got >= events:
+                    break
+        finally:
+            resp.close()
+
+    threads = [threading.Thread(target=reader, daemon=True) for _ in range(subscribers)]
+    for t in threads:
+        t.start()
+    deadline = time.monotonic() + timeout
+    while event_broker.subscriber_count(notebook_id) < subscribers and time.monotonic() < deadline:
+        time.sleep(0.005)
+
+    t_start = time.perf_counter()
+    for seq in range(events):
+        sent[seq] = time.perf_counter()
+        notify_notebook_change(notebook_id, {'action': 'bench', 'seq': seq})
+        time.sleep(0.001)          # stay under the per-subscriber queue limit
+    for t in threads:
+        t.join(max(0.0, deadline - time.monotonic()))
+    latencies = [(at - sent[seq]) * 1000 for seq, at in received if seq in sent]
+    return summarize_samples(latencies, [], time.perf_counter() - t_start,
+                             subscribers * events - len(latencies))
+
+
+# -----------------------------
+# Baselines
+# -----------------------------
+def compare(results, baseline, tolerance, floor_ms=1.0):
+    """
+    Regressions of results against a saved baseline: p95 or p99 slower by more
+    than tolerance (and by floor_ms), throughput lower by more than tolerance,
+    more SQL statements per request, or new errors.
+    """
+    regressions = []
+    for name, now in results.items():
+        then = baseline.get('results', {}).get(name)
+        if then is None:
+            continue
+        # p99 of fewer than 100 samples is just the slowest one
+        for key in ('p95_ms', 'p99_ms') if now['n'] >= 100 else ('p95_ms',):
+            if now[key] > then[key] * (1 + tolerance) and now[key] - then[key] > floor_ms:
+                regressions.append(f"{name}: {key} {then[key]} -> {now[key]}")
+        if now['throughput_rps'] < then['throughput_rps'] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {then['throughput_rps']} -> {now['throughput_rps']} req/s")
+        if (now['queries_per_request'] is not None and then.get('queries_per_request') is not None
+                and now['queries_per_request'] > then['queries_per_request'] + 0.5):
+            regressions.append(f"{name}: queries/request {then['queries_per_request']} -> {now['queries_per_request']}")
+        if now['errors'] > then.get('errors', 0):
+            regressions.append(f"{name}: errors {then.get('errors', 0)} -> {now['errors']}")
+    return regressions
+
+
+def print_report(results, baseline=None):
+    print(f"{'benchmark':<22}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}{'queries':>9}{'errors':>8}")
+    for name, r in results.items():
+        queries = '-' if r['queries_per_request'] is None else f"{r['queries_per_request']:.1f}"
+        line = (f"{name:<22}{r['n']:>6}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}{r['p99_ms']:>10.2f}"
+                f"{r['throughput_rps']:>10.1f}{queries:>9}{r['errors']:>8}")
+        then = (baseline or {}).get('results', {}).get(name)
+        if then and then['p95_ms']:
+            line += f"   p95 {100 * (r['p95_ms'] / then['p95_ms'] - 1):+.0f}%"
+        print(line)
+
+
+# -----------------------------
+# Main
+# -----------------------------
+def run(args):
+    tmpdir = tempfile.mkdtemp(prefix='notebridge-bench-')
+    database.close_pools()
+    database.DATABASE = app.config['DATABASE'] = os.path.join(tmpdir, 'bench.db')
+    app.config['TESTING'] = True
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    try:
+        with app.app_context():
+            db = get_db()
+            init_db(db)
+            t0 = time.perf_counter()
+            dataset = seed(db, args.scale, args.seed)
+            counts = {t: db.execute(f'SELECT COUNT(*) FROM {t}').fetchone()[0]
+                      for t in ('users', 'notebooks', 'notes', 'comments', 'contributions')}
+        print(f"Seeded {', '.join(f'{n} {t}' for t, n in counts.items())} "
+              f"in {time.perf_counter() - t0:.1f} s (scale {args.scale})")
+
+        user_ids = sorted(dataset)[:args.concurrency]
+        clients = [(user_id, _login(app.test_client(), user_id)) for user_id in user_ids]
+        results = {}
+        with quiet:
+            for name in args.routes:
+                results[name] = bench_route(name, clients, dataset, args.requests, args.warmup)
+            user_id, client = clients[0]
+            results['socketio_fanout'] = bench_socketio_fanout(
+                client, dataset[user_id]['notes'][0], args.editors, args.requests)
+            results['sse_fanout'] = bench_sse_fanout(
+                client, dataset[user_id]['notebooks'][0], args.subscribers, args.events)
+            autosave.flush()
+            contributions_writer.flush()
+        return results
+    finally:
+        database.close_pools()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scale', type=float, default=1.0, help='dataset size multiplier')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--requests', type=int, default=200, help='requests per route (all clients)')
+    parser.add_argument('--concurrency', type=int, default=4, help='parallel logged-in clients')
+    parser.add_argument('--warmup', type=int, default=3, help='unmeasured requests per client and route')
+    parser.add_argument('--editors', type=int, default=8, help='Socket.IO clients editing one note')
+    parser.add_argument('--subscribers', type=int, default=16, help='SSE streams on one notebook')
+    parser.add_argument('--events', type=int, default=50, help='SSE events to publish')
+    parser.add_argument('--routes', nargs='+', default=list(ROUTES), choices=list(ROUTES))
+    parser.add_argument('--save', metavar='FILE', help='write the results as a baseline')
+    parser.add_argument('--baseline', metavar='FILE', help='compare against a saved baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown before flagging')
+    parser.add_argument('--verbose', action='store_true', help="keep the app's own log output")
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({
+                'created_at': datetime.datetime.utcnow().isoformat(' ', 'seconds'),
+                'python': platform.python_version(),
+                'settings': {k: getattr(args, k) for k in ('scale', 'seed', 'requests', 'concurrency',
+                                                          'editors', 'subscribers', 'events')},
+                'results': results,
+            }, f, indent=2)
+        print(f"Baseline saved to {args.save}")
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        for line in regressions:
+            print(f"[WARN] Regression: {line}")
+        if regressions:
+            return 1
+        print("No regressions against the baseline.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,65 @@
+"""
+Benchmark of the extractive summarizer against the previous implementation.
+
+    python bench_summarizer.py              # 1, 5, 10 and 25 MB notebooks
+    python bench_summarizer.py 50           # custom sizes in MB
+"""
+import random
+import re
+import sys
+import time
+from summarizer import summarize
+
+_WORDS = ('note lecture chapter review exam topic formula theorem proof example '
+          'method result model data value error function system process student '
+          'class group share voice audio summary search question answer research').split()
+
+
+def synthetic_text(size_mb, seed=0):
+    """Random sentences of 6-25 words, roughly size_mb megabytes of text."""
+    rng = random.Random(seed)
+    target = int(size_mb * 1024 * 1024)
+    parts, length = [], 0
+    while length < target:
+        sentence = ' '.join(rng.choice(_WORDS) for _ in range(rng.randint(6, 25)))
+        sentence = sentence.capitalize() + rng.choice('..!?')
+        parts.append(sentence)
+        length += len(sentence) + 1
+    return ' '.join(parts)
+
+
+def legacy_summary(text):
+    """The dict-and-loops summarizer this module replaced, for comparison."""
+    sentences = re.split(r'(?<=[.!?]) +', text)
+    sentences = [s.strip() for s in sentences if s.strip()]
+    if len(sentences) <= 3:
+        return text
+    words = re.findall(r'\w+', text.lower())
+    freq = {}
+    for w in words:
+        if len(w) > 3:
+            freq[w] = freq.get(w, 0) + 1
+    scored = [(sum(freq.get(w, 0) for w in s.lower().split()), s) for s in sentences]
+    return " ".join(s for _, s in sorted(scored, reverse=True)[:5]).strip()
+
+
+def best_of(fn, text, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(text)
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+
+def main(sizes):
+    print(f"{'size':>8}  {'summarize':>12}  {'legacy':>12}")
+    for size in sizes:
+        text = synthetic_text(size)
+        new_ms = best_of(summarize, text)
+        old_ms = best_of(legacy_summary, text, repeat=1)
+        print(f"{size:>6} MB  {new_ms:>9.0f} ms  {old_ms:>9.0f} ms")
+
+
+if __name__ == '__main__':
+    main([float(a) for a in sys.argv[1:]] or [1, 5, 10, 25])
@@ -0,0 +1,234 @@
+import itertools
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from applog import get_logger
+from config import SSE_QUEUE_SIZE, SSE_HISTORY_SIZE, SSE_HISTORY_GRACE, SSE_REPLAY_MAX_CHARS
+
+log = get_logger('broker')
+
+# -----------------------------
+# In-process pub/sub for Server-Sent Events
+# -----------------------------
+# Event ids come from one counter seeded with the start time in ms, so they
+# keep increasing across restarts and a Last-Event-ID from a previous run can
+# be told apart from one this process handed out. With a cross-worker event
+# bus the bus assigns the ids instead (see continue_after).
+
+
+class Event:
+    __slots__ = ('id', 'data')
+
+    def __init__(self, event_id, data):
+        self.id = event_id
+        self.data = data
+
+
+# Sent to a client whose Last-Event-ID is older than the replay buffer
+RESYNC = {'action': 'resync'}
+
+
+def _replay_data(data, max_chars):
+    """
+    Copy of an event's data for the replay buffer: values longer than
+    max_chars (note content) are left out and their keys listed in 'omitted',
+    so a replaying client knows to fetch them.
+    """
+    if not isinstance(data, dict):
+        return data
+    kept, omitted = {}, []
+    for key, value in data.items():
+        if isinstance(value, str) and len(value) > max_chars:
+            omitted.append(key)
+        else:
+            kept[key] = value
+    if omitted:
+        kept['omitted'] = omitted
+    return kept
+
+
+# Seconds between checks of a subscription's queue when waiting cooperatively
+POLL_INTERVAL = 0.05
+
+
+class Subscription:
+    """One client's bounded queue on a channel; get() waits until an event or the timeout."""
+
+    def __init__(self, channel, max_queue, sleep=None):
+        self.channel = channel
+        self.max_queue = max_queue
+        self.closed = False
+        self._queue = queue.Queue()
+        self._sleep = sleep
+
+    def get(self, timeout=None):
+        """Next Event, or None on timeout or once the subscription was closed."""
+        if self.closed:
+            return None
+        if self._sleep is None:
+            try:
+                return self._queue.get(timeout=timeout)
+            except queue.Empty:
+                return None
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            try:
+                return self._queue.get_nowait()
+            except queue.Empty:
+                pass
+            if self.closed or (deadline is not None and time.monotonic() >= deadline):
+                return None
+            self._sleep(POLL_INTERVAL)
+
+    def _close(self):
+        self.closed = True
+        # Wake a waiting reader right away instead of at its next heartbeat
+        self._queue.put(None)
+
+
+class EventBroker:
+    """
+    Fans events out to the subscribers of a channel (a notebook id).
+    Each subscriber has a bounded queue; one that falls max_queue events
+    behind is evicted so a stalled client cannot hold memory or slow others.
+    The last history events per channel are kept, without their large
+    values, for Last-Event-ID replay, and forgotten once the channel has had
+    no subscriber for grace seconds.
+    """
+
+    def __init__(self, max_queue=SSE_QUEUE_SIZE, history=SSE_HISTORY_SIZE, grace=SSE_HISTORY_GRACE,
+                 replay_max_chars=SSE_REPLAY_MAX_CHARS):
+        self.max_queue = max_queue
+        self.history = history
+        self.grace = grace
+        self.replay_max_chars = replay_max_chars
+        # Set to socketio.sleep under eventlet, where a blocking queue wait
+        # would stall every greenlet; subscribers then poll and yield instead
+        self.sleep = None
+        self._lock = threading.Lock()
+        self._first_id = int(time.time() * 1000)
+        self._ids = itertools.count(self._first_id)
+        self._last_id = self._first_id - 1
+        self._subscribers = {}           # channel -> set of Subscription
+        self._history = {}               # channel -> deque of Event
+        self._dropped = {}               # channel -> id of the newest event pushed out of history
+        self._idle = OrderedDict()       # channel with history but no subscriber -> monotonic time since
+        self._expired_id = 0             # newest event id of any history forgotten as idle
+        self.published = 0
+        self.evicted = 0
+
+    def continue_after(self, last_id):
+        """Take event ids from an external source (the event bus) whose last issued id is last_id."""
+        with self._lock:
+            self._first_id = last_id + 1
+            self._last_id = last_id
+
+    def publish(self, channel, data, event_id=None):
+        """Send data to every subscriber of channel; returns the event id."""
+        with self._lock:
+            event = Event(next(self._ids) if event_id is None else event_id, data)
+            self._last_id = max(self._last_id, event.id)
+            self._expire_idle()
+            history = self._history.get(channel)
+            if history is None:
+                history = self._history[channel] = deque()
+                # The channel may have had a history forgotten as idle
+                self._dropped[channel] = self._expired_id
+            if len(history) >= self.history:
+                self._dropped[channel] = history.popleft().id
+            history.append(Event(event.id, _replay_data(data, self.replay_max_chars)))
+            if channel not in self._subscribers and channel not in self._idle:
+                self._idle[channel] = time.monotonic()
+            for sub in list(self._subscribers.get(channel, ())):
+                if sub._queue.qsize() >= sub.max_queue:
+                    self._evict(sub)
+                else:
+                    sub._queue.put(event)
+            self.published += 1
+        return event.id
+
+    def subscribe(self, channel, last_event_id=None):
+        """
+        Register a subscriber. With last_event_id, events newer than it are
+        queued first; if some were already forgotten, a RESYNC event is queued
+        instead so the client reloads.
+        """
+        sub = Subscription(channel, self.max_queue, self.sleep)
+        with self._lock:
+            self._expire_idle()
+            self._idle.pop(channel, None)
+            last_id = _parse_id(last_event_id)
+            if last_id is not None:
+                if last_id < self._first_id - 1 or last_id < self._dropped.get(channel, self._expired_id):
+                    # Carries the newest id, so the next reconnect resumes from here
+                    sub._queue.put(Event(self._last_id, RESYNC))
+                else:
+                    missed = [e for e in self._history.get(channel, ()) if e.id > last_id]
+                    for event in missed[-self.max_queue:]:
+                        sub._queue.put(event)
+            self._subscribers.setdefault(channel, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            subs = self._subscribers.get(sub.channel)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    self._channel_left(sub.channel)
+        sub.closed = True
+
+    def subscriber_count(self, channel=None):
+        with self._lock:
+            if channel is not None:
+                return len(self._subscribers.get(channel, ()))
+            return sum(len(subs) for subs in self._subscribers.values())
+
+    def stats(self):
+        return {
+            'channels': len(self._subscribers),
+            'history_channels': len(self._history),
+            'subscribers': self.subscriber_count(),
+            'published': self.published,
+            'evicted': self.evicted,
+        }
+
+    def _evict(self, sub):
+        # Called with the lock held
+        self._subscribers[sub.channel].discard(sub)
+        if not self._subscribers[sub.channel]:
+            self._channel_left(sub.channel)
+        self.evicted += 1
+        log.warning('Evicted slow SSE subscriber', channel=sub.channel)
+        sub._close()
+
+    def _channel_left(self, channel):
+        # Called with the lock held, when the last subscriber of channel is gone
+        del self._subscribers[channel]
+        if channel in self._history:
+            self._idle[channel] = time.monotonic()
+
+    def _expire_idle(self):
+        # Called with the lock held; _idle is ordered oldest first
+        cutoff = time.monotonic() - self.grace
+        while self._idle:
+            channel, since = next(iter(self._idle.items()))
+            if since > cutoff:
+                break
+            del self._idle[channel]
+            history = self._history.pop(channel, None)
+            dropped = self._dropped.pop(channel, 0)
+            newest = history[-1].id if history else dropped
+            # A reconnect to a forgotten channel that may have missed events must resync
+            self._expired_id = max(self._expired_id, newest)
+
+
+def _parse_id(value):
+    try:
+        return int(value) if value not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+
+event_broker = EventBroker()
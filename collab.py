@@ -0,0 +1,263 @@
+import threading
+from eventbus import invalidate
+from config import COLLAB_HISTORY_SIZE, COLLAB_MAX_NOTE_CHARS
+
+# -----------------------------
+# Text operations
+# -----------------------------
+# An operation is a list of components that walks the whole document once:
+#   n > 0   retain n characters
+#   n < 0   delete -n characters
+#   "text"  insert text
+# e.g. [12, "new ", -3, 40] on a 55-character note. Only the edited span
+# travels over the wire; the rest of the note is two integers.
+
+
+class InvalidOperation(ValueError):
+    """The operation is malformed or does not fit the document it is applied to."""
+
+
+def _components(op):
+    if not isinstance(op, list):
+        raise InvalidOperation('operation must be a list')
+    for c in op:
+        if isinstance(c, bool) or not isinstance(c, (int, str)) or c == 0 or c == '':
+            raise InvalidOperation(f'bad component {c!r}')
+    return op
+
+
+def _push(op, c):
+    """Append a component, merging it with its neighbour of the same kind."""
+    if isinstance(c, str):
+        if op and isinstance(op[-1], str):
+            op[-1] += c
+        elif op and op[-1] < 0:
+            # Inserts go before deletes so equal operations have one spelling
+            if len(op) > 1 and isinstance(op[-2], str):
+                op[-2] += c
+            else:
+                op.insert(len(op) - 1, c)
+        else:
+            op.append(c)
+    elif op and isinstance(op[-1], int) and (op[-1] > 0) == (c > 0):
+        op[-1] += c
+    else:
+        op.append(c)
+
+
+def normalize(components):
+    """Build an operation from components in walk order, dropping empty ones."""
+    op = []
+    for c in components:
+        if c:
+            _push(op, c)
+    return op
+
+
+def base_length(op):
+    return sum(abs(c) for c in op if isinstance(c, int))
+
+
+def apply(text, op):
+    """Apply op to text and return the new text."""
+    if base_length(_components(op)) != len(text):
+        raise InvalidOperation(f'operation expects {base_length(op)} characters, note has {len(text)}')
+    parts, pos = [], 0
+    for c in op:
+        if isinstance(c, str):
+            parts.append(c)
+        elif c > 0:
+            parts.append(text[pos:pos + c])
+            pos += c
+        else:
+            pos -= c
+    return ''.join(parts)
+
+
+def transform(a, b):
+    """
+    Transform two concurrent operations on the same text. Returns (a2, b2)
+    such that apply(apply(t, a), b2) == apply(apply(t, b), a2). When both
+    insert at the same place, a's text ends up first.
+    """
+    if base_length(_components(a)) != base_length(_components(b)):
+        raise InvalidOperation('concurrent operations must start from the same text')
+    a2, b2 = [], []
+    ia, ib = iter(a), iter(b)
+    ca, cb = next(ia, None), next(ib, None)
+    while ca is not None or cb is not None:
+        if isinstance(ca, str):
+            _push(a2, ca)
+            _push(b2, len(ca))
+            ca = next(ia, None)
+            continue
+        if isinstance(cb, str):
+            _push(a2, len(cb))
+            _push(b2, cb)
+            cb = next(ib, None)
+            continue
+        n = min(abs(ca), abs(cb))
+        if ca > 0 and cb > 0:
+            _push(a2, n)
+            _push(b2, n)
+        elif ca < 0 and cb > 0:
+            _push(a2, -n)
+        elif ca > 0 and cb < 0:
+            _push(b2, -n)
+        # both delete the same span: nothing left to do for either side
+        ca = _shrink(ca, n) or next(ia, None)
+        cb = _shrink(cb, n) or next(ib, None)
+    return a2, b2
+
+
+def _shrink(c, n):
+    return c - n if c > 0 else c + n
+
+
+# -----------------------------
+# Authoritative documents of notes being edited
+# -----------------------------
+class StaleRevision(Exception):
+    """The client's base revision is too old (or unknown); it must reload the note."""
+
+
+class NoteDocument:
+    """
+    In-memory copy of a note under live editing. Every accepted operation
+    bumps rev; operations based on an older rev are transformed against the
+    ones applied since, which are kept for up to history_size revisions.
+    saved is the text the database holds, as far as this document knows.
+    """
+
+    def __init__(self, note_id, content, history_size=COLLAB_HISTORY_SIZE):
+        self.note_id = note_id
+        self.content = content
+        self.saved = content
+        self.rev = 0
+        self.history_size = history_size
+        self._history = []               # ops for revisions rev-len+1 .. rev
+        self._lock = threading.Lock()
+
+    def receive(self, base_rev, op):
+        """Apply a client operation made against base_rev; returns (new rev, op as applied)."""
+        with self._lock:
+            behind = self.rev - base_rev if isinstance(base_rev, int) else -1
+            if behind < 0 or behind > len(self._history):
+                raise StaleRevision(f'note {self.note_id} is at revision {self.rev}')
+            for past in self._history[len(self._history) - behind:]:
+                op, _ = transform(op, past)
+            content = apply(self.content, op)
+            if len(content) > COLLAB_MAX_NOTE_CHARS:
+                raise InvalidOperation('note is too long')
+            self.content = content
+            self.rev += 1
+            self._history.append(op)
+            if len(self._history) > self.history_size:
+                del self._history[0]
+            return self.rev, op
+
+    def reset(self, content):
+        """Replace the text after a direct write; every editor has to resync."""
+        with self._lock:
+            self.content = self.saved = content
+            self.rev += 1
+            self._history.clear()
+
+    def save_state(self):
+        """(saved, content): what the database should hold, and what it should become."""
+        with self._lock:
+            return self.saved, self.content
+
+    def mark_saved(self, base, content):
+        """content was written over base; ignored if a reset came in between."""
+        with self._lock:
+            if self.saved == base:
+                self.saved = content
+
+    def snapshot(self):
+        with self._lock:
+            return {'note_id': self.note_id, 'rev': self.rev, 'content': self.content}
+
+
+class DocumentRegistry:
+    """
+    Live documents by note id, loaded when the first editor joins a note
+    and dropped when the last one leaves. Socket.IO session ids are tracked,
+    with the user each one joined as, so a disconnect leaves every note the
+    client had joined and edits are only taken from joined sessions.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._documents = {}             # note_id -> NoteDocument
+        self._editors = {}               # note_id -> {sid: user_id}
+        self._joined = {}                # sid -> set of note_ids
+
+    def join(self, note_id, sid, load, user_id=None):
+        """Register sid (as user_id) as an editor of note_id; load() gives the content if not live yet."""
+        with self._lock:
+            doc = self._documents.get(note_id)
+            if doc is not None:
+                return self._add_editor(doc, sid, user_id)
+        # Loaded without the lock, so a slow query does not hold up every other note;
+        # if another editor loaded it meanwhile, theirs is kept
+        loaded = NoteDocument(note_id, load())
+        with self._lock:
+            return self._add_editor(self._documents.setdefault(note_id, loaded), sid, user_id)
+
+    def _add_editor(self, doc, sid, user_id):
+        # Called with the lock held
+        self._editors.setdefault(doc.note_id, {})[sid] = user_id
+        self._joined.setdefault(sid, set()).add(doc.note_id)
+        return doc
+
+    def editor_of(self, note_id, sid):
+        """The user sid joined note_id as, or None if it has not joined it."""
+        with self._lock:
+            return self._editors.get(note_id, {}).get(sid)
+
+    def leave(self, note_id, sid):
+        """Remove sid from a note; returns the document if it was the last editor."""
+        with self._lock:
+            self._joined.get(sid, set()).discard(note_id)
+            editors = self._editors.get(note_id)
+            if editors is None:
+                return None
+            editors.pop(sid, None)
+            if editors:
+                return None
+            del self._editors[note_id]
+            return self._documents.pop(note_id, None)
+
+    def disconnect(self, sid):
+        """Leave every note sid had joined; returns the documents that lost their last editor."""
+        with self._lock:
+            note_ids = self._joined.pop(sid, set())
+        return [doc for doc in (self.leave(note_id, sid) for note_id in note_ids) if doc is not None]
+
+    def get(self, note_id):
+        with self._lock:
+            return self._documents.get(note_id)
+
+    def editor_count(self, note_id):
+        with self._lock:
+            return len(self._editors.get(note_id, ()))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'documents': len(self._documents),
+                'editors': sum(len(sids) for sids in self._editors.values()),
+            }
+
+
+documents = DocumentRegistry()
+
+
+def invalidate_document(note_id):
+    """
+    Call after writing a note's text outside live editing (PUT, restore,
+    grammar correction): every worker holding it live reloads it, rather
+    than letting autosave overwrite the write.
+    """
+    invalidate('document', [note_id])
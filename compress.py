@@ -0,0 +1,223 @@
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from flask import current_app, request
+from werkzeug.security import safe_join
+from werkzeug.wsgi import ClosingIterator
+from metrics import registry
+from config import (COMPRESS_ENABLED, COMPRESS_MIN_SIZE, COMPRESS_LEVEL, COMPRESS_BROTLI_QUALITY,
+                    COMPRESS_STREAMS, COMPRESS_STATIC_CACHE_BYTES)
+
+try:
+    import brotli
+except ImportError:     # optional: gzip and deflate only
+    brotli = None
+
+# -----------------------------
+# Response compression
+# -----------------------------
+# An after_request hook compresses text responses (HTML, JSON, CSS, JS, SSE)
+# with the best encoding the client accepts: br (if brotli is installed),
+# gzip, deflate.
+#   - buffered bodies below COMPRESS_MIN_SIZE are sent as they are
+#   - streamed bodies (SSE, chunked) are compressed chunk by chunk, with a sync
+#     flush after each, so every event still reaches the client at once
+#   - static files are compressed once at the highest level and kept in a
+#     byte-bounded LRU, keyed by path, mtime and size
+# A compressed body is a different representation, so a strong ETag becomes
+# weak; conditional GETs (which compare weakly) keep working.
+COMPRESSIBLE_TYPES = {
+    'text/html', 'text/css', 'text/plain', 'text/javascript', 'text/event-stream', 'text/xml',
+    'application/javascript', 'application/json', 'application/xml', 'image/svg+xml',
+}
+ENCODINGS = ('br', 'gzip', 'deflate') if brotli else ('gzip', 'deflate')
+# zlib wbits for each container: 31 = gzip header, 15 = zlib ("deflate" in HTTP)
+_WBITS = {'gzip': 31, 'deflate': 15}
+
+COMPRESSION_BYTES = registry.counter(
+    'notebridge_http_compression_bytes_total', 'Response body bytes before and after compression.',
+    ('encoding', 'stage'))
+
+
+def _compressor(encoding, level):
+    """Object with compress(data), flush() (sync point) and finish() for one body."""
+    if encoding == 'br':
+        return _BrotliCompressor(level)
+    return _ZlibCompressor(encoding, level)
+
+
+class _ZlibCompressor:
+    def __init__(self, encoding, level):
+        self._obj = zlib.compressobj(level, zlib.DEFLATED, _WBITS[encoding])
+
+    def compress(self, data):
+        return self._obj.compress(data)
+
+    def flush(self):
+        return self._obj.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._obj.flush(zlib.Z_FINISH)
+
+
+class _BrotliCompressor:
+    def __init__(self, quality):
+        self._obj = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self._obj.process(data)
+
+    def flush(self):
+        return self._obj.flush()
+
+    def finish(self):
+        return self._obj.finish()
+
+
+def compress_bytes(data, encoding, level=None):
+    """Compress a whole body; level defaults to COMPRESS_LEVEL (COMPRESS_BROTLI_QUALITY for br)."""
+    if level is None:
+        level = COMPRESS_BROTLI_QUALITY if encoding == 'br' else COMPRESS_LEVEL
+    c = _compressor(encoding, level)
+    return c.compress(data) + c.finish()
+
+
+def _max_level(encoding):
+    return 11 if encoding == 'br' else 9
+
+
+class StaticCache:
+    """Compressed variants of static files, least recently used first, at most max_bytes in total."""
+
+    def __init__(self, max_bytes=COMPRESS_STATIC_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path, encoding):
+        """Compressed contents of the file at path, or None if it cannot be read."""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        key = (path, encoding)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] == (stat.st_mtime_ns, stat.st_size):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+        with open(path, 'rb') as f:
+            data = compress_bytes(f.read(), encoding, _max_level(encoding))
+        with self._lock:
+            self.misses += 1
+            old = self._entries.pop(key, None)
+            if old:
+                self.size -= len(old[1])
+            if len(data) <= self.max_bytes:
+                self._entries[key] = ((stat.st_mtime_ns, stat.st_size), data)
+                self.size += len(data)
+                while self.size > self.max_bytes:
+                    _, (_, evicted) = self._entries.popitem(last=False)
+                    self.size -= len(evicted)
+        return data
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+static_cache = StaticCache()
+registry.collect('notebridge_static_compression_cache_bytes', 'Compressed static files held in memory.',
+                 'gauge', lambda: static_cache.size)
+
+
+def negotiate():
+    """The encoding to use for the current request, or None."""
+    return request.accept_encodings.best_match(ENCODINGS)
+
+
+def _stream(response, encoding):
+    """Compress a streamed body chunk by chunk; closes the original iterable when done."""
+    original = response.response
+    chunks = response.iter_encoded()
+    c = _compressor(encoding, COMPRESS_BROTLI_QUALITY if encoding == 'br' else COMPRESS_LEVEL)
+    bytes_in = COMPRESSION_BYTES.labels(encoding, 'in')
+    bytes_out = COMPRESSION_BYTES.labels(encoding, 'out')
+
+    def generate():
+        for chunk in chunks:
+            if not chunk:
+                continue
+            out = c.compress(chunk) + c.flush()
+            bytes_in.inc(len(chunk))
+            bytes_out.inc(len(out))
+            yield out
+        tail = c.finish()
+        bytes_out.inc(len(tail))
+        yield tail
+
+    # Closed even if the client went away before the first chunk (an SSE stream unsubscribes then)
+    close = getattr(original, 'close', None)
+    return ClosingIterator(generate(), [close] if close else None)
+
+
+def compress_response(response):
+    """after_request hook: compress response if the client and the content allow it."""
+    if response.mimetype not in COMPRESSIBLE_TYPES:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate()
+    if encoding is None:
+        return response
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+
+    if (request.method == 'HEAD' or response.status_code != 200 or 'Content-Encoding' in response.headers
+            or 'no-transform' in (response.headers.get('Cache-Control') or '')):
+        return response
+
+    if request.endpoint == 'static':
+        size = response.content_length or 0
+        path = safe_join(current_app.static_folder, request.view_args['filename'])
+        if size < COMPRESS_MIN_SIZE or path is None:
+            return response
+        data = static_cache.get(path, encoding)
+        if data is None:
+            return response
+        # The file send_file opened is not read any more
+        response.response.close()
+        response.direct_passthrough = False
+        response.set_data(data)
+        # Byte ranges would refer to the uncompressed file
+        response.headers.pop('Accept-Ranges', None)
+        COMPRESSION_BYTES.labels(encoding, 'in').inc(size)
+        COMPRESSION_BYTES.labels(encoding, 'out').inc(len(data))
+    elif response.is_streamed:
+        if not COMPRESS_STREAMS or response.direct_passthrough:
+            return response
+        response.response = _stream(response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        body = response.get_data()
+        if len(body) < COMPRESS_MIN_SIZE:
+            return response
+        data = compress_bytes(body, encoding)
+        response.set_data(data)
+        COMPRESSION_BYTES.labels(encoding, 'in').inc(len(body))
+        COMPRESSION_BYTES.labels(encoding, 'out').inc(len(data))
+
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def init_app(app):
+    """Compress app's responses (no-op when COMPRESS_ENABLED is off)."""
+    if COMPRESS_ENABLED:
+        app.after_request(compress_response)
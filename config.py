@@ -3,3 +3,109 @@ import os
 DATABASE = os.path.join(os.path.dirname(__file__), 'notebridge.db')
 SECRET_KEY = os.environ.get('SECRET_KEY', 'qwerty1234')
 DEBUG = True
+
+# SQLite connection pool settings
+DB_WRITE_POOL_SIZE = int(os.environ.get('DB_WRITE_POOL_SIZE', 4))
+DB_READ_POOL_SIZE = int(os.environ.get('DB_READ_POOL_SIZE', 16))
+# Seconds a request waits for a connection once every one of a pool is checked out
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+DB_BUSY_TIMEOUT_MS = int(os.environ.get('DB_BUSY_TIMEOUT_MS', 5000))
+DB_MMAP_SIZE = int(os.environ.get('DB_MMAP_SIZE', 256 * 1024 * 1024))
+DB_CACHED_STATEMENTS = int(os.environ.get('DB_CACHED_STATEMENTS', 256))
+
+# Write-behind contributions log
+CONTRIBUTIONS_WRITE_BEHIND = os.environ.get('CONTRIBUTIONS_WRITE_BEHIND', '1') == '1'
+CONTRIBUTIONS_BATCH_SIZE = int(os.environ.get('CONTRIBUTIONS_BATCH_SIZE', 200))
+CONTRIBUTIONS_FLUSH_INTERVAL_MS = int(os.environ.get('CONTRIBUTIONS_FLUSH_INTERVAL_MS', 50))
+CONTRIBUTIONS_QUEUE_SIZE = int(os.environ.get('CONTRIBUTIONS_QUEUE_SIZE', 10000))
+# How long the contributions feed waits for rows queued before it was asked for
+CONTRIBUTIONS_READ_WAIT_MS = int(os.environ.get('CONTRIBUTIONS_READ_WAIT_MS', 200))
+
+# Seconds a worker trusts its cached per-user session version before re-reading it
+AUTH_VERSION_TTL = float(os.environ.get('AUTH_VERSION_TTL', 5))
+
+# Per-user dashboard view model cache
+DASHBOARD_CACHE_TTL = float(os.environ.get('DASHBOARD_CACHE_TTL', 30))
+DASHBOARD_CACHE_SIZE = int(os.environ.get('DASHBOARD_CACHE_SIZE', 1024))
+
+# In-memory notebook summary cache (entries, one per notebook)
+SUMMARY_CACHE_SIZE = int(os.environ.get('SUMMARY_CACHE_SIZE', 256))
+
+# Extractive summary length targets (max characters 0 = no limit)
+SUMMARY_MAX_SENTENCES = int(os.environ.get('SUMMARY_MAX_SENTENCES', 5))
+SUMMARY_MAX_CHARS = int(os.environ.get('SUMMARY_MAX_CHARS', 0))
+
+# Text-to-speech worker pool
+TTS_WORKERS = int(os.environ.get('TTS_WORKERS', 2))
+TTS_MAX_PENDING = int(os.environ.get('TTS_MAX_PENDING', 8))
+TTS_TIMEOUT = float(os.environ.get('TTS_TIMEOUT', 30))
+TTS_RATE = int(os.environ.get('TTS_RATE', 170))
+TTS_CHUNK_CHARS = int(os.environ.get('TTS_CHUNK_CHARS', 240))
+TTS_STREAM_LOOKAHEAD = int(os.environ.get('TTS_STREAM_LOOKAHEAD', 2))
+
+# Startup: build lazily loaded NLP resources before serving (0 = on first use)
+WARM_UP_ON_START = os.environ.get('WARM_UP_ON_START', '1') == '1'
+
+# Grammar correction service for voice notes
+GRAMMAR_WORKERS = int(os.environ.get('GRAMMAR_WORKERS', 2))
+GRAMMAR_BATCH_CHARS = int(os.environ.get('GRAMMAR_BATCH_CHARS', 20000))
+GRAMMAR_BATCH_WINDOW_MS = float(os.environ.get('GRAMMAR_BATCH_WINDOW_MS', 25))
+GRAMMAR_CACHE_SIZE = int(os.environ.get('GRAMMAR_CACHE_SIZE', 4096))
+
+# Server-Sent Events: per-subscriber queue, replay buffer per notebook, keep-alive seconds
+SSE_QUEUE_SIZE = int(os.environ.get('SSE_QUEUE_SIZE', 100))
+SSE_HISTORY_SIZE = int(os.environ.get('SSE_HISTORY_SIZE', 200))
+# Seconds a notebook's replay buffer outlives its last subscriber; longer replayed values are left out
+SSE_HISTORY_GRACE = float(os.environ.get('SSE_HISTORY_GRACE', 300))
+SSE_REPLAY_MAX_CHARS = int(os.environ.get('SSE_REPLAY_MAX_CHARS', 256))
+SSE_HEARTBEAT = float(os.environ.get('SSE_HEARTBEAT', 15))
+SSE_RETRY_MS = int(os.environ.get('SSE_RETRY_MS', 3000))
+
+# Event bus between worker processes: 'local' (one worker) or 'sqlite' (several on one machine)
+EVENT_BUS = os.environ.get('EVENT_BUS', 'local')
+EVENT_BUS_PATH = os.environ.get('EVENT_BUS_PATH', os.path.join(os.path.dirname(__file__), 'notebridge-bus.db'))
+EVENT_BUS_POLL_MS = float(os.environ.get('EVENT_BUS_POLL_MS', 20))
+EVENT_BUS_RETENTION = float(os.environ.get('EVENT_BUS_RETENTION', 60))
+
+# Live collaborative editing: operations kept for rebasing, largest note accepted
+COLLAB_HISTORY_SIZE = int(os.environ.get('COLLAB_HISTORY_SIZE', 500))
+COLLAB_MAX_NOTE_CHARS = int(os.environ.get('COLLAB_MAX_NOTE_CHARS', 2_000_000))
+
+# Autosave of live-edited notes: write after edits pause, or at most this long after the first
+AUTOSAVE_DEBOUNCE_MS = float(os.environ.get('AUTOSAVE_DEBOUNCE_MS', 2000))
+AUTOSAVE_MAX_DELAY_MS = float(os.environ.get('AUTOSAVE_MAX_DELAY_MS', 10000))
+
+# Note revision history: a full snapshot every N revisions (deltas in between), and what is kept
+REVISION_SNAPSHOT_EVERY = int(os.environ.get('REVISION_SNAPSHOT_EVERY', 25))
+REVISION_MAX_PER_NOTE = int(os.environ.get('REVISION_MAX_PER_NOTE', 1000))
+REVISION_RETENTION_DAYS = float(os.environ.get('REVISION_RETENTION_DAYS', 180))
+
+# Prometheus metrics at /metrics; with a token set, scrapers must send "Authorization: Bearer <token>",
+# without one only requests from localhost are answered
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# SQL tracer (opt-in): per-request statement report in an X-SQL-Trace header and the log
+SQL_TRACE = os.environ.get('SQL_TRACE', '0') == '1'
+SQL_TRACE_EXPLAIN = os.environ.get('SQL_TRACE_EXPLAIN', '1') == '1'
+SQL_TRACE_REPEAT_THRESHOLD = int(os.environ.get('SQL_TRACE_REPEAT_THRESHOLD', 5))
+
+# Logging: level, 'text' or 'json' lines, records buffered before the writer thread drops new ones
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+# Only every Nth live-edit operation is logged
+LOG_EDIT_SAMPLE = int(os.environ.get('LOG_EDIT_SAMPLE', 100))
+
+# Part of every ETag; defaults to a fingerprint of the templates so a deploy invalidates cached pages
+ETAG_BUILD_ID = os.environ.get('ETAG_BUILD_ID', '')
+
+# Response compression (gzip/deflate, brotli when installed) of text bodies of at least COMPRESS_MIN_SIZE bytes
+COMPRESS_ENABLED = os.environ.get('COMPRESS_ENABLED', '1') == '1'
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 500))
+COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL', 6))
+COMPRESS_BROTLI_QUALITY = int(os.environ.get('COMPRESS_BROTLI_QUALITY', 4))
+# Streamed responses (SSE) are compressed too, flushed after every chunk
+COMPRESS_STREAMS = os.environ.get('COMPRESS_STREAMS', '1') == '1'
+# Compressed static files are kept in memory, up to this many bytes
+COMPRESS_STATIC_CACHE_BYTES = int(os.environ.get('COMPRESS_STATIC_CACHE_BYTES', 16 * 1024 * 1024))
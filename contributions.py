@@ -0,0 +1,191 @@
+import datetime
+import queue
+import threading
+import time
+import database
+from applog import get_logger
+from config import (CONTRIBUTIONS_BATCH_SIZE, CONTRIBUTIONS_FLUSH_INTERVAL_MS,
+                    CONTRIBUTIONS_QUEUE_SIZE)
+
+log = get_logger('contributions')
+
+# -----------------------------
+# Write-behind Contributions Log
+# -----------------------------
+# Rows whose note was deleted before the batch landed are kept, detached from
+# it (note_id NULL) like the rest of its history, rather than failing the whole
+# batch on the foreign key.
+INSERT_SQL = '''
+    INSERT INTO contributions (note_id, user_id, action, detail, timestamp)
+    VALUES ((SELECT id FROM notes WHERE id=?), ?, ?, ?, ?)
+'''
+# Queued by flush() while the thread runs: write everything before it now
+_FLUSH = object()
+
+
+class ContributionsWriter:
+    """
+    Background writer that group-commits contributions rows.
+    Events are queued by request handlers and written with executemany in one
+    transaction once batch_size events are waiting or interval_ms has passed.
+    Rows are written in the order they were submitted.
+    """
+
+    # Waits in flush(timeout=...) poll with this; the app makes it cooperative
+    sleep = staticmethod(time.sleep)
+
+    def __init__(self, batch_size=CONTRIBUTIONS_BATCH_SIZE,
+                 interval_ms=CONTRIBUTIONS_FLUSH_INTERVAL_MS,
+                 max_queue=CONTRIBUTIONS_QUEUE_SIZE):
+        self.batch_size = batch_size
+        self.interval = interval_ms / 1000
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._submit_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._submitted = 0              # rows queued so far
+        self._done = 0                   # of those, rows whose batch has been written (or failed)
+        self._stop = threading.Event()
+        self._thread = None
+        self.batches = 0
+        self.written = 0
+        self.failed = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start the background flush thread (no-op if already running)."""
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='contributions-writer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the flush thread after writing everything still queued."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def submit(self, note_id, user_id, action, detail, timestamp=None):
+        """Queue one contribution; blocks only when the queue is full."""
+        if timestamp is None:
+            timestamp = datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        # Counted in queue order, so the first n rows written are the first n counted
+        with self._submit_lock:
+            self._queue.put((note_id, user_id, action, detail, timestamp))
+            self._submitted += 1
+
+    def flush(self, timeout=None):
+        """
+        Write every row queued before the call, including batches already in
+        flight; rows queued meanwhile are not waited for. With a timeout (in
+        seconds) gives up after it; returns whether the rows were written.
+        """
+        target = self._submitted
+        if self._done >= target:
+            return True
+        if self.running:
+            # Writing from here could land rows ahead of the batch the thread
+            # is still collecting; have the thread write it now instead
+            self._queue.put(_FLUSH)
+        else:
+            batch = self._drain()
+            if batch:
+                self._write(batch)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._done < target:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            self.sleep(0.005)
+        return True
+
+    def stats(self):
+        return {
+            'queue_depth': self._queue.qsize(),
+            'batches': self.batches,
+            'written': self.written,
+            'failed': self.failed,
+            'last_flush_ms': round(self.last_flush_ms, 3),
+            'max_flush_ms': round(self.max_flush_ms, 3),
+        }
+
+    def _drain(self, limit=None, batch=None, deadline=None):
+        batch = batch if batch is not None else []
+        while limit is None or len(batch) < limit:
+            try:
+                if deadline is None:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+            if batch[-1] is _FLUSH:
+                batch.pop()
+                self._queue.task_done()
+                if deadline is not None:
+                    break
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                first = self._queue.get(timeout=self.interval)
+            except queue.Empty:
+                continue
+            if first is _FLUSH:
+                self._queue.task_done()
+                continue
+            batch = self._drain(self.batch_size, [first], time.monotonic() + self.interval)
+            self._write(batch)
+
+    def _write(self, batch):
+        with self._write_lock:
+            start = time.perf_counter()
+            db = None
+            try:
+                db = database.get_pool().acquire()
+                # Take the write lock before reading so rows of a request
+                # transaction that is still open are seen once it commits
+                db.execute('BEGIN IMMEDIATE')
+                written = db.executemany(INSERT_SQL, batch).rowcount
+                db.commit()
+                self.written += written
+            except Exception as e:
+                self.failed += len(batch)
+                log.error('Contributions write failed', rows=len(batch), error=str(e))
+            finally:
+                if db is not None:
+                    db.close()
+                elapsed = (time.perf_counter() - start) * 1000
+                self.batches += 1
+                self.last_flush_ms = elapsed
+                self.max_flush_ms = max(self.max_flush_ms, elapsed)
+                self._done += len(batch)
+                for _ in batch:
+                    self._queue.task_done()
+
+
+contributions_writer = ContributionsWriter()
+
+
+def log_contribution(db, note_id, user_id, action, detail, timestamp=None):
+    """
+    Log a contribution through the background writer, or inline on db if it
+    is not running. Inside a unit of work the row is only queued once the
+    transaction commits, so a rolled-back change leaves no trace in the log.
+    """
+    if contributions_writer.running:
+        if timestamp is None:
+            timestamp = datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        database.after_commit(lambda: contributions_writer.submit(note_id, user_id, action, detail, timestamp))
+    else:
+        database.record_contribution(db, note_id, user_id, action, detail, timestamp)
@@ -1,53 +1,123 @@
 from flask import Blueprint, render_template, jsonify
 from auth import login_required, current_user
-from database import get_db
+from database import get_read_db
+from eventbus import invalidate, on_invalidate
+from etags import make_etag, not_modified, with_etag, CACHE_NOTE_TEXT
+from config import DASHBOARD_CACHE_TTL, DASHBOARD_CACHE_SIZE
+from collections import OrderedDict
+import threading
+import time
 
 dashboard_bp = Blueprint('dashboard', __name__)
-# Dashboard route
-@dashboard_bp.route('/dashboard')
-@login_required
-def dashboard():
-    user = current_user()
-    db = get_db()
 
+# -----------------------------
+# Dashboard view model (cached per user)
+# -----------------------------
+# user_id -> (built_at, model), least recently used first
+_dashboard_cache = OrderedDict()
+_dashboard_lock = threading.Lock()
+_dashboard_generation = 0
+
+def invalidate_dashboard(*user_ids):
+    """Drop cached dashboards for the given users, or for everyone if none are given, on every worker."""
+    invalidate('dashboard', user_ids)
+
+def _drop_dashboards(user_ids):
+    global _dashboard_generation
+    with _dashboard_lock:
+        _dashboard_generation += 1
+        if not user_ids:
+            _dashboard_cache.clear()
+        for uid in user_ids:
+            _dashboard_cache.pop(uid, None)
+
+on_invalidate('dashboard', _drop_dashboards)
+
+def _build_dashboard_model(db, user_id):
     notebooks = db.execute(
-        'SELECT id, title FROM notebooks WHERE owner_id=?', 
-        (user['id'],)
+        'SELECT id, title FROM notebooks WHERE owner_id=? ORDER BY created_at DESC',
+        (user_id,)
     ).fetchall()
 
+    # Shared notebooks owned by someone who is in one of this user's groups
     shared_notebooks = db.execute(
-        'SELECT n.id, n.title FROM notebooks n '
-        'JOIN group_members gm ON gm.user_id=? '
-        'JOIN groups g ON g.id=gm.group_id '
-        'WHERE n.is_shared=1', 
-        (user['id'],)
+        'SELECT DISTINCT nb.id, nb.title, nb.created_at FROM notebooks nb '
+        'JOIN group_members owner_gm ON owner_gm.user_id = nb.owner_id '
+        'JOIN group_members gm ON gm.group_id = owner_gm.group_id AND gm.user_id = ? '
+        'WHERE nb.is_shared = 1 AND nb.owner_id != ? '
+        'ORDER BY nb.created_at DESC',
+        (user_id, user_id)
     ).fetchall()
 
+    # The user's groups with their member counts, in one grouped pass
     groups = db.execute(
-        'SELECT g.id, g.name, '
-        '(SELECT COUNT(*) FROM group_members gm WHERE gm.group_id=g.id) AS members '
-        'FROM groups g'
+        'SELECT g.id, g.name, COUNT(*) AS members '
+        'FROM groups g JOIN group_members gm ON gm.group_id = g.id '
+        'WHERE g.id IN (SELECT group_id FROM group_members WHERE user_id = ?) '
+        'GROUP BY g.id, g.name ORDER BY g.id',
+        (user_id,)
     ).fetchall()
 
+    return {
+        'notebooks': [dict(nb) for nb in notebooks],
+        'shared_notebooks': [{'id': nb['id'], 'title': nb['title']} for nb in shared_notebooks],
+        'groups': [dict(g) for g in groups],
+    }
+
+def get_dashboard_model(user_id):
+    """Notebooks, shared notebooks and groups shown on a user's dashboard."""
+    now = time.monotonic()
+    with _dashboard_lock:
+        entry = _dashboard_cache.get(user_id)
+        if entry and now - entry[0] < DASHBOARD_CACHE_TTL:
+            _dashboard_cache.move_to_end(user_id)
+            return entry[1]
+        generation = _dashboard_generation
+
+    model = _build_dashboard_model(get_read_db(), user_id)
+
+    with _dashboard_lock:
+        # Skip storing if an invalidation raced with the build
+        if generation == _dashboard_generation:
+            _dashboard_cache[user_id] = (now, model)
+            _dashboard_cache.move_to_end(user_id)
+            while len(_dashboard_cache) > DASHBOARD_CACHE_SIZE:
+                _dashboard_cache.popitem(last=False)
+    return model
+
+# Dashboard route
+@dashboard_bp.route('/dashboard')
+@login_required
+def dashboard():
+    user = current_user()
+    model = get_dashboard_model(user['id'])
     return render_template(
         'dashboard.html',
         user=user,
-        notebooks=notebooks,
-        shared_notebooks=shared_notebooks,
-        groups=groups
+        notebooks=model['notebooks'],
+        shared_notebooks=model['shared_notebooks'],
+        groups=model['groups']
     )
 # get notes text for a specific note
 @dashboard_bp.route('/get_notes_text/<int:note_id>')
 @login_required
 def get_notes_text(note_id):
-    db = get_db()
+    db = get_read_db()
+    row = db.execute('SELECT version, updated_at FROM notes WHERE id=?', (note_id,)).fetchone()
+    if not row:
+        return jsonify({'error': 'Note not found'}), 404
+    etag = make_etag('notes_text', note_id, row['version'], row['updated_at'])
+    cached = not_modified(etag, CACHE_NOTE_TEXT)
+    if cached:
+        return cached
+
     note = db.execute(
         'SELECT title, content FROM notes WHERE id=?',
         (note_id,)
     ).fetchone()
     if not note:
         return jsonify({'error': 'Note not found'}), 404
-    return jsonify({'notes_text': note['content'], 'title': note['title']})
+    return with_etag(jsonify({'notes_text': note['content'], 'title': note['title']}), etag, CACHE_NOTE_TEXT)
 
 
 # get dashboard text summary
@@ -55,18 +125,9 @@ def get_notes_text(note_id):
 @login_required
 def get_dashboard_text():
     user = current_user()
-    db = get_db()
-
-    notebooks = db.execute(
-        'SELECT title FROM notebooks WHERE owner_id=?',
-        (user['id'],)
-    ).fetchall()
-
-    groups = db.execute(
-        'SELECT g.name, '
-        '(SELECT COUNT(*) FROM group_members gm WHERE gm.group_id=g.id) AS members '
-        'FROM groups g'
-    ).fetchall()
+    model = get_dashboard_model(user['id'])
+    notebooks = model['notebooks']
+    groups = model['groups']
 
     lines = [f"Welcome {user['full_name'] or user['username']}!"]
 
@@ -1,27 +1,316 @@
+import queue
 import sqlite3
-from flask import g
-from config import DATABASE
+import threading
+import time
+from contextlib import contextmanager
+from flask import g, has_app_context
+from migrations import migrate
+from config import (DATABASE, DB_WRITE_POOL_SIZE, DB_READ_POOL_SIZE, DB_POOL_TIMEOUT, DB_BUSY_TIMEOUT_MS,
+                    DB_MMAP_SIZE, DB_CACHED_STATEMENTS)
+
+# -----------------------------
+# Connection Pool
+# -----------------------------
+# Replaced with socketio.sleep by the app so a request waiting for a connection yields to other greenlets
+sleep = time.sleep
+
+
+class PoolTimeout(sqlite3.OperationalError):
+    """Every connection of a pool stayed checked out for the whole wait."""
+
+
+class PooledConnection:
+    """Request-scoped handle on a pooled connection; unusable once released."""
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def _live(self):
+        if self._conn is None:
+            raise sqlite3.ProgrammingError('Cannot operate on a connection returned to the pool.')
+        return self._conn
+
+    def __getattr__(self, name):
+        return getattr(self._live(), name)
+
+    def execute(self, sql, parameters=()):
+        if not _statement_hooks:
+            return self._live().execute(sql, parameters)
+        start = time.perf_counter()
+        try:
+            return self._live().execute(sql, parameters)
+        finally:
+            _run_statement_hooks(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        if not _statement_hooks:
+            return self._live().executemany(sql, seq_of_parameters)
+        start = time.perf_counter()
+        try:
+            return self._live().executemany(sql, seq_of_parameters)
+        finally:
+            _run_statement_hooks(sql, time.perf_counter() - start)
+
+    def __enter__(self):
+        self._live().__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._live().__exit__(*exc)
+
+    def close(self):
+        """Hand the underlying connection back to its pool."""
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._pool.release(conn)
+
+
+class ConnectionPool:
+    """
+    A bounded pool of pre-configured SQLite connections to one database file.
+    At most size connections are open; once all are checked out, acquire()
+    waits up to timeout seconds for one to come back.
+    """
+
+    def __init__(self, path, size, readonly=False, timeout=DB_POOL_TIMEOUT):
+        self.path = path
+        self.size = size
+        self.readonly = readonly
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._opened = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=DB_BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+            cached_statements=DB_CACHED_STATEMENTS
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA foreign_keys=ON')
+        conn.execute(f'PRAGMA mmap_size={DB_MMAP_SIZE}')
+        conn.execute(f'PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}')
+        if self.readonly:
+            conn.execute('PRAGMA query_only=ON')
+        for hook in _connect_hooks:
+            hook(conn)
+        return conn
+
+    def acquire(self):
+        """
+        Return a handle on an idle connection, opening a new one while the pool
+        is below its size. Raises PoolTimeout if none is free within timeout.
+        """
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                return PooledConnection(self, self._idle.get_nowait())
+            except queue.Empty:
+                pass
+            with self._lock:
+                can_open = self._opened < self.size
+                if can_open:
+                    self._opened += 1
+            if can_open:
+                try:
+                    return PooledConnection(self, self._connect())
+                except BaseException:
+                    self._forget()
+                    raise
+            if time.monotonic() >= deadline:
+                raise PoolTimeout(f'no connection free in the pool of {self.size} within {self.timeout}s')
+            # Polled rather than a blocking get() so waiting works under eventlet too
+            sleep(0.005)
+
+    def _forget(self):
+        with self._lock:
+            self._opened -= 1
+
+    def release(self, conn):
+        """Put a connection back; anything left uncommitted is rolled back."""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+        if self._closed:
+            self._discard(conn)
+            return
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            self._discard(conn)
+
+    def _discard(self, conn):
+        conn.close()
+        self._forget()
+
+    def close(self):
+        """Close every idle connection and stop accepting returns."""
+        self._closed = True
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+
+# Called with every connection the pools open (see on_connect)
+_connect_hooks = []
+
+def on_connect(hook):
+    """Run hook(conn) on each new pooled connection, e.g. to install a trace callback."""
+    _connect_hooks.append(hook)
+    return hook
+
+# Called as hook(sql, seconds) after each execute()/executemany() on a pooled connection
+_statement_hooks = []
+
+def on_statement(hook):
+    """Time every statement run through a pooled connection and report it to hook."""
+    _statement_hooks.append(hook)
+    return hook
+
+def _run_statement_hooks(sql, seconds):
+    for hook in _statement_hooks:
+        hook(sql, seconds)
+
+# (database path, readonly) -> ConnectionPool
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(readonly=False):
+    """Get the read or write pool for the currently configured DATABASE."""
+    key = (DATABASE, readonly)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                size = DB_READ_POOL_SIZE if readonly else DB_WRITE_POOL_SIZE
+                pool = _pools[key] = ConnectionPool(DATABASE, size, readonly=readonly)
+    return pool
+
+def close_pools():
+    """Close all pooled connections (used on shutdown and by tests)."""
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+
+# -----------------------------
+# Request-scoped Connections
+# -----------------------------
+# wrapper(conn) -> conn, applied to the connections handed to requests (see sqltrace.py)
+_request_wrappers = []
+
+def wrap_request_connections(wrapper):
+    """Pass every connection get_db/get_read_db hand out through wrapper first."""
+    _request_wrappers.append(wrapper)
+    return wrapper
+
+def _for_request(conn):
+    for wrapper in _request_wrappers:
+        conn = wrapper(conn)
+    return conn
 
 def get_db():
-    """Get or create a database connection for the current Flask request context."""
+    """Get a pooled read/write connection for the current Flask request context."""
     db = getattr(g, "_database", None)
     if db is None:
-        db = g._database = sqlite3.connect(DATABASE)
-        db.row_factory = sqlite3.Row
+        db = g._database = _for_request(get_pool().acquire())
+    return db
+
+def get_read_db():
+    """Get a pooled read-only connection for the current Flask request context."""
+    db = getattr(g, "_read_database", None)
+    if db is None:
+        db = g._read_database = _for_request(get_pool(readonly=True).acquire())
     return db
 
 def close_connection(exception=None):
-    """Close the database connection when the app context ends."""
-    db = getattr(g, "_database", None)
-    if db is not None:
-        db.close()
+    """Return the request's connections to their pools when the app context ends."""
+    for attr in ("_database", "_read_database"):
+        db = g.pop(attr, None)
+        if db is not None:
+            db.close()
 
-def init_db(db):
+# -----------------------------
+# Unit of Work
+# -----------------------------
+@contextmanager
+def unit_of_work():
     """
-    Initialize the SQLite database schema for NoteBridge.
-    Includes Sprint 2 updates: contributions, tags, comments tables.
+    Run a block of writes on the request's write connection as one transaction.
+    Commits once when the block exits and rolls back if it raises; nested
+    blocks join the outer transaction.
     """
-    schema = """
+    db = get_db()
+    if g.get("_unit_of_work"):
+        yield db
+        return
+    g._unit_of_work = True
+    g._after_commit = []
+    try:
+        db.execute('BEGIN IMMEDIATE')
+        yield db
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+    finally:
+        g._unit_of_work = False
+        callbacks = g.pop('_after_commit')
+    for callback in callbacks:
+        callback()
+
+def after_commit(callback):
+    """Call callback once the current unit of work commits (never, if it rolls back); now outside one."""
+    if has_app_context() and g.get('_unit_of_work'):
+        g._after_commit.append(callback)
+    else:
+        callback()
+
+def record_contribution(db, note_id, user_id, action, detail, timestamp=None):
+    """Append a row to the contributions log (timestamp defaults to now)."""
+    if timestamp is None:
+        db.execute(
+            'INSERT INTO contributions (note_id, user_id, action, detail) VALUES (?, ?, ?, ?)',
+            (note_id, user_id, action, detail)
+        )
+    else:
+        db.execute(
+            'INSERT INTO contributions (note_id, user_id, action, detail, timestamp) VALUES (?, ?, ?, ?, ?)',
+            (note_id, user_id, action, detail, timestamp)
+        )
+
+# Notebooks a user may read: their own, plus shared notebooks owned by
+# someone they are in a group with. Expects a named :user_id parameter.
+VISIBLE_NOTEBOOKS_SQL = '''
+    SELECT nb.id FROM notebooks nb WHERE nb.owner_id = :user_id
+    UNION
+    SELECT nb.id FROM notebooks nb
+    JOIN group_members owner_gm ON owner_gm.user_id = nb.owner_id
+    JOIN group_members gm ON gm.group_id = owner_gm.group_id AND gm.user_id = :user_id
+    WHERE nb.is_shared = 1
+'''
+
+def visible_note(db, note_id, user_id):
+    """The note row if it is in a notebook user_id may read, else None."""
+    return db.execute(
+        f'SELECT * FROM notes WHERE id = :note_id AND notebook_id IN ({VISIBLE_NOTEBOOKS_SQL})',
+        {'note_id': note_id, 'user_id': user_id}
+    ).fetchone()
+
+# Base schema (migration version 0)
+SCHEMA = """
     PRAGMA foreign_keys = ON;
 
     -- USERS TABLE
@@ -108,7 +397,14 @@ def init_db(db):
         FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE SET NULL,
         FOREIGN KEY(parent_id) REFERENCES comments(id) ON DELETE CASCADE
     );
-    """
+"""
 
-    db.executescript(schema)
+def init_db(db):
+    """
+    Initialize the SQLite database schema for NoteBridge.
+    Includes Sprint 2 updates: contributions, tags, comments tables.
+    Later changes are applied on top by the versioned migrations.
+    """
+    db.executescript(SCHEMA)
     db.commit()
+    migrate(db)
@@ -0,0 +1,62 @@
+import hashlib
+import os
+from flask import Response, make_response, request
+from config import ETAG_BUILD_ID
+
+# -----------------------------
+# ETags and conditional GET
+# -----------------------------
+# Routes compute a strong ETag from a cheap lookup (a version counter, an
+# updated_at, a fingerprint) before loading or rendering anything:
+#
+#     etag = make_etag('note', note_id, row['version'])
+#     cached = not_modified(etag, CACHE_PAGE)
+#     if cached:
+#         return cached
+#     return with_etag(render_template(...), etag, CACHE_PAGE)
+#
+# Tags also cover the build, so a deploy with changed templates invalidates them.
+
+# Cache-Control per kind of response. Pages and note text must be revalidated
+# on every use, which the ETag makes cheap; a summary may be reused briefly.
+CACHE_PAGE = 'private, no-cache'
+CACHE_NOTE_TEXT = 'private, no-cache'
+CACHE_SUMMARY = 'private, max-age=10, must-revalidate'
+
+
+def _templates_fingerprint():
+    folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+    digest = hashlib.sha1()
+    for name in sorted(os.listdir(folder)):
+        stat = os.stat(os.path.join(folder, name))
+        digest.update(f'{name}:{stat.st_size}:{stat.st_mtime_ns};'.encode())
+    return digest.hexdigest()[:12]
+
+
+BUILD_ID = ETAG_BUILD_ID or _templates_fingerprint()
+
+
+def make_etag(*parts):
+    """Strong ETag value (unquoted) for a response determined by parts."""
+    key = '|'.join(str(p) for p in (BUILD_ID,) + parts)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:32]
+
+
+def _headers(response, etag, cache_control):
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    # Bodies depend on who is logged in
+    response.vary.add('Cookie')
+    return response
+
+
+def not_modified(etag, cache_control):
+    """A 304 response if the request's If-None-Match names etag, else None."""
+    if request.if_none_match.contains_weak(etag):
+        return _headers(Response(status=304), etag, cache_control)
+    return None
+
+
+def with_etag(response, etag, cache_control):
+    """Add the ETag and caching headers to a full response (anything a view may return)."""
+    return _headers(make_response(response), etag, cache_control)
@@ -0,0 +1,218 @@
+import json
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+import socketio
+from applog import get_logger
+from config import EVENT_BUS, EVENT_BUS_PATH, EVENT_BUS_POLL_MS, EVENT_BUS_RETENTION
+
+log = get_logger('eventbus')
+
+# -----------------------------
+# Cross-worker event bus
+# -----------------------------
+# Note events (SSE) and Socket.IO packets are published on a topic; every
+# worker process running the app receives them, its own included. Handlers
+# are called as handler(event_id, payload) with JSON-serializable payloads.
+
+
+class LocalBus:
+    """Single-process bus: handlers run right away in the publishing thread."""
+
+    cross_process = False
+
+    def __init__(self):
+        self._handlers = {}
+        self.published = 0
+        self.received = 0
+
+    def subscribe(self, topic, handler):
+        self._handlers.setdefault(topic, []).append(handler)
+
+    def publish(self, topic, payload):
+        self.published += 1
+        for handler in self._handlers.get(topic, ()):
+            handler(None, payload)
+
+    def last_id(self):
+        return None
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+class SQLiteBus(LocalBus):
+    """
+    Bus shared by the worker processes of one machine through a small WAL
+    SQLite file. Publishing appends a row and then delivers every row not
+    seen yet, its own included; a poller thread in every process picks up
+    the rows of the other workers in between. Either way handlers see the
+    events in row id order. Row ids are global, so they double as SSE event
+    ids on every worker. Rows older than retention seconds are pruned.
+    """
+
+    cross_process = True
+
+    def __init__(self, path=EVENT_BUS_PATH, poll_ms=EVENT_BUS_POLL_MS, retention=EVENT_BUS_RETENTION):
+        super().__init__()
+        self.path = path
+        self.poll = poll_ms / 1000
+        self.retention = retention
+        self.origin = uuid.uuid4().hex
+        self._local = threading.local()
+        self._stop = threading.Event()
+        self._thread = None
+        # Held while delivering, so rows reach the handlers one at a time and in order
+        self._deliver_lock = threading.RLock()
+        self._last_prune = 0.0
+        self._connect().executescript('''
+            CREATE TABLE IF NOT EXISTS bus_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                topic TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                origin TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+        ''')
+        self._last_seen = self.last_id()
+
+    def _connect(self):
+        # One connection per thread: request threads publish, the poller reads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def publish(self, topic, payload):
+        cur = self._connect().execute(
+            'INSERT INTO bus_events (topic, payload, origin, created_at) VALUES (?, ?, ?, ?)',
+            (topic, json.dumps(payload), self.origin, time.time())
+        )
+        self.published += 1
+        # Rows of other workers with lower ids are delivered first
+        self.poll_once()
+        return cur.lastrowid
+
+    def last_id(self):
+        row = self._connect().execute('SELECT MAX(id) FROM bus_events').fetchone()
+        return row[0] or 0
+
+    def start(self):
+        """Start polling for other workers' events (no-op if already running)."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='event-bus', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def poll_once(self):
+        """Deliver the events published since the last poll, in id order."""
+        with self._deliver_lock:
+            rows = self._connect().execute(
+                'SELECT id, topic, payload, origin FROM bus_events WHERE id > ? ORDER BY id',
+                (self._last_seen,)
+            ).fetchall()
+            for event_id, topic, payload, origin in rows:
+                self._last_seen = event_id
+                if origin != self.origin:
+                    self.received += 1
+                for handler in self._handlers.get(topic, ()):
+                    try:
+                        handler(event_id, json.loads(payload))
+                    except Exception as e:
+                        log.error('Event bus handler failed', topic=topic, error=str(e))
+        return len(rows)
+
+    def _run(self):
+        while not self._stop.wait(self.poll):
+            try:
+                self.poll_once()
+                if time.monotonic() - self._last_prune > self.retention:
+                    self._last_prune = time.monotonic()
+                    self._connect().execute('DELETE FROM bus_events WHERE created_at < ?',
+                                            (time.time() - self.retention,))
+            except sqlite3.Error as e:
+                log.warning('Event bus poll failed', error=str(e))
+
+
+def create_bus(kind=EVENT_BUS):
+    if kind == 'sqlite':
+        return SQLiteBus()
+    if kind == 'local':
+        return LocalBus()
+    raise ValueError(f"unknown EVENT_BUS backend: {kind}")
+
+
+event_bus = create_bus()
+
+
+# -----------------------------
+# Cache invalidation across workers
+# -----------------------------
+# Per-process caches (dashboards, summaries, live documents) register how to
+# drop entries; invalidate() then drops them in every worker, this one
+# included (right away, before it returns).
+_invalidators = {}
+
+def on_invalidate(cache, drop):
+    """Call drop(keys) in this worker whenever any worker invalidates cache."""
+    _invalidators[cache] = drop
+
+def invalidate(cache, keys=()):
+    """Drop keys from cache (every entry, if keys is empty) in every worker."""
+    event_bus.publish('invalidate', {'cache': cache, 'keys': list(keys)})
+
+def _on_invalidate(event_id, payload):
+    drop = _invalidators.get(payload['cache'])
+    if drop is not None:
+        drop(payload['keys'])
+
+event_bus.subscribe('invalidate', _on_invalidate)
+
+
+# -----------------------------
+# Flask-SocketIO message queue on the bus
+# -----------------------------
+class BusClientManager(socketio.PubSubManager):
+    """
+    python-socketio client manager that carries Socket.IO packets (room
+    emits, joins, ...) over the event bus, so that emit(..., room=...) on
+    one worker reaches clients connected to any worker.
+    Pass it to SocketIO(client_manager=...) in place of a message_queue URL.
+    """
+
+    name = 'notebridge-bus'
+
+    def __init__(self, bus, channel='flask-socketio', write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.bus = bus
+        self.poll = EVENT_BUS_POLL_MS / 1000
+        self._inbox = queue.Queue()
+        bus.subscribe(channel, lambda event_id, payload: self._inbox.put(payload))
+
+    def _publish(self, data):
+        self.bus.publish(self.channel, data)
+
+    def _listen(self):
+        # Runs as a Socket.IO background task: a blocking get() would stall
+        # the eventlet hub, so poll and sleep cooperatively while idle
+        sleep = self.server.sleep if self.server is not None else time.sleep
+        while True:
+            try:
+                yield self._inbox.get_nowait()
+            except queue.Empty:
+                sleep(self.poll)
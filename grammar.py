@@ -0,0 +1,231 @@
+import hashlib
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+import startup
+from applog import get_logger
+from config import GRAMMAR_WORKERS, GRAMMAR_BATCH_CHARS, GRAMMAR_BATCH_WINDOW_MS, GRAMMAR_CACHE_SIZE
+
+log = get_logger('grammar')
+
+# -----------------------------
+# LanguageTool (heavy, started lazily)
+# -----------------------------
+def _create_language_tool():
+    # Importing is cheap; constructing the tool starts a local Java server
+    with startup.timed('language_tool_python', 'import'):
+        import language_tool_python
+    return language_tool_python.LanguageTool('en-US')
+
+# Local AI/text tool, started on first use or by startup.warm_up()
+grammar_tool = startup.lazy('language_tool', _create_language_tool)
+
+
+# -----------------------------
+# Paragraph helpers
+# -----------------------------
+_PARAGRAPH_RE = re.compile(r'(\n\s*\n)')
+# Paragraphs of one batch are checked as a single document joined by this
+_BATCH_SEPARATOR = '\n\n'
+
+def split_paragraphs(text):
+    """Split text into [paragraph, separator, paragraph, ...]; joining the parts gives text back."""
+    return _PARAGRAPH_RE.split(text)
+
+def _paragraph_key(paragraph):
+    return hashlib.sha1(paragraph.encode('utf-8')).hexdigest()
+
+def apply_matches(text, matches, base=0):
+    """
+    Apply the first suggested replacement of every match that falls inside
+    text[...]; match offsets are relative to a document where text starts at base.
+    """
+    end = base + len(text)
+    for m in sorted(matches, key=lambda m: m.offset, reverse=True):
+        if not m.replacements or m.offset < base or m.offset + m.errorLength > end:
+            continue
+        start = m.offset - base
+        text = text[:start] + m.replacements[0] + text[start + m.errorLength:]
+    return text
+
+
+# -----------------------------
+# Batched correction service
+# -----------------------------
+class GrammarService:
+    """
+    Grammar correction off the request thread.
+    Paragraphs of all pending texts are collected for up to window_ms (or
+    batch_chars characters), checked by a worker pool as one LanguageTool
+    document per batch, and cached by paragraph hash so unchanged paragraphs
+    of an edited note are never checked twice.
+    """
+
+    def __init__(self, tool=grammar_tool, workers=GRAMMAR_WORKERS, batch_chars=GRAMMAR_BATCH_CHARS,
+                 window_ms=GRAMMAR_BATCH_WINDOW_MS, cache_size=GRAMMAR_CACHE_SIZE):
+        self.tool = tool
+        self.workers = workers
+        self.batch_chars = batch_chars
+        self.window = window_ms / 1000
+        self.cache_size = cache_size
+        self._queue = queue.Queue()
+        self._cache = OrderedDict()      # paragraph hash -> corrected paragraph
+        self._inflight = {}              # paragraph hash -> Future
+        self._lock = threading.Lock()
+        self._executor = None
+        self._thread = None
+        self._stop = threading.Event()
+        self.batches = 0
+        self.checked = 0
+        self.cache_hits = 0
+        self.failed = 0
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start the batching thread and worker pool (no-op if already running)."""
+        with self._lock:
+            if self.running:
+                return
+            self._stop.clear()
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='grammar')
+            self._thread = threading.Thread(target=self._run, name='grammar-batcher', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop batching; paragraphs still queued fail so callers keep their raw text."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        while True:
+            try:
+                key, _, future = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            # Forget the failed future so the paragraph is checked again after a restart
+            with self._lock:
+                self._inflight.pop(key, None)
+            future.set_exception(RuntimeError('grammar service stopped'))
+
+    def correct_async(self, text):
+        """Return a Future resolving to the corrected text."""
+        if not self.running:
+            self.start()
+        parts = split_paragraphs(text)
+        pending = {}
+        with self._lock:
+            for i in range(0, len(parts), 2):
+                paragraph = parts[i]
+                if not paragraph.strip():
+                    continue
+                key = _paragraph_key(paragraph)
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    parts[i] = self._cache[key]
+                    self.cache_hits += 1
+                    continue
+                future = self._inflight.get(key)
+                if future is None:
+                    future = self._inflight[key] = Future()
+                    self._queue.put((key, paragraph, future))
+                pending[i] = future
+
+        result = Future()
+        if not pending:
+            result.set_result(''.join(parts))
+            return result
+
+        remaining = [len(pending)]
+        remaining_lock = threading.Lock()
+
+        def paragraph_done(index, future):
+            with remaining_lock:
+                if result.done():
+                    return
+                if future.exception() is not None:
+                    result.set_exception(future.exception())
+                    return
+                parts[index] = future.result()
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    result.set_result(''.join(parts))
+
+        for index, future in pending.items():
+            future.add_done_callback(lambda f, index=index: paragraph_done(index, f))
+        return result
+
+    def correct(self, text, timeout=None):
+        """Blocking variant of correct_async."""
+        return self.correct_async(text).result(timeout)
+
+    def stats(self):
+        return {
+            'queue_depth': self._queue.qsize(),
+            'cache_entries': len(self._cache),
+            'batches': self.batches,
+            'checked': self.checked,
+            'cache_hits': self.cache_hits,
+            'failed': self.failed,
+        }
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                first = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            batch, size = [first], len(first[1])
+            deadline = time.monotonic() + self.window
+            while size < self.batch_chars:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(item)
+                size += len(item[1])
+            self._executor.submit(self._check_batch, batch)
+
+    def _check_batch(self, batch):
+        document = _BATCH_SEPARATOR.join(paragraph for _, paragraph, _ in batch)
+        try:
+            matches = self.tool.get().check(document)
+        except Exception as e:
+            log.warning('Grammar check failed', paragraphs=len(batch), error=str(e))
+            with self._lock:
+                self.failed += len(batch)
+                for key, _, _ in batch:
+                    self._inflight.pop(key, None)
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+
+        results = []
+        base = 0
+        for key, paragraph, future in batch:
+            results.append((key, apply_matches(paragraph, matches, base), future))
+            base += len(paragraph) + len(_BATCH_SEPARATOR)
+        with self._lock:
+            self.batches += 1
+            self.checked += len(batch)
+            for key, corrected, _ in results:
+                self._inflight.pop(key, None)
+                self._cache[key] = corrected
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        for _, corrected, future in results:
+            future.set_result(corrected)
+
+
+grammar_service = GrammarService()
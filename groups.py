@@ -1,6 +1,7 @@
 from flask import Blueprint, render_template, request, redirect, url_for, session, abort
 from auth import login_required, current_user
-from database import get_db
+from database import get_db, get_read_db
+from dashboard import invalidate_dashboard
 from werkzeug.security import generate_password_hash
 import datetime
 
@@ -8,7 +9,7 @@ group_bp = Blueprint('group', __name__, url_prefix='/groups')
 
 # Helper to get group by ID
 def get_group(group_id):
-    db = get_db()
+    db = get_read_db()
     group = db.execute('SELECT * FROM groups WHERE id=?', (group_id,)).fetchone()
     if not group:
         abort(404, "Group not found")
@@ -16,7 +17,7 @@ def get_group(group_id):
 
 # Helper to get members of a group
 def get_members(group_id):
-    db = get_db()
+    db = get_read_db()
     members = db.execute(
         'SELECT u.id as user_id, u.username, u.full_name, gm.role '
         'FROM users u JOIN group_members gm ON u.id = gm.user_id '
@@ -66,6 +67,7 @@ def create_group():
         )
 
     db.commit()
+    invalidate_dashboard()
     return redirect(url_for('dashboard.dashboard'))
 
 # View a group
@@ -88,6 +90,7 @@ def edit_group(group_id):
         description = request.form.get('description', group['description'])
         db.execute('UPDATE groups SET name=?, description=? WHERE id=?', (name, description, group_id))
         db.commit()
+        invalidate_dashboard()
         return redirect(url_for('group.view_group', group_id=group_id))
 
     members = get_members(group_id)
@@ -102,6 +105,7 @@ def delete_group(group_id):
     db.execute('DELETE FROM group_members WHERE group_id=?', (group_id,))
     db.execute('DELETE FROM groups WHERE id=?', (group_id,))
     db.commit()
+    invalidate_dashboard()
     return redirect(url_for('dashboard.dashboard'))
 
 # Add member to group
@@ -128,6 +132,7 @@ def add_member(group_id):
         (group_id, user_id, role, now)
     )
     db.commit()
+    invalidate_dashboard()
     return redirect(url_for('group.view_group', group_id=group_id))
 
 # Remove member from group
@@ -137,12 +142,13 @@ def remove_member(group_id, user_id):
     db = get_db()
     db.execute('DELETE FROM group_members WHERE group_id=? AND user_id=?', (group_id, user_id))
     db.commit()
+    invalidate_dashboard()
     return redirect(url_for('group.view_group', group_id=group_id))
 
 @group_bp.route('', methods=['GET'])
 @login_required
 def list_groups():
-    db = get_db()
+    db = get_read_db()
     groups = db.execute(
         'SELECT g.id, g.name, '
         '(SELECT COUNT(*) FROM group_members gm WHERE gm.group_id=g.id) AS members '
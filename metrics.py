@@ -0,0 +1,297 @@
+import bisect
+import contextlib
+import math
+import threading
+import time
+from flask import Blueprint, Response, g, has_request_context, request
+import database
+from applog import get_logger
+from config import METRICS_ENABLED, METRICS_TOKEN
+
+log = get_logger('metrics')
+
+# -----------------------------
+# Metric types
+# -----------------------------
+# A small in-process registry rendered in the Prometheus text format
+# (version 0.0.4). Updating a metric is a dict lookup and one short lock;
+# numbers other modules already keep (queue sizes, counters in stats())
+# are read through callbacks only when /metrics is scraped.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+class _Value:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class _Buckets:
+    __slots__ = ('bounds', 'counts', 'sum', '_lock')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)     # last slot is +Inf
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    @contextlib.contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class Metric:
+    """A metric family; labels(...) gives the child for one set of label values."""
+
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    # Unlabelled metrics are used directly
+    def __getattr__(self, name):
+        if name in ('inc', 'dec', 'set', 'observe', 'time') and not self.label_names:
+            return getattr(self.labels(), name)
+        raise AttributeError(name)
+
+    def _new_child(self):
+        return _Value()
+
+    def samples(self):
+        with self._lock:
+            children = list(self._children.items())
+        for values, child in children:
+            yield self.name, _labels(self.label_names, values), child.value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        lines += [f'{name}{labels} {_number(value)}' for name, labels, value in self.samples()]
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _Buckets(self.buckets)
+
+    def samples(self):
+        with self._lock:
+            children = list(self._children.items())
+        for values, child in children:
+            with child._lock:
+                counts, total = list(child.counts), child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                yield f'{self.name}_bucket', _labels(self.label_names, values, [('le', _number(bound))]), cumulative
+            yield f'{self.name}_sum', _labels(self.label_names, values), total
+            yield f'{self.name}_count', _labels(self.label_names, values), cumulative
+
+
+class Callback(Metric):
+    """Counter or gauge whose value is read from fn() at scrape time (a number, or {label values: number})."""
+
+    def __init__(self, name, help_text, kind, fn, labels=()):
+        super().__init__(name, help_text, labels)
+        self.kind = kind
+        self.fn = fn
+
+    def samples(self):
+        value = self.fn()
+        items = value.items() if isinstance(value, dict) else [((), value)]
+        for values, v in items:
+            values = values if isinstance(values, tuple) else (values,)
+            yield self.name, _labels(self.label_names, values), v
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f'metric {metric.name} is already registered')
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._add(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=()):
+        return self._add(Gauge(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help_text, labels, buckets))
+
+    def collect(self, name, help_text, kind, fn, labels=()):
+        """Register a counter/gauge computed by fn() whenever metrics are rendered."""
+        return self._add(Callback(name, help_text, kind, fn, labels))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                lines += metric.render()
+            except Exception as e:
+                log.warning('Metric could not be collected', metric=metric.name, error=str(e))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+# -----------------------------
+# Request and SQLite instrumentation
+# -----------------------------
+REQUESTS = registry.counter(
+    'notebridge_http_requests_total', 'HTTP requests handled.', ('endpoint', 'method', 'status'))
+REQUEST_SECONDS = registry.histogram(
+    'notebridge_http_request_duration_seconds',
+    'Request latency; streamed responses count until the stream ends.', ('endpoint',))
+IN_FLIGHT = registry.gauge(
+    'notebridge_http_requests_in_flight', 'Requests being handled (open SSE streams included).', ('endpoint',))
+REQUEST_QUERIES = registry.histogram(
+    'notebridge_http_request_db_queries', 'SQL statements run per request.', ('endpoint',),
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500))
+REQUEST_DB_SECONDS = registry.histogram(
+    'notebridge_http_request_db_seconds', 'Time spent executing SQL statements per request.', ('endpoint',))
+DB_STATEMENTS = registry.counter(
+    'notebridge_db_statements_total', 'SQL statements run on pooled connections (requests and background writers).')
+DB_SECONDS = registry.counter(
+    'notebridge_db_statement_seconds_total', 'Time spent executing SQL statements on pooled connections.')
+
+
+def _on_statement(sql, seconds):
+    DB_STATEMENTS.inc()
+    DB_SECONDS.inc(seconds)
+    # Per-request totals live on g, which follows the request into whatever
+    # thread or greenlet serves it; background writers have no request
+    if has_request_context() and '_metrics_queries' in g:
+        g._metrics_queries += 1
+        g._metrics_db_seconds += seconds
+
+
+def _before_request():
+    g._metrics_start = time.perf_counter()
+    g._metrics_endpoint = request.endpoint or 'unmatched'
+    IN_FLIGHT.labels(g._metrics_endpoint).inc()
+    g._metrics_queries = 0
+    g._metrics_db_seconds = 0.0
+
+
+def _after_request(response):
+    g._metrics_status = response.status_code
+    return response
+
+
+def _teardown_request(exc=None):
+    start = g.pop('_metrics_start', None)
+    if start is None:
+        return
+    endpoint = g._metrics_endpoint
+    status = g.get('_metrics_status', 500 if exc is not None else 200)
+    REQUEST_SECONDS.labels(endpoint).observe(time.perf_counter() - start)
+    REQUESTS.labels(endpoint, request.method, str(status)).inc()
+    IN_FLIGHT.labels(endpoint).dec()
+    if '_metrics_queries' in g:
+        REQUEST_QUERIES.labels(endpoint).observe(g.pop('_metrics_queries'))
+        REQUEST_DB_SECONDS.labels(endpoint).observe(g.pop('_metrics_db_seconds'))
+
+
+metrics_bp = Blueprint('metrics', __name__)
+LOCAL_ADDRESSES = ('127.0.0.1', '::1')
+
+
+@metrics_bp.route('/metrics')
+def metrics():
+    """
+    Prometheus scrape endpoint. With METRICS_TOKEN set, send Authorization:
+    Bearer <METRICS_TOKEN>; without one, only local scrapers are answered.
+    """
+    if METRICS_TOKEN:
+        if request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+            return Response('unauthorized\n', status=401, content_type='text/plain')
+    elif request.remote_addr not in LOCAL_ADDRESSES:
+        return Response('forbidden\n', status=403, content_type='text/plain')
+    return Response(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def init_app(app):
+    """Time every request of app, count its SQL statements and serve /metrics."""
+    if not METRICS_ENABLED:
+        return
+    database.on_statement(_on_statement)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    app.register_blueprint(metrics_bp)
@@ -0,0 +1,203 @@
+"""
+Versioned schema migrations for NoteBridge.
+
+The schema version of a database file is tracked in ``PRAGMA user_version``.
+Each migration runs in its own transaction together with the version bump,
+so an interrupted upgrade leaves the file at the last fully applied version.
+"""
+from applog import get_logger
+
+log = get_logger('migrations')
+
+# -----------------------------
+# Migrations: (version, description, sql)
+# -----------------------------
+MIGRATIONS = [
+    (1, 'hot-path secondary indexes', """
+    -- notebooks.view_notebook / summaries / search: notes of a notebook, newest first
+    CREATE INDEX IF NOT EXISTS idx_notes_notebook_updated
+        ON notes (notebook_id, updated_at DESC, created_at DESC);
+
+    -- view_note: tags and threaded comments of a note
+    CREATE INDEX IF NOT EXISTS idx_tags_note ON tags (note_id, tag);
+    CREATE INDEX IF NOT EXISTS idx_comments_note_ts ON comments (note_id, timestamp);
+    CREATE INDEX IF NOT EXISTS idx_comments_parent ON comments (parent_id);
+
+    -- groups / dashboard: members of a group and groups of a user
+    CREATE INDEX IF NOT EXISTS idx_group_members_group_user ON group_members (group_id, user_id);
+    CREATE INDEX IF NOT EXISTS idx_group_members_user_group ON group_members (user_id, group_id);
+
+    -- dashboard / chatbot / list_notebooks: a user's notebooks by creation date
+    CREATE INDEX IF NOT EXISTS idx_notebooks_owner_created
+        ON notebooks (owner_id, created_at DESC, title);
+
+    -- contributions feed and foreign-key cascades
+    CREATE INDEX IF NOT EXISTS idx_contributions_timestamp ON contributions (timestamp DESC);
+    CREATE INDEX IF NOT EXISTS idx_contributions_note ON contributions (note_id);
+    CREATE INDEX IF NOT EXISTS idx_contributions_user ON contributions (user_id);
+    """),
+    (2, 'FTS5 full-text index over notes', """
+    CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5(
+        title, content, content='notes', content_rowid='id', tokenize='unicode61'
+    );
+
+    -- keep the external-content index in step with notes
+    CREATE TRIGGER IF NOT EXISTS notes_fts_ai AFTER INSERT ON notes BEGIN
+        INSERT INTO notes_fts (rowid, title, content) VALUES (new.id, new.title, new.content);
+    END;
+    CREATE TRIGGER IF NOT EXISTS notes_fts_ad AFTER DELETE ON notes BEGIN
+        INSERT INTO notes_fts (notes_fts, rowid, title, content)
+        VALUES ('delete', old.id, old.title, old.content);
+    END;
+    CREATE TRIGGER IF NOT EXISTS notes_fts_au AFTER UPDATE OF title, content ON notes BEGIN
+        INSERT INTO notes_fts (notes_fts, rowid, title, content)
+        VALUES ('delete', old.id, old.title, old.content);
+        INSERT INTO notes_fts (rowid, title, content) VALUES (new.id, new.title, new.content);
+    END;
+
+    INSERT INTO notes_fts (notes_fts) VALUES ('rebuild');
+    """),
+    (3, 'per-user session version counter', """
+    ALTER TABLE users ADD COLUMN session_version INTEGER NOT NULL DEFAULT 0;
+    """),
+    (4, 'persistent notebook summary cache', """
+    CREATE TABLE IF NOT EXISTS notebook_summaries (
+        notebook_id INTEGER PRIMARY KEY,
+        fingerprint TEXT NOT NULL,
+        summary TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        FOREIGN KEY(notebook_id) REFERENCES notebooks(id) ON DELETE CASCADE
+    );
+    """),
+    (5, 'discard summaries made by the old summarizer', """
+    -- summaries.py switched to the TF-IDF engine in summarizer.py
+    DELETE FROM notebook_summaries;
+    """),
+    (6, 'note revision history', """
+    -- revisions.py: full snapshots every few revisions, compressed forward deltas between
+    CREATE TABLE IF NOT EXISTS note_revisions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        note_id INTEGER NOT NULL,
+        revision INTEGER NOT NULL,
+        kind TEXT NOT NULL CHECK (kind IN ('snapshot', 'delta')),
+        depth INTEGER NOT NULL,
+        data BLOB NOT NULL,
+        title TEXT,
+        length INTEGER NOT NULL,
+        checksum INTEGER NOT NULL,
+        user_id INTEGER,
+        created_at TEXT NOT NULL,
+        UNIQUE (note_id, revision),
+        FOREIGN KEY(note_id) REFERENCES notes(id) ON DELETE CASCADE,
+        FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE SET NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_note_revisions_user ON note_revisions (user_id);
+    """),
+    (7, 'version counters for ETags', """
+    -- etags.py: a note's version changes with anything its page shows (text, tags,
+    -- comments); a notebook's with its own fields and its list of notes
+    ALTER TABLE notes ADD COLUMN version INTEGER NOT NULL DEFAULT 0;
+    ALTER TABLE notebooks ADD COLUMN version INTEGER NOT NULL DEFAULT 0;
+
+    CREATE TRIGGER IF NOT EXISTS notes_version_au AFTER UPDATE OF title, content, notebook_id ON notes BEGIN
+        UPDATE notes SET version = version + 1 WHERE id = new.id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS comments_version_ai AFTER INSERT ON comments BEGIN
+        UPDATE notes SET version = version + 1 WHERE id = new.note_id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS comments_version_au AFTER UPDATE ON comments BEGIN
+        UPDATE notes SET version = version + 1 WHERE id = new.note_id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS comments_version_ad AFTER DELETE ON comments BEGIN
+        UPDATE notes SET version = version + 1 WHERE id = old.note_id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS tags_version_ai AFTER INSERT ON tags BEGIN
+        UPDATE notes SET version = version + 1 WHERE id = new.note_id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS tags_version_ad AFTER DELETE ON tags BEGIN
+        UPDATE notes SET version = version + 1 WHERE id = old.note_id;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS notebooks_version_au AFTER UPDATE OF title, description, is_shared ON notebooks BEGIN
+        UPDATE notebooks SET version = version + 1 WHERE id = new.id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS notes_notebook_version_ai AFTER INSERT ON notes BEGIN
+        UPDATE notebooks SET version = version + 1 WHERE id = new.notebook_id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS notes_notebook_version_ad AFTER DELETE ON notes BEGIN
+        UPDATE notebooks SET version = version + 1 WHERE id = old.notebook_id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS notes_notebook_version_au
+    AFTER UPDATE OF title, updated_at, created_at, notebook_id ON notes BEGIN
+        UPDATE notebooks SET version = version + 1 WHERE id IN (old.notebook_id, new.notebook_id);
+    END;
+    """),
+    (8, 'keep the contributions log when a note is deleted', """
+    -- With foreign keys enforced, ON DELETE CASCADE erased a note's history along
+    -- with it; the rows now stay, detached (note_id NULL). SQLite cannot alter a
+    -- foreign key in place, so the table is rebuilt.
+    CREATE TABLE contributions_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        note_id INTEGER,
+        user_id INTEGER,
+        action TEXT NOT NULL,
+        detail TEXT,
+        timestamp TEXT DEFAULT (datetime('now')),
+        FOREIGN KEY(note_id) REFERENCES notes(id) ON DELETE SET NULL,
+        FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE SET NULL
+    );
+    -- rows left behind by deletes made while enforcement was off are detached too
+    INSERT INTO contributions_new (id, note_id, user_id, action, detail, timestamp)
+        SELECT c.id, n.id, u.id, c.action, c.detail, c.timestamp
+        FROM contributions c
+        LEFT JOIN notes n ON n.id = c.note_id
+        LEFT JOIN users u ON u.id = c.user_id;
+    DROP TABLE contributions;
+    ALTER TABLE contributions_new RENAME TO contributions;
+
+    CREATE INDEX IF NOT EXISTS idx_contributions_timestamp ON contributions (timestamp DESC);
+    CREATE INDEX IF NOT EXISTS idx_contributions_note ON contributions (note_id);
+    CREATE INDEX IF NOT EXISTS idx_contributions_user ON contributions (user_id);
+    """),
+    (9, 'bump session_version whenever a user changes', """
+    -- auth.py trusts a session's user snapshot while its version is current;
+    -- any change to what the snapshot holds, however it is made, retires it
+    CREATE TRIGGER IF NOT EXISTS users_session_version_au
+    AFTER UPDATE OF username, full_name, password_hash ON users BEGIN
+        UPDATE users SET session_version = session_version + 1 WHERE id = new.id;
+    END;
+    """),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_version(db):
+    """Return the schema version recorded in the database file."""
+    return db.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(db):
+    """
+    Apply every pending migration in order and refresh planner statistics.
+    Returns the list of versions that were applied.
+    """
+    current = get_version(db)
+    applied = []
+    for version, description, sql in MIGRATIONS:
+        if version <= current:
+            continue
+        log.info('Applying migration', version=version, description=description)
+        # executescript() runs in autocommit mode, so the transaction is spelled out
+        try:
+            db.executescript(f"BEGIN;\n{sql}\nPRAGMA user_version = {version};\nCOMMIT;")
+        except Exception:
+            if db.in_transaction:
+                db.rollback()
+            raise
+        applied.append(version)
+
+    if applied:
+        db.execute('ANALYZE')
+        db.commit()
+    return applied
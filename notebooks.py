@@ -1,53 +1,70 @@
-from flask import Blueprint, redirect, render_template, request, jsonify, url_for, send_file, Response, stream_with_context
+from flask import Blueprint, redirect, render_template, request, jsonify, url_for, Response, stream_with_context
 from auth import login_required, current_user
-from database import get_db
+from database import get_db, get_read_db, get_pool, close_connection, unit_of_work, visible_note, VISIBLE_NOTEBOOKS_SQL
+from contributions import contributions_writer, log_contribution
+from autosave import autosave
+from dashboard import get_dashboard_model, invalidate_dashboard
+from summaries import notebook_fingerprint, get_notebook_summary, invalidate_summary
+from tts import tts_pool, TTSBusy, SpeechStream, send_audio
+from search import search_notes, SEARCH_DEFAULT_LIMIT, SEARCH_MAX_LIMIT
+from grammar import grammar_service
+from broker import event_broker
+from eventbus import event_bus
+from revisions import record_revision, list_revisions, get_revision, diff_revisions, RevisionError
+from etags import make_etag, not_modified, with_etag, CACHE_PAGE, CACHE_SUMMARY
+from collab import invalidate_document
+from config import SSE_HEARTBEAT, SSE_RETRY_MS, CONTRIBUTIONS_READ_WAIT_MS
+from applog import get_logger
 import datetime
 from datetime import datetime as dt
 import re
-import pyttsx3
-from tempfile import NamedTemporaryFile
-from io import BytesIO
+import sqlite3
 import os
-import torch
 import json
-import time
-import numpy as np
-from transformers import pipeline
 # -----------------------------
 # Notebook Blueprint
 # -----------------------------
 
 notebook_bp = Blueprint('notebook', __name__, url_prefix='/notebook')
-
-# SSE subscribers: notebook_id -> list of queues
-notebook_subscribers = {}
+log = get_logger('notebooks')
 
 # -----------------------------
 
 # notebook routes
 
+def _invalidate_notebook_viewers(owner_id, is_shared):
+    """Drop cached dashboards that list a notebook: the owner's, or everyone's if shared."""
+    if is_shared:
+        invalidate_dashboard()
+    else:
+        invalidate_dashboard(owner_id)
+
 # route to list notebooks
 @notebook_bp.route('/notebooks', methods=['GET'])
 @login_required
 def list_notebooks():
     """📘 List all notebooks for the logged-in user."""
     user = current_user()
-    db = get_db()
-    notebooks = db.execute(
-        'SELECT id, title FROM notebooks WHERE owner_id=? ORDER BY created_at DESC',
-        (user['id'],)
-    ).fetchall()
-    groups = db.execute(
-        'SELECT g.id, g.name, (SELECT COUNT(*) FROM group_members gm WHERE gm.group_id=g.id) AS members FROM groups g'
-    ).fetchall()
-    return render_template('dashboard.html', user=user, notebooks=notebooks, groups=groups, current_user=user)
+    model = get_dashboard_model(user['id'])
+    return render_template('dashboard.html', user=user, notebooks=model['notebooks'],
+                           groups=model['groups'], current_user=user)
 
 # route for viewing a specific notebook
 @notebook_bp.route('/notebook/<int:notebook_id>')
 @login_required
 def view_notebook(notebook_id):
     """📘 View a specific notebook and its notes."""
-    db = get_db()
+    db = get_read_db()
+    row = db.execute('SELECT version FROM notebooks WHERE id=?', (notebook_id,)).fetchone()
+    if not row:
+        return "Notebook not found", 404
+    user = current_user()
+    year = datetime.datetime.utcnow().year
+    etag = make_etag('notebook', notebook_id, row['version'], user['id'], year)
+    cached = not_modified(etag, CACHE_PAGE)
+    if cached:
+        return cached
+
     nb = db.execute('SELECT * FROM notebooks WHERE id=?', (notebook_id,)).fetchone()
     if not nb:
         return "Notebook not found", 404
@@ -55,7 +72,8 @@ def view_notebook(notebook_id):
         'SELECT * FROM notes WHERE notebook_id=? ORDER BY updated_at DESC, created_at DESC',
         (notebook_id,)
     ).fetchall()
-    return render_template('notebook.html', notebook=nb, notes=notes, current_user=current_user())
+    page = render_template('notebook.html', notebook=nb, notes=notes, current_user=user, current_year=year)
+    return with_etag(page, etag, CACHE_PAGE)
 
 
 # ✅ Create new notebook route
@@ -80,9 +98,10 @@ def create_notebook():
             (user['id'], title, description, now, is_shared)
         )
         db.commit()
+        _invalidate_notebook_viewers(user['id'], is_shared)
 
         new_id = cur.lastrowid
-        print(f"✅ Created new notebook (ID: {new_id}) titled '{title}' for user {user['id']}")
+        log.info('Created notebook', notebook_id=new_id, user_id=user['id'], title_chars=len(title))
 
         # If AJAX (used by voice or fetch)
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
@@ -96,7 +115,6 @@ def create_notebook():
         return redirect(url_for('notebook.view_notebook', notebook_id=new_id))
 
     # --- GET request: render creation form ---
-    print(f"🧱 Rendering notebook creation form for user {user['id']}")
     return render_template('notebook_create.html', user=user)
 # route for updating notebook metadata
 @notebook_bp.route('/notebook/<int:notebook_id>', methods=['PUT'])
@@ -120,6 +138,7 @@ def update_notebook(notebook_id):
         (title, description, is_shared, notebook_id)
     )
     db.commit()
+    _invalidate_notebook_viewers(user['id'], is_shared or notebook['is_shared'])
     return jsonify({'message': 'notebook updated'})
 
 # route for deleting a notebook
@@ -137,6 +156,8 @@ def delete_notebook(notebook_id):
     db.execute('DELETE FROM notes WHERE notebook_id=?', (notebook_id,))
     db.execute('DELETE FROM notebooks WHERE id=?', (notebook_id,))
     db.commit()
+    _invalidate_notebook_viewers(user['id'], notebook['is_shared'])
+    invalidate_summary(notebook_id)
     return redirect(url_for('notebook.list_notebooks'))
 
 # Note routes
@@ -145,7 +166,17 @@ def delete_notebook(notebook_id):
 @login_required
 def view_note(note_id):
     """📝 View a specific note."""
-    db = get_db()
+    db = get_read_db()
+    user = current_user()
+    row = visible_note(db, note_id, user['id'])
+    if not row:
+        return "Note not found", 404
+    year = datetime.datetime.utcnow().year
+    etag = make_etag('note', note_id, row['version'], row['updated_at'], user['id'], user['username'], year)
+    cached = not_modified(etag, CACHE_PAGE)
+    if cached:
+        return cached
+
     note = db.execute(
         'SELECT n.*, u.username as author FROM notes n LEFT JOIN users u ON u.id=n.created_by WHERE n.id=?',
         (note_id,)
@@ -161,15 +192,16 @@ def view_note(note_id):
     ).fetchall()
     tags = db.execute('SELECT tag FROM tags WHERE note_id=?', (note_id,)).fetchall()
 
-    return render_template(
+    page = render_template(
     'note.html',
     note=note,
     notebook=notebook,
     comments=comments,
     tags=tags,
-    current_user=current_user(),
-    current_year=datetime.datetime.utcnow().year
+    current_user=user,
+    current_year=year
 )
+    return with_etag(page, etag, CACHE_PAGE)
 
 # route for creating a new note
 @notebook_bp.route('/note/create', methods=['POST'])
@@ -184,27 +216,20 @@ def create_note():
     content = request.form.get('content') or ''
     user = current_user()
     now = datetime.datetime.utcnow().isoformat()
-    db = get_db()
 
-    # Create the note
-    cur = db.execute(
-        '''
-        INSERT INTO notes (notebook_id, title, content, created_by, created_at, updated_at)
-        VALUES (?, ?, ?, ?, ?, ?)
-        ''',
-        (notebook_id, title, content, user['id'], now, now)
-    )
-    db.commit()
-
-    # Log contribution with timestamp
-    db.execute(
-        '''
-        INSERT INTO contributions (note_id, user_id, action, detail, timestamp)
-        VALUES (?, ?, ?, ?, ?)
-        ''',
-        (cur.lastrowid, user['id'], 'Created note', f'Title: {title}', datetime.datetime.utcnow())
-    )
-    db.commit()
+    # Create the note and log the contribution in one transaction
+    with unit_of_work() as db:
+        cur = db.execute(
+            '''
+            INSERT INTO notes (notebook_id, title, content, created_by, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ''',
+            (notebook_id, title, content, user['id'], now, now)
+        )
+        record_revision(db, cur.lastrowid, None, content, title, user['id'], now)
+        log_contribution(db, cur.lastrowid, user['id'], 'Created note', f'Title: {title}',
+                            datetime.datetime.utcnow().isoformat(' '))
+    invalidate_summary(notebook_id)
 
     return jsonify({'note_id': cur.lastrowid, 'message': 'note created'})
 
@@ -226,21 +251,20 @@ def update_note(note_id):
 
     data = request.get_json() or request.form
     title = data.get('title', note['title'])
-    content = data.get('content', note['content'])
+    # null content (or a note stored before content was required) is an empty note
+    content = data.get('content', note['content']) or ''
     now = datetime.datetime.utcnow().isoformat()
 
-    db.execute(
-        'UPDATE notes SET title=?, content=?, updated_at=? WHERE id=?',
-        (title, content, now, note_id)
-    )
-    db.commit()
-
-    # include timestamp in contributions
-    db.execute(
-        'INSERT INTO contributions (note_id, user_id, action, detail, timestamp) VALUES (?, ?, ?, ?, ?)',
-        (note_id, user['id'], 'Edited note', f'Title: {title}', datetime.datetime.utcnow())
-    )
-    db.commit()
+    with unit_of_work():
+        db.execute(
+            'UPDATE notes SET title=?, content=?, updated_at=? WHERE id=?',
+            (title, content, now, note_id)
+        )
+        record_revision(db, note_id, note['content'] or '', content, title, user['id'], now)
+        log_contribution(db, note_id, user['id'], 'Edited note', f'Title: {title}',
+                            datetime.datetime.utcnow().isoformat(' '))
+    invalidate_document(note_id)
+    invalidate_summary(note['notebook_id'])
 
     return jsonify({'message': 'note updated successfully'})
 
@@ -258,21 +282,98 @@ def delete_note(note_id):
     if note['created_by'] != user['id']:
         return jsonify({'error': 'unauthorized'}), 403
 
-    # Delete the note
-    db.execute('DELETE FROM notes WHERE id=?', (note_id,))
-    db.commit()
-
-    # Log the deletion with timestamp
-    from datetime import datetime
-    db.execute(
-        'INSERT INTO contributions (note_id, user_id, action, detail, timestamp) VALUES (?, ?, ?, ?, ?)',
-        (note_id, user['id'], 'Deleted note', f'Note ID: {note_id}', datetime.utcnow())
-    )
-    db.commit()
+    # Tags, comments and revisions go with the note; its contributions stay
+    # (detached, note_id NULL), and so does the record of the deletion
+    with unit_of_work():
+        db.execute('DELETE FROM notes WHERE id=?', (note_id,))
+        log_contribution(db, None, user['id'], 'Deleted note', f'Note ID: {note_id}',
+                         datetime.datetime.utcnow().isoformat(' '))
+    invalidate_summary(note['notebook_id'])
 
     return jsonify({'message': f'note {note_id} deleted successfully'})
 
 
+# 🕘 Revision history of a note: list, view, diff and restore
+def _get_note(db, note_id):
+    return db.execute('SELECT * FROM notes WHERE id=?', (note_id,)).fetchone()
+
+def _can_read(db, note_id):
+    # Notes in notebooks the user cannot see answer like missing ones
+    return visible_note(db, note_id, current_user()['id']) is not None
+
+@notebook_bp.route('/note/<int:note_id>/revisions', methods=['GET'])
+@login_required
+def note_revisions(note_id):
+    db = get_read_db()
+    if not _can_read(db, note_id):
+        return jsonify({'error': 'note not found'}), 404
+    return jsonify({'note_id': note_id, 'revisions': list_revisions(db, note_id)})
+
+@notebook_bp.route('/note/<int:note_id>/revisions/<int:revision>', methods=['GET'])
+@login_required
+def note_revision(note_id, revision):
+    db = get_read_db()
+    if not _can_read(db, note_id):
+        return jsonify({'error': 'note not found'}), 404
+    try:
+        return jsonify(get_revision(db, note_id, revision))
+    except RevisionError as e:
+        return jsonify({'error': str(e)}), 404
+
+@notebook_bp.route('/note/<int:note_id>/revisions/<int:revision>/diff', methods=['GET'])
+@login_required
+def note_revision_diff(note_id, revision):
+    """Unified diff of a revision against ?against=<revision> (default: the one before it)."""
+    against = request.args.get('against', type=int, default=revision - 1)
+    db = get_read_db()
+    if not _can_read(db, note_id):
+        return jsonify({'error': 'note not found'}), 404
+    try:
+        new = get_revision(db, note_id, revision)
+        old = get_revision(db, note_id, against) if against > 0 else {'revision': 0, 'content': ''}
+    except RevisionError as e:
+        return jsonify({'error': str(e)}), 404
+    return jsonify({'from': old['revision'], 'to': new['revision'], 'diff': diff_revisions(old, new)})
+
+@notebook_bp.route('/note/<int:note_id>/revisions/<int:revision>/restore', methods=['POST'])
+@login_required
+def restore_note_revision(note_id, revision):
+    """Make an old revision the current text again (recorded as a new revision)."""
+    db = get_db()
+    note = _get_note(db, note_id)
+    if not note:
+        return jsonify({'error': 'note not found'}), 404
+    user = current_user()
+    if note['created_by'] != user['id']:
+        return jsonify({'error': 'unauthorized'}), 403
+    try:
+        old = get_revision(db, note_id, revision)
+    except RevisionError as e:
+        return jsonify({'error': str(e)}), 404
+
+    now = datetime.datetime.utcnow().isoformat()
+    with unit_of_work():
+        db.execute(
+            'UPDATE notes SET title=?, content=?, updated_at=? WHERE id=?',
+            (old['title'] or note['title'], old['content'], now, note_id)
+        )
+        new_revision = record_revision(db, note_id, note['content'] or '', old['content'],
+                                       old['title'] or note['title'], user['id'], now)
+        log_contribution(db, note_id, user['id'], 'Restored note', f'Revision {revision}',
+                            datetime.datetime.utcnow().isoformat(' '))
+    invalidate_document(note_id)
+    invalidate_summary(note['notebook_id'])
+    notify_notebook_change(note['notebook_id'], {
+        'action': 'note_updated',
+        'note_id': note_id,
+        'title': old['title'] or note['title'],
+        'content': old['content'],
+        'updated_by': user['username'],
+        'timestamp': now
+    })
+    return jsonify({'message': f'note restored to revision {revision}', 'revision': new_revision})
+
+
 # 🏷️ Add a tag to a note (Sprint 2).
 @notebook_bp.route('/note/<int:note_id>/tags', methods=['POST'])
 @login_required
@@ -281,24 +382,78 @@ def add_tag(note_id):
     if not tag:
         return jsonify({'error': 'empty tag'}), 400
     db = get_db()
+    if not _get_note(db, note_id):
+        return jsonify({'error': 'note not found'}), 404
     db.execute('INSERT INTO tags (note_id, tag) VALUES (?, ?)', (note_id, tag))
     db.commit()
     return jsonify({'message': f'tag "{tag}" added'})
 
-# 📊 Retrieve all contributions (Sprint 2)
+# 📊 Retrieve contributions, newest first (Sprint 2)
+CONTRIBUTIONS_DEFAULT_LIMIT = 50
+CONTRIBUTIONS_MAX_LIMIT = 200
+
 @notebook_bp.route('/contributions', methods=['GET'])
 @login_required
 def get_contributions():
-    db = get_db()
-    rows = db.execute("""
-        SELECT c.id, c.note_id, c.user_id, c.action, c.detail, c.timestamp, 
+    """
+    One page of the activity log for notes the user can see.
+    Filters: ?note_id=, ?notebook_id=, ?user_id=, ?action=. Paging is keyset-based:
+    pass the returned next_before ("<timestamp>,<id>") as ?before= for the next page.
+    """
+    user = current_user()
+    args = request.args
+    limit = min(max(args.get('limit', CONTRIBUTIONS_DEFAULT_LIMIT, type=int), 1), CONTRIBUTIONS_MAX_LIMIT)
+    params = {'user_id': user['id'], 'limit': limit}
+    where = [f'n.notebook_id IN ({VISIBLE_NOTEBOOKS_SQL})']
+
+    before = args.get('before')
+    if before:
+        ts, _, cid = before.rpartition(',')
+        if not ts or not cid.isdigit():
+            return jsonify({'error': 'invalid cursor'}), 400
+        where.append('(c.timestamp, c.id) < (:before_ts, :before_id)')
+        params.update(before_ts=ts, before_id=int(cid))
+    for name, column in (('note_id', 'c.note_id'), ('notebook_id', 'n.notebook_id'), ('user_id', 'c.user_id')):
+        value = args.get(name, type=int)
+        if value is not None:
+            where.append(f'{column} = :f_{name}')
+            params[f'f_{name}'] = value
+    if args.get('action'):
+        where.append('c.action = :f_action')
+        params['f_action'] = args['action']
+
+    # Give write-behind rows queued so far (this user's last change, say) a
+    # short while to land; past that the feed may lag behind by a batch
+    contributions_writer.flush(timeout=CONTRIBUTIONS_READ_WAIT_MS / 1000)
+    db = get_read_db()
+    rows = db.execute(f"""
+        SELECT c.id, c.note_id, n.notebook_id, c.user_id, c.action, c.detail, c.timestamp,
                u.username, n.title AS note_title
         FROM contributions c
+        JOIN notes n ON c.note_id = n.id
         LEFT JOIN users u ON c.user_id = u.id
-        LEFT JOIN notes n ON c.note_id = n.id
-        ORDER BY c.timestamp DESC
-    """).fetchall()
-    return jsonify([dict(row) for row in rows])
+        WHERE {' AND '.join(where)}
+        ORDER BY c.timestamp DESC, c.id DESC
+        LIMIT :limit
+    """, params).fetchall()
+
+    items = [dict(row) for row in rows]
+    next_before = None
+    if len(items) == limit:
+        next_before = f"{items[-1]['timestamp']},{items[-1]['id']}"
+    return jsonify({'items': items, 'next_before': next_before})
+
+# Write-behind contributions log health: queue depth and flush latency
+@notebook_bp.route('/contributions/writer', methods=['GET'])
+@login_required
+def contributions_writer_stats():
+    return jsonify(contributions_writer.stats())
+
+# Live-edit autosave health: notes waiting to be written and how far behind they are
+@notebook_bp.route('/autosave', methods=['GET'])
+@login_required
+def autosave_stats():
+    return jsonify(autosave.stats())
 
 # search and summary routes
 
@@ -307,50 +462,31 @@ def get_contributions():
 # === SUMMARIZE NOTE CONTENT USING TEXT-TO-SPEECH (TTS) ===
 # ==========================================================
 
-def generate_summary(text):
-    print("[LOG] Generating summary...")
-    sentences = re.split(r'(?<=[.!?]) +', text)
-    sentences = [s.strip() for s in sentences if s.strip()]
-    if len(sentences) <= 3:
-        print("[LOG] Short content, returning full text as summary.")
-        return text
-
-    words = re.findall(r'\w+', text.lower())
-    freq = {}
-    for w in words:
-        if len(w) > 3:
-            freq[w] = freq.get(w, 0) + 1
-
-    scored = [(sum(freq.get(w, 0) for w in s.lower().split()), s) for s in sentences]
-    top_sentences = [s for _, s in sorted(scored, reverse=True)[:5]]
-    summary = " ".join(top_sentences).strip()
-    print(f"[LOG] Summary generated: {summary[:100]}{'...' if len(summary) > 100 else ''}")
-    return summary
-
 # route for summarizing notebook content
 @notebook_bp.route('/<int:notebook_id>/summarize', methods=['GET'])
 @login_required
 def summarize_notebook(notebook_id):
-    print(f"[LOG] /summarize called for notebook_id={notebook_id}")
-    db = get_db()
-    notebook = db.execute('SELECT * FROM notebooks WHERE id=?', (notebook_id,)).fetchone()
-    if not notebook:
-        print("[ERROR] Notebook not found")
+    db = get_read_db()
+    fingerprint = notebook_fingerprint(db, notebook_id)
+    if fingerprint is None:
+        log.warning('Summary of unknown notebook', notebook_id=notebook_id)
         return jsonify({'error': 'notebook not found'}), 404
 
-    notes = db.execute('SELECT title, content FROM notes WHERE notebook_id=?', (notebook_id,)).fetchall()
-    if not notes:
-        print("[LOG] No notes found in notebook")
-        return jsonify({'summary': "This notebook has no notes."})
+    # The summary is the same for every reader, so the tag is not per user
+    etag = make_etag('summary', notebook_id, fingerprint)
+    cached = not_modified(etag, CACHE_SUMMARY)
+    if cached:
+        return cached
 
-    full_text = " ".join(f"{n['title']}. {n['content']}" for n in notes if n['content']).strip()
-    if not full_text:
-        print("[LOG] Notebook content empty")
-        return jsonify({'summary': "Notebook content is empty."})
+    if fingerprint.startswith('0:'):
+        return with_etag(jsonify({'summary': "This notebook has no notes."}), etag, CACHE_SUMMARY)
 
-    summary = generate_summary(full_text)
-    print("[LOG] Returning JSON summary")
-    return jsonify({'summary': summary})
+    summary = get_notebook_summary(db, notebook_id, fingerprint)
+    if not summary:
+        return with_etag(jsonify({'summary': "Notebook content is empty."}), etag, CACHE_SUMMARY)
+
+    log.debug('Summary served', notebook_id=notebook_id, chars=len(summary))
+    return with_etag(jsonify({'summary': summary}), etag, CACHE_SUMMARY)
 
 
 # ==========================================================
@@ -363,49 +499,55 @@ def serve_summary_audio(notebook_id):
     - Uses a unique temp file per request to avoid Windows file locking
     - Generates TTS audio on the fly
     """
-    print(f"[LOG] 🎧 /summary.mp3 requested for notebook {notebook_id}")
-    db = get_db()
+    db = get_read_db()
 
-    # === Get notebook content ===
-    notes = db.execute(
-        'SELECT title, content FROM notes WHERE notebook_id=?',
-        (notebook_id,)
-    ).fetchall()
-    if not notes:
-        print("[ERROR] No notes to read.")
+    # === Get (cached) notebook summary ===
+    fingerprint = notebook_fingerprint(db, notebook_id)
+    if fingerprint is None or fingerprint.startswith('0:'):
         return jsonify({'error': 'No notes found.'}), 404
 
-    full_text = " ".join(f"{n['title']}. {n['content']}" for n in notes if n['content']).strip()
-    if not full_text:
-        print("[ERROR] Notebook content empty.")
+    summary = get_notebook_summary(db, notebook_id, fingerprint)
+    if not summary:
         return jsonify({'error': 'Notebook empty.'}), 404
 
-    # === Generate summary ===
-    summary = generate_summary(full_text)
-
     try:
-        import tempfile
-        import pyttsx3
-
-        # Create a unique temporary file for this request
-        tmp_fd, tmp_path = tempfile.mkstemp(suffix=f"_summary_{notebook_id}.mp3")
-        os.close(tmp_fd)  # Close the low-level fd
+        # Generate TTS audio in the worker pool
+        tmp_path = tts_pool.synthesize(summary, suffix=f"_summary_{notebook_id}.mp3")
 
-        # Generate TTS audio
-        engine = pyttsx3.init()
-        engine.save_to_file(summary, tmp_path)
-        engine.runAndWait()
-        engine.stop()
-
-        # Serve the file directly
-        print(f"[LOG] ✅ Serving fresh summary.mp3 for notebook {notebook_id}")
-        return send_file(tmp_path, mimetype='audio/mpeg', as_attachment=False)
+        # Serve the file, removing it once sent
+        log.info('Summary audio synthesized', notebook_id=notebook_id, chars=len(summary))
+        return send_audio(tmp_path, 'audio/mpeg')
 
+    except TTSBusy:
+        return jsonify({'error': 'Speech service busy, try again shortly.'}), 503
+    except TimeoutError:
+        return jsonify({'error': 'Summary audio timed out.'}), 504
     except Exception as e:
-        print(f"[ERROR] ❌ Failed to generate TTS summary: {e}")
+        log.error('Summary audio failed', notebook_id=notebook_id, error=str(e))
         return jsonify({'error': 'Failed to generate summary audio.'}), 500
 
 
+# route for streaming the summary as it is synthesized
+@notebook_bp.route('/<int:notebook_id>/summary/stream', methods=['GET'])
+@login_required
+def stream_summary_audio(notebook_id):
+    """Stream the notebook summary as WAV audio, one sentence chunk at a time."""
+    db = get_read_db()
+    fingerprint = notebook_fingerprint(db, notebook_id)
+    if fingerprint is None or fingerprint.startswith('0:'):
+        return jsonify({'error': 'No notes found.'}), 404
+
+    summary = get_notebook_summary(db, notebook_id, fingerprint)
+    if not summary:
+        return jsonify({'error': 'Notebook empty.'}), 404
+
+    try:
+        stream = SpeechStream(tts_pool, summary, voice=request.args.get('voice', 'male'))
+    except TTSBusy:
+        return jsonify({'error': 'Speech service busy, try again shortly.'}), 503
+    return Response(stream, mimetype='audio/wav', headers={'Cache-Control': 'no-store'})
+
+
 #----------------------------------------------------------------#
 # DEVELOP COMMENTING FEATURES FOR SPRINT 2
 #----------------------------------------------------------------#
@@ -423,23 +565,22 @@ def add_comment(note_id):
 
     if not content:
         return jsonify({'error': 'empty comment'}), 400
+    if not _get_note(db, note_id):
+        return jsonify({'error': 'note not found'}), 404
 
     # Ensure parent_id is None if empty string
     if parent_id in ('', None):
         parent_id = None
+    elif not db.execute('SELECT 1 FROM comments WHERE id=? AND note_id=?', (parent_id, note_id)).fetchone():
+        return jsonify({'error': 'parent comment not found'}), 404
 
-    db.execute(
-        'INSERT INTO comments (note_id, user_id, parent_id, content) VALUES (?, ?, ?, ?)',
-        (note_id, user['id'], parent_id, content)
-    )
-    db.commit()
-
-    # Log contribution (Sprint 2)
-    db.execute(
-        'INSERT INTO contributions (note_id, user_id, action, detail) VALUES (?, ?, ?, ?)',
-        (note_id, user['id'], 'Commented', content[:100])
-    )
-    db.commit()
+    with unit_of_work():
+        db.execute(
+            'INSERT INTO comments (note_id, user_id, parent_id, content) VALUES (?, ?, ?, ?)',
+            (note_id, user['id'], parent_id, content)
+        )
+        # Log contribution (Sprint 2)
+        log_contribution(db, note_id, user['id'], 'Commented', content[:100])
 
     return jsonify({'message': 'comment added'})
 # -----------------------------
@@ -465,18 +606,13 @@ def update_comment(comment_id):
     if not new_content:
         return jsonify({'error': 'empty comment'}), 400
 
-    db.execute(
-        'UPDATE comments SET content=?, timestamp=CURRENT_TIMESTAMP WHERE id=?',
-        (new_content, comment_id)
-    )
-    db.commit()
-
-    # Log contribution (Sprint 2)
-    db.execute(
-        'INSERT INTO contributions (note_id, user_id, action, detail) VALUES (?, ?, ?, ?)',
-        (comment['note_id'], user['id'], 'Edited comment', new_content[:100])
-    )
-    db.commit()
+    with unit_of_work():
+        db.execute(
+            'UPDATE comments SET content=?, timestamp=CURRENT_TIMESTAMP WHERE id=?',
+            (new_content, comment_id)
+        )
+        # Log contribution (Sprint 2)
+        log_contribution(db, comment['note_id'], user['id'], 'Edited comment', new_content[:100])
 
     return jsonify({'message': 'comment updated successfully'})
 
@@ -496,15 +632,10 @@ def delete_comment(comment_id):
     if comment['user_id'] != user['id']:
         return jsonify({'error': 'unauthorized'}), 403
 
-    db.execute('DELETE FROM comments WHERE id=?', (comment_id,))
-    db.commit()
-
-    # Log contribution (Sprint 2)
-    db.execute(
-        'INSERT INTO contributions (note_id, user_id, action, detail) VALUES (?, ?, ?, ?)',
-        (comment['note_id'], user['id'], 'Deleted comment', f'Comment ID: {comment_id}')
-    )
-    db.commit()
+    with unit_of_work():
+        db.execute('DELETE FROM comments WHERE id=?', (comment_id,))
+        # Log contribution (Sprint 2)
+        log_contribution(db, comment['note_id'], user['id'], 'Deleted comment', f'Comment ID: {comment_id}')
 
     return jsonify({'message': 'comment deleted successfully'})
 
@@ -517,93 +648,117 @@ def delete_comment(comment_id):
 @notebook_bp.route('/search_notebooks')
 @login_required
 def search_notebooks():
-    query = (request.args.get('query') or '').strip().lower()
+    """Ranked full-text search over the user's notes (?query=, &limit=, &offset=)."""
+    query = (request.args.get('query') or '').strip()
+    limit = min(max(request.args.get('limit', SEARCH_DEFAULT_LIMIT, type=int), 1), SEARCH_MAX_LIMIT)
+    offset = max(request.args.get('offset', 0, type=int), 0)
     user = current_user()
-    db = get_db()
-    results = []
-    notebooks = db.execute('SELECT id, title FROM notebooks WHERE owner_id=?', (user['id'],)).fetchall()
-    for nb in notebooks:
-        notes = db.execute('SELECT id, title, content FROM notes WHERE notebook_id=?', (nb['id'],)).fetchall()
-        for note in notes:
-            combined_text = f"{note['title']} {note['content']}"
-            combined_text_lower = combined_text.lower()
-            if query in combined_text_lower:
-                index = combined_text_lower.find(query)
-                start = max(0, index - 50)
-                end = min(len(combined_text), index + len(query) + 50)
-                snippet = combined_text[start:end].replace("\n", " ")
-                results.append({
-                    'notebook_id': nb['id'],
-                    'note_id': note['id'],
-                    'note_title': note['title'],
-                    'snippet': snippet
-                })
+    db = get_read_db()
+    try:
+        results = search_notes(db, user['id'], query, limit=limit, offset=offset)
+    except sqlite3.OperationalError:
+        return jsonify({'error': 'invalid search query'}), 400
     return jsonify(results)
 
 
 #=================================================================================================#
 # AI assisted note generation 
 #=================================================================================================#
-import language_tool_python
-# Initialize local AI/text tool
-tool = language_tool_python.LanguageTool('en-US')
+def _apply_grammar_correction(note_id, notebook_id, raw_content, future):
+    """
+    Runs on a grammar worker once the correction of a new note is ready.
+    The note is only rewritten if nobody edited it in the meantime.
+    """
+    try:
+        corrected = future.result()
+    except Exception as e:
+        log.warning('Grammar correction failed, keeping the original', note_id=note_id, error=str(e))
+        return
+    if corrected == raw_content:
+        return
+
+    now = datetime.datetime.utcnow().isoformat()
+    db = get_pool().acquire()
+    try:
+        cur = db.execute(
+            'UPDATE notes SET content=?, updated_at=? WHERE id=? AND content=?',
+            (corrected, now, note_id, raw_content)
+        )
+        if cur.rowcount:
+            record_revision(db, note_id, raw_content, corrected, timestamp=now)
+        db.commit()
+    finally:
+        db.close()
+    if cur.rowcount == 0:
+        return
+    invalidate_document(note_id)
+    invalidate_summary(notebook_id)
+    notify_notebook_change(notebook_id, {
+        'action': 'note_corrected',
+        'note_id': note_id,
+        'content': corrected,
+        'timestamp': now
+    })
+    log.info('Note corrected', note_id=note_id, chars=len(corrected))
 
 @notebook_bp.route('/<int:notebook_id>/add_note', methods=['POST'])
 @login_required
 def add_note(notebook_id):
-    print(f"[LOG] /add_note called for notebook_id={notebook_id}")
-
     db = get_db()
     notebook = db.execute('SELECT * FROM notebooks WHERE id=?', (notebook_id,)).fetchone()
     if not notebook:
-        print("[ERROR] Notebook not found")
         return jsonify({'error': 'Notebook not found'}), 404
 
     data = request.get_json()
     content = (data.get('content') or "").strip()
     if not content:
-        print("[ERROR] No note content provided")
         return jsonify({'error': 'No content provided'}), 400
 
-    # --- AI-assisted enhancement ---
-    try:
-        matches = tool.check(content)
-        enhanced_content = language_tool_python.utils.correct(content, matches)
-        print("[LOG] Note content enhanced using local AI tool")
-    except Exception as e:
-        print(f"[WARN] AI enhancement failed, saving original note. Error: {e}")
-        enhanced_content = content
-
     user = current_user()
     now = datetime.datetime.utcnow().isoformat()
 
-    # Add required fields created_at, updated_at, created_by
-    db.execute(
+    # Save the raw text right away; the grammar pass rewrites it in place later
+    cur = db.execute(
         '''
         INSERT INTO notes (notebook_id, title, content, created_by, created_at, updated_at)
         VALUES (?, ?, ?, ?, ?, ?)
         ''',
-        (notebook_id, 'Voice Note', enhanced_content, user['id'], now, now)
+        (notebook_id, 'Voice Note', content, user['id'], now, now)
     )
+    record_revision(db, cur.lastrowid, None, content, 'Voice Note', user['id'], now)
     db.commit()
+    note_id = cur.lastrowid
+    invalidate_summary(notebook_id)
 
-    print(f"[LOG] ✅ Note added successfully to notebook {notebook_id}")
-    return jsonify({'success': True, 'message': 'Note added successfully.'})
+    # --- AI-assisted enhancement (asynchronous, see _apply_grammar_correction) ---
+    try:
+        grammar_service.correct_async(content).add_done_callback(
+            lambda f: _apply_grammar_correction(note_id, notebook_id, content, f)
+        )
+    except Exception as e:
+        log.warning('Grammar correction unavailable, keeping the original', note_id=note_id, error=str(e))
+
+    log.info('Note added', notebook_id=notebook_id, note_id=note_id, chars=len(content))
+    return jsonify({'success': True, 'message': 'Note added successfully.', 'note_id': note_id})
 
 #=================================================================================================#
 # -----------------------------
 # SSE: Real-time Note Change Notifications # Sprint 3
 # -----------------------------
-# Dictionary to hold subscribers for each notebook
 
 def notify_notebook_change(notebook_id, note_data):
     """
-    Push note_data to all SSE subscribers of a notebook.
+    Push note_data to all SSE subscribers of a notebook, on every worker.
     note_data: dict containing 'action', 'note_id', 'content', etc.
+    A replayed event lists the long values it left out (content) in 'omitted'.
     """
-    if notebook_id in notebook_subscribers:
-        for q in notebook_subscribers[notebook_id]:
-            q.append(note_data)
+    event_bus.publish('notebook', {'notebook_id': notebook_id, 'event': note_data})
+
+def _deliver_notebook_event(event_id, payload):
+    # Runs in every worker for every published note event (see eventbus.py)
+    event_broker.publish(payload['notebook_id'], payload['event'], event_id)
+
+event_bus.subscribe('notebook', _deliver_notebook_event)
 
 @notebook_bp.route('/<int:notebook_id>/subscribe')
 @login_required
@@ -611,24 +766,33 @@ def subscribe_notebook(notebook_id):
     """
     SSE endpoint for real-time notebook updates.
     Clients can listen to this to get live updates when notes are added/updated.
+    A reconnecting EventSource sends Last-Event-ID and gets the events it missed.
     """
-    def event_stream():
-        if notebook_id not in notebook_subscribers:
-            notebook_subscribers[notebook_id] = []
-
-        q = []
-        notebook_subscribers[notebook_id].append(q)
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    sub = event_broker.subscribe(notebook_id, last_event_id)
 
+    def event_stream():
         try:
-            while True:
-                if q:
-                    data = q.pop(0)
-                    yield f"data: {json.dumps(data)}\n\n"
-                time.sleep(0.5)
-        except GeneratorExit:
-            notebook_subscribers[notebook_id].remove(q)
-
-    return Response(stream_with_context(event_stream()), mimetype="text/event-stream")
+            yield f"retry: {SSE_RETRY_MS}\n\n"
+            while not sub.closed:
+                event = sub.get(timeout=SSE_HEARTBEAT)
+                if event is None:
+                    # Comment line: keeps proxies from timing out idle streams
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"id: {event.id}\ndata: {json.dumps(event.data)}\n\n"
+        finally:
+            event_broker.unsubscribe(sub)
+
+    response = Response(stream_with_context(event_stream()), mimetype="text/event-stream")
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    # Also covers clients that go away before the stream starts
+    response.call_on_close(lambda: event_broker.unsubscribe(sub))
+    # The stream never queries; give the pooled connections back now rather
+    # than when the stream ends
+    close_connection()
+    return response
 
 # -----------------------------
 #  Add Note (with SSE notification)
@@ -659,7 +823,9 @@ def add_note_sse(notebook_id):
         ''',
         (notebook_id, 'Voice Note', content, user['id'], now, now)
     )
+    record_revision(db, cur.lastrowid, None, content, 'Voice Note', user['id'], now)
     db.commit()
+    invalidate_summary(notebook_id)
 
     # SSE notification
     notify_notebook_change(notebook_id, {
@@ -691,14 +857,18 @@ def update_note_sse(note_id):
 
     data = request.get_json() or request.form
     title = data.get('title', note['title'])
-    content = data.get('content', note['content'])
+    # null content (or a note stored before content was required) is an empty note
+    content = data.get('content', note['content']) or ''
     now = datetime.datetime.utcnow().isoformat()
 
     db.execute(
         'UPDATE notes SET title=?, content=?, updated_at=? WHERE id=?',
         (title, content, now, note_id)
     )
+    record_revision(db, note_id, note['content'] or '', content, title, user['id'], now)
     db.commit()
+    invalidate_document(note_id)
+    invalidate_summary(note['notebook_id'])
 
     # SSE notification
     notify_notebook_change(note['notebook_id'], {
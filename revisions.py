@@ -0,0 +1,263 @@
+import datetime
+import difflib
+import json
+import zlib
+import collab
+from config import REVISION_SNAPSHOT_EVERY, REVISION_MAX_PER_NOTE, REVISION_RETENTION_DAYS
+
+# -----------------------------
+# Note revision history
+# -----------------------------
+# Every saved version of a note is a row of note_revisions. A row holds either
+# a full 'snapshot' of the text or a forward 'delta': the collab operation that
+# turns the previous revision into this one ([retain, "insert", -delete, ...]),
+# as zlib-compressed JSON, so a revision costs about as much as the text it
+# touched. depth counts the deltas since the last snapshot; a new snapshot is
+# written once it reaches REVISION_SNAPSHOT_EVERY, which bounds rebuilding any
+# revision to one snapshot plus that many deltas.
+SNAPSHOT = 'snapshot'
+DELTA = 'delta'
+
+
+class RevisionError(Exception):
+    """A revision does not exist or its history cannot be rebuilt."""
+
+
+def _checksum(text):
+    return zlib.crc32(text.encode('utf-8'))
+
+
+def _common_prefix(a, b):
+    # Binary search over slice comparisons: C-speed, O(n log n)
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[:mid] == b[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def _common_suffix(a, b, limit):
+    lo, hi = 0, min(len(a), len(b), limit)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[len(a) - mid:] == b[len(b) - mid:]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def diff_op(old, new):
+    """
+    Operation turning old into new. The unchanged head and tail are found
+    first; only the span between them is diffed, line by line.
+    """
+    start = _common_prefix(old, new)
+    end = _common_suffix(old, new, min(len(old), len(new)) - start)
+    a, b = old[start:len(old) - end], new[start:len(new) - end]
+    components = [start]
+    if a and b:
+        a_lines, b_lines = a.splitlines(keepends=True), b.splitlines(keepends=True)
+        matcher = difflib.SequenceMatcher(None, a_lines, b_lines)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            removed = sum(map(len, a_lines[i1:i2]))
+            if tag == 'equal':
+                components.append(removed)
+            else:
+                components += [''.join(b_lines[j1:j2]), -removed]
+    else:
+        components += [b, -len(a)]
+    components.append(end)
+    return collab.normalize(components)
+
+
+def _encode(kind, text, op=None):
+    raw = text if kind == SNAPSHOT else json.dumps(op, ensure_ascii=False, separators=(',', ':'))
+    return zlib.compress(raw.encode('utf-8'))
+
+
+def _decode(kind, data):
+    raw = zlib.decompress(data).decode('utf-8')
+    return raw if kind == SNAPSHOT else json.loads(raw)
+
+
+# -----------------------------
+# Writing
+# -----------------------------
+def _insert(db, note_id, revision, kind, depth, data, title, text, user_id, timestamp):
+    db.execute(
+        '''
+        INSERT INTO note_revisions (note_id, revision, kind, depth, data, title, length, checksum, user_id, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''',
+        (note_id, revision, kind, depth, data, title, len(text), _checksum(text), user_id, timestamp)
+    )
+
+
+def record_revision(db, note_id, old_content, new_content, title=None, user_id=None, timestamp=None):
+    """
+    Add the revision new_content of a note, inside the caller's transaction.
+    old_content is the text the write replaced (None for a new note); a note
+    written before history was kept gets it stored as its first revision.
+    title=None keeps the previous revision's title. Returns the new revision
+    number, or None if nothing changed.
+    """
+    timestamp = timestamp or datetime.datetime.utcnow().isoformat()
+    last = db.execute(
+        'SELECT revision, depth, title, length, checksum FROM note_revisions '
+        'WHERE note_id=? ORDER BY revision DESC LIMIT 1',
+        (note_id,)
+    ).fetchone()
+
+    if last is None:
+        if old_content is None or old_content == new_content:
+            _insert(db, note_id, 1, SNAPSHOT, 0, _encode(SNAPSHOT, new_content), title,
+                    new_content, user_id, timestamp)
+            return 1
+        _insert(db, note_id, 1, SNAPSHOT, 0, _encode(SNAPSHOT, old_content), title,
+                old_content, None, timestamp)
+        last = db.execute(
+            'SELECT revision, depth, title, length, checksum FROM note_revisions WHERE note_id=? AND revision=1',
+            (note_id,)
+        ).fetchone()
+
+    if title is None:
+        title = last['title']
+    if new_content == old_content and title == last['title']:
+        return None
+
+    revision = last['revision'] + 1
+    in_step = (old_content is not None and len(old_content) == last['length']
+               and _checksum(old_content) == last['checksum'])
+    data = None
+    if in_step and last['depth'] + 1 < REVISION_SNAPSHOT_EVERY:
+        data = _encode(DELTA, None, diff_op(old_content, new_content))
+        # A rewrite of most of the note is no cheaper as a delta
+        if len(data) * 2 > len(new_content):
+            data = None
+    if data is not None:
+        _insert(db, note_id, revision, DELTA, last['depth'] + 1, data, title, new_content, user_id, timestamp)
+    else:
+        # The chain restarts here (also when the note was written without a
+        # revision, so old_content is not what the history ends with)
+        _insert(db, note_id, revision, SNAPSHOT, 0, _encode(SNAPSHOT, new_content), title,
+                new_content, user_id, timestamp)
+        compact(db, note_id)
+    return revision
+
+
+# -----------------------------
+# Reading
+# -----------------------------
+def list_revisions(db, note_id):
+    """Revision metadata of a note, newest first (no content)."""
+    rows = db.execute(
+        '''
+        SELECT r.revision, r.kind, r.title, r.length, r.created_at, r.user_id, u.username
+        FROM note_revisions r
+        LEFT JOIN users u ON u.id = r.user_id
+        WHERE r.note_id=?
+        ORDER BY r.revision DESC
+        ''',
+        (note_id,)
+    ).fetchall()
+    return [dict(row) for row in rows]
+
+
+def get_revision(db, note_id, revision):
+    """
+    Rebuild one revision: {'revision', 'title', 'content', 'created_at', 'user_id'}.
+    Reads the nearest snapshot at or before it and replays the deltas after it.
+    """
+    rows = db.execute(
+        '''
+        SELECT revision, kind, data, title, length, checksum, created_at, user_id
+        FROM note_revisions
+        WHERE note_id=? AND revision <= ? AND revision >= (
+            SELECT revision - depth FROM note_revisions WHERE note_id=? AND revision=?
+        )
+        ORDER BY revision
+        ''',
+        (note_id, revision, note_id, revision)
+    ).fetchall()
+    if not rows:
+        raise RevisionError(f'note {note_id} has no revision {revision}')
+    if rows[0]['kind'] != SNAPSHOT or len(rows) != rows[-1]['revision'] - rows[0]['revision'] + 1:
+        raise RevisionError(f'history of note {note_id} is broken before revision {revision}')
+
+    text = _decode(SNAPSHOT, rows[0]['data'])
+    for row in rows[1:]:
+        text = collab.apply(text, _decode(DELTA, row['data']))
+    target = rows[-1]
+    if len(text) != target['length'] or _checksum(text) != target['checksum']:
+        raise RevisionError(f'revision {revision} of note {note_id} does not match its checksum')
+    return {
+        'revision': target['revision'],
+        'title': target['title'],
+        'content': text,
+        'created_at': target['created_at'],
+        'user_id': target['user_id'],
+    }
+
+
+def diff_revisions(old, new, context=3):
+    """Unified diff between two revisions returned by get_revision."""
+    return ''.join(difflib.unified_diff(
+        old['content'].splitlines(keepends=True),
+        new['content'].splitlines(keepends=True),
+        fromfile=f"revision {old['revision']}",
+        tofile=f"revision {new['revision']}",
+        n=context,
+    ))
+
+
+# -----------------------------
+# Retention and compaction
+# -----------------------------
+def compact(db, note_id, max_revisions=REVISION_MAX_PER_NOTE, retention_days=REVISION_RETENTION_DAYS, now=None):
+    """
+    Drop the revisions of a note beyond the newest max_revisions and those
+    older than retention_days (0 disables either rule); the latest revision
+    is always kept. If the oldest kept revision is a delta it is rewritten as
+    a snapshot and its chain rebased on it. Returns the number of rows deleted.
+    """
+    now = now or datetime.datetime.utcnow()
+    cutoff = (now - datetime.timedelta(days=retention_days)).isoformat() if retention_days else None
+    # Revisions are numbered without gaps, so the oldest one tells whether
+    # either limit is crossed (usually neither is) without reading them all
+    oldest, newest = db.execute(
+        'SELECT MIN(revision), MAX(revision) FROM note_revisions WHERE note_id=?', (note_id,)
+    ).fetchone()
+    if oldest is None or oldest == newest:
+        return 0
+    oldest_at = db.execute('SELECT created_at FROM note_revisions WHERE note_id=? AND revision=?',
+                           (note_id, oldest)).fetchone()[0]
+    if not ((max_revisions and newest - oldest + 1 > max_revisions) or (cutoff and oldest_at < cutoff)):
+        return 0
+
+    rows = db.execute(
+        'SELECT revision, created_at FROM note_revisions WHERE note_id=? ORDER BY revision DESC',
+        (note_id,)
+    ).fetchall()
+    keep = rows[:max_revisions] if max_revisions else rows
+    if cutoff:
+        keep = [rows[0]] + [row for row in keep[1:] if row['created_at'] >= cutoff]
+    first = keep[-1]['revision']
+    if first == rows[-1]['revision']:
+        return 0
+
+    base = get_revision(db, note_id, first)
+    db.execute(
+        "UPDATE note_revisions SET kind=?, depth=0, data=? WHERE note_id=? AND revision=?",
+        (SNAPSHOT, _encode(SNAPSHOT, base['content']), note_id, first)
+    )
+    # Deltas that hung off a snapshot now deleted count from the new one
+    db.execute(
+        'UPDATE note_revisions SET depth = revision - ? WHERE note_id=? AND revision > ? AND revision - depth < ?',
+        (first, note_id, first, first)
+    )
+    cur = db.execute('DELETE FROM note_revisions WHERE note_id=? AND revision < ?', (note_id, first))
+    return cur.rowcount
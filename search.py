@@ -0,0 +1,60 @@
+import html
+import re
+
+# -----------------------------
+# Full-text note search (FTS5)
+# -----------------------------
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+
+_TERM_RE = re.compile(r'"([^"]*)"|(\S+)')
+# snippet() brackets matches with these private-use characters; the note text
+# is HTML-escaped first and only then are they turned into <mark> tags
+_MARK_OPEN, _MARK_CLOSE = '\ue000', '\ue001'
+
+
+def build_match_query(text):
+    """
+    Turn free text typed by a user into an FTS5 MATCH expression.
+    Quoted parts become phrase queries, every other word a prefix query;
+    all parts must match. Returns None when there is nothing to search for.
+    """
+    parts = []
+    for phrase, word in _TERM_RE.findall(text or ''):
+        if phrase.strip():
+            parts.append('"%s"' % phrase.strip().replace('"', '""'))
+        elif word:
+            word = word.strip('"')
+            if re.search(r'\w', word):
+                parts.append('"%s"*' % word.replace('"', '""'))
+    return ' '.join(parts) or None
+
+
+def _highlight(snippet):
+    """HTML for a snippet: the note text escaped, the matches in <mark>."""
+    return html.escape(snippet).replace(_MARK_OPEN, '<mark>').replace(_MARK_CLOSE, '</mark>')
+
+
+def search_notes(db, owner_id, text, limit=SEARCH_DEFAULT_LIMIT, offset=0):
+    """Return one page of the owner's notes matching text, best match first."""
+    match = build_match_query(text)
+    if match is None:
+        return []
+    rows = db.execute(
+        '''
+        SELECT n.notebook_id, n.id AS note_id, n.title AS note_title,
+               snippet(notes_fts, -1, ?, ?, '…', 16) AS snippet,
+               bm25(notes_fts) AS rank
+        FROM notes_fts
+        JOIN notes n ON n.id = notes_fts.rowid
+        JOIN notebooks nb ON nb.id = n.notebook_id
+        WHERE notes_fts MATCH ? AND nb.owner_id = ?
+        ORDER BY rank
+        LIMIT ? OFFSET ?
+        ''',
+        (_MARK_OPEN, _MARK_CLOSE, match, owner_id, limit, offset)
+    ).fetchall()
+    results = [dict(row) for row in rows]
+    for result in results:
+        result['snippet'] = _highlight(result['snippet'] or '')
+    return results
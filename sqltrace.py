@@ -0,0 +1,238 @@
+import functools
+import re
+import threading
+import time
+from collections import OrderedDict
+from flask import g, request
+import database
+from applog import get_logger
+from config import SQL_TRACE, SQL_TRACE_EXPLAIN, SQL_TRACE_REPEAT_THRESHOLD
+
+# -----------------------------
+# Per-request SQL tracer
+# -----------------------------
+# When enabled, the connections get_db/get_read_db hand to a request are
+# wrapped in a TracedConnection that records every statement: normalized SQL,
+# time (execute plus fetches), rows returned and whether its query plan scans
+# a whole table. After the request a one-line summary goes into the
+# X-SQL-Trace response header and the log, with the statements that repeated
+# (the N+1 pattern) and the full scans spelled out.
+HEADER = 'X-SQL-Trace'
+log = get_logger('sqltrace')
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST_RE = re.compile(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)+\s*\)', re.I)
+_SPACE_RE = re.compile(r'\s+')
+_EXPLAINABLE = ('SELECT', 'WITH', 'UPDATE', 'DELETE')
+
+
+@functools.lru_cache(maxsize=1024)
+def normalize_sql(sql):
+    """SQL with literals replaced by ?, IN lists folded and whitespace collapsed."""
+    sql = _STRING_RE.sub('?', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    sql = _SPACE_RE.sub(' ', sql).strip()
+    return _IN_LIST_RE.sub('IN (?...)', sql)
+
+
+def full_scans(plan_rows):
+    """Tables an EXPLAIN QUERY PLAN result reads in full (no index, not a virtual table)."""
+    scans = []
+    for row in plan_rows:
+        detail = row[-1]
+        if detail.startswith('SCAN ') and ' USING ' not in detail and 'VIRTUAL TABLE' not in detail:
+            scans.append(detail[5:].split(' ')[0])
+    return scans
+
+
+class Statement:
+    __slots__ = ('sql', 'params', 'seconds', 'rows', 'full_scans')
+
+    def __init__(self, sql, params):
+        self.sql = normalize_sql(sql)
+        self.params = params
+        self.seconds = 0.0
+        self.rows = 0
+        self.full_scans = ()
+
+
+class RequestTrace:
+    """The statements of one request, in order."""
+
+    def __init__(self):
+        self.statements = []
+
+    def report(self, repeat_threshold=SQL_TRACE_REPEAT_THRESHOLD):
+        by_sql = {}
+        for st in self.statements:
+            by_sql.setdefault(st.sql, []).append(st)
+        repeated = [
+            {'sql': sql, 'count': len(sts), 'distinct_params': len({repr(st.params) for st in sts}),
+             'ms': round(sum(st.seconds for st in sts) * 1000, 2)}
+            for sql, sts in by_sql.items() if len(sts) >= repeat_threshold
+        ]
+        scans = {}
+        for st in self.statements:
+            for table in st.full_scans:
+                scans.setdefault((st.sql, table), 0)
+                scans[(st.sql, table)] += 1
+        return {
+            'statements': len(self.statements),
+            'ms': round(sum(st.seconds for st in self.statements) * 1000, 2),
+            'rows': sum(st.rows for st in self.statements),
+            'repeated': sorted(repeated, key=lambda r: -r['count']),
+            'full_scans': [{'sql': sql, 'table': table, 'count': n} for (sql, table), n in scans.items()],
+        }
+
+
+class TracedCursor:
+    """Counts the rows fetched and the time spent fetching them."""
+
+    def __init__(self, cursor, statement):
+        self._cursor = cursor
+        self._statement = statement
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def _timed(self, fetch, *args):
+        start = time.perf_counter()
+        result = fetch(*args)
+        self._statement.seconds += time.perf_counter() - start
+        return result
+
+    def fetchone(self):
+        row = self._timed(self._cursor.fetchone)
+        self._statement.rows += row is not None
+        return row
+
+    def fetchmany(self, *args):
+        rows = self._timed(self._cursor.fetchmany, *args)
+        self._statement.rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(self._cursor.fetchall)
+        self._statement.rows += len(rows)
+        return rows
+
+    def __iter__(self):
+        while True:
+            row = self.fetchone()
+            if row is None:
+                return
+            yield row
+
+
+class TracedConnection:
+    """A request's connection that adds each statement it runs to trace."""
+
+    def __init__(self, conn, tracer, trace):
+        self._conn = conn
+        self._tracer = tracer
+        self._trace = trace
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._conn.__exit__(*exc)
+
+    def _run(self, method, sql, params, plan_params):
+        statement = Statement(sql, params)
+        start = time.perf_counter()
+        cursor = method(sql, params)
+        statement.seconds = time.perf_counter() - start
+        if cursor.description is None and cursor.rowcount > 0:
+            statement.rows = cursor.rowcount
+        statement.full_scans = self._tracer.plan(self._conn, sql, plan_params)
+        self._trace.statements.append(statement)
+        return TracedCursor(cursor, statement)
+
+    def execute(self, sql, parameters=()):
+        return self._run(self._conn.execute, sql, parameters, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        # One statement for the whole batch: its params are every row's, its
+        # rows the rows changed; any one row's parameters give the plan
+        seq = list(seq_of_parameters)
+        return self._run(self._conn.executemany, sql, seq, seq[0] if seq else ())
+
+
+class SQLTracer:
+    """
+    Switchable tracer (enabled from SQL_TRACE). Query plans are looked up once
+    per normalized statement and remembered, so tracing adds an EXPLAIN only
+    the first time a statement shape is seen.
+    """
+
+    def __init__(self, enabled=SQL_TRACE, explain=SQL_TRACE_EXPLAIN,
+                 repeat_threshold=SQL_TRACE_REPEAT_THRESHOLD, plan_cache_size=512):
+        self.enabled = enabled
+        self.explain = explain
+        self.repeat_threshold = repeat_threshold
+        self.plan_cache_size = plan_cache_size
+        self._plans = OrderedDict()
+        self._lock = threading.Lock()
+
+    def plan(self, conn, sql, params):
+        """Tables the statement scans in full ((), if unknown or not a query)."""
+        if not self.explain or not sql.lstrip()[:6].upper().startswith(_EXPLAINABLE):
+            return ()
+        key = normalize_sql(sql)
+        with self._lock:
+            if key in self._plans:
+                self._plans.move_to_end(key)
+                return self._plans[key]
+        try:
+            # On the raw connection: the EXPLAIN itself is neither traced nor timed
+            raw = conn._live() if hasattr(conn, '_live') else conn
+            scans = tuple(full_scans(raw.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()))
+        except Exception:
+            scans = ()
+        with self._lock:
+            self._plans[key] = scans
+            if len(self._plans) > self.plan_cache_size:
+                self._plans.popitem(last=False)
+        return scans
+
+    def wrap(self, conn):
+        """database.wrap_request_connections hook: trace conn if the tracer is on."""
+        if not self.enabled:
+            return conn
+        trace = g.get('_sql_trace')
+        if trace is None:
+            trace = g._sql_trace = RequestTrace()
+        return TracedConnection(conn, self, trace)
+
+    def finish(self, response):
+        """after_request hook: add the report header and log it."""
+        trace = g.pop('_sql_trace', None)
+        if trace is None:
+            return response
+        report = trace.report(self.repeat_threshold)
+        response.headers[HEADER] = (
+            f"statements={report['statements']}; ms={report['ms']}; rows={report['rows']}; "
+            f"repeated={len(report['repeated'])}; full_scans={len(report['full_scans'])}"
+        )
+        log.info('SQL trace', method=request.method, path=request.path, statements=report['statements'],
+                 ms=report['ms'], rows=report['rows'])
+        for r in report['repeated']:
+            log.warning('SQL statement repeated', path=request.path, **r)
+        for s in report['full_scans']:
+            log.warning('SQL full table scan', path=request.path, **s)
+        return response
+
+
+sql_tracer = SQLTracer()
+
+
+def init_app(app):
+    """Install the tracer; it only records anything while sql_tracer.enabled is set."""
+    database.wrap_request_connections(sql_tracer.wrap)
+    app.after_request(sql_tracer.finish)
@@ -0,0 +1,95 @@
+import importlib
+import threading
+import time
+from contextlib import contextmanager
+
+# -----------------------------
+# Startup cost accounting
+# -----------------------------
+# (name, kind, seconds) in the order they were measured; kind is 'import' or 'init'
+_timings = []
+
+@contextmanager
+def timed(name, kind):
+    """Record how long the wrapped block takes under name/kind."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _timings.append((name, kind, time.perf_counter() - start))
+
+def timed_imports(*module_names):
+    """Import modules one by one, recording the cost of each."""
+    for name in module_names:
+        with timed(name, 'import'):
+            importlib.import_module(name)
+
+def report():
+    """Measured import and init costs, most expensive first."""
+    rows = [{'name': n, 'kind': k, 'ms': round(s * 1000, 1)} for n, k, s in _timings]
+    return sorted(rows, key=lambda r: r['ms'], reverse=True)
+
+def print_report():
+    print("[LOG] Startup cost by module:")
+    for row in report():
+        print(f"[LOG]   {row['ms']:>9.1f} ms  {row['kind']:<6}  {row['name']}")
+
+
+# -----------------------------
+# Lazily initialized heavy dependencies
+# -----------------------------
+_resources = {}
+
+class LazyResource:
+    """
+    A heavy object (ML model, external server, ...) built on first use.
+    A failed build is remembered for retry_after seconds so callers fall back
+    quickly instead of paying the start-up cost on every request.
+    """
+
+    def __init__(self, name, factory, retry_after=60):
+        self.name = name
+        self._factory = factory
+        self._retry_after = retry_after
+        self._value = None
+        self._loaded = False
+        self._error = None
+        self._failed_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def get(self):
+        if self._loaded:
+            return self._value
+        with self._lock:
+            if self._loaded:
+                return self._value
+            if self._error is not None and time.monotonic() - self._failed_at < self._retry_after:
+                raise self._error
+            try:
+                with timed(self.name, 'init'):
+                    self._value = self._factory()
+            except Exception as e:
+                self._error, self._failed_at = e, time.monotonic()
+                raise
+            self._error = None
+            self._loaded = True
+            return self._value
+
+def lazy(name, factory, retry_after=60):
+    """Register a heavy dependency to be built on first use (or by warm_up)."""
+    resource = _resources[name] = LazyResource(name, factory, retry_after)
+    return resource
+
+def warm_up(names=None):
+    """Build registered resources now; failures are reported, not raised."""
+    for name, resource in list(_resources.items()):
+        if names is not None and name not in names:
+            continue
+        try:
+            resource.get()
+        except Exception as e:
+            print(f"[WARN] Warm-up of {name} failed: {e}")
@@ -22,6 +22,126 @@ document.addEventListener('DOMContentLoaded', async () => {
 
   socket.emit('join_note', { note_id: noteId });
 
+  // ==============================
+  // LIVE COLLABORATIVE EDITING
+  // ==============================
+  // Edits travel as operations (see collab.py): [retain n, "insert", -delete n, ...].
+  // Lengths count Unicode code points, like the server does.
+  const collab = { rev: 0, shadow: editor.value, outstanding: null, ready: false };
+
+  function cpLength(s) { let n = 0; for (const _ of s) n++; return n; }
+  function cpAdvance(s, pos, n) {
+    while (n-- > 0 && pos < s.length) {
+      const c = s.charCodeAt(pos);
+      pos += (c >= 0xD800 && c < 0xDC00) ? 2 : 1;
+    }
+    return pos;
+  }
+
+  function pushComponent(op, c) {
+    const last = op[op.length - 1];
+    if (typeof c === 'string') {
+      if (typeof last === 'string') op[op.length - 1] += c;
+      else if (typeof last === 'number' && last < 0) {
+        if (typeof op[op.length - 2] === 'string') op[op.length - 2] += c;
+        else op.splice(op.length - 1, 0, c);
+      } else op.push(c);
+    } else if (typeof last === 'number' && (last > 0) === (c > 0)) op[op.length - 1] += c;
+    else op.push(c);
+  }
+
+  function applyOp(text, op) {
+    let out = '', pos = 0;
+    for (const c of op) {
+      if (typeof c === 'string') out += c;
+      else if (c > 0) { const end = cpAdvance(text, pos, c); out += text.slice(pos, end); pos = end; }
+      else pos = cpAdvance(text, pos, -c);
+    }
+    return out;
+  }
+
+  // Returns [a2, b2] with apply(apply(t, a), b2) === apply(apply(t, b), a2)
+  function transformOps(a, b) {
+    const a2 = [], b2 = [];
+    let i = 0, j = 0, ca = a[0], cb = b[0];
+    while (ca !== undefined || cb !== undefined) {
+      if (typeof ca === 'string') { pushComponent(a2, ca); pushComponent(b2, cpLength(ca)); ca = a[++i]; continue; }
+      if (typeof cb === 'string') { pushComponent(a2, cpLength(cb)); pushComponent(b2, cb); cb = b[++j]; continue; }
+      const n = Math.min(Math.abs(ca), Math.abs(cb));
+      if (ca > 0 && cb > 0) { pushComponent(a2, n); pushComponent(b2, n); }
+      else if (ca < 0 && cb > 0) pushComponent(a2, -n);
+      else if (ca > 0 && cb < 0) pushComponent(b2, -n);
+      ca = (ca > 0 ? ca - n : ca + n) || a[++i];
+      cb = (cb > 0 ? cb - n : cb + n) || b[++j];
+    }
+    return [a2, b2];
+  }
+
+  // Smallest single-span operation turning oldText into newText
+  function diffOp(oldText, newText) {
+    let start = 0;
+    while (start < oldText.length && start < newText.length && oldText[start] === newText[start]) start++;
+    if (start > 0 && /[\uD800-\uDBFF]/.test(oldText[start - 1])) start--;
+    let end = 0;
+    while (end < oldText.length - start && end < newText.length - start &&
+           oldText[oldText.length - 1 - end] === newText[newText.length - 1 - end]) end++;
+    if (end > 0 && /[\uDC00-\uDFFF]/.test(oldText[oldText.length - end])) end--;
+    const op = [];
+    if (start) pushComponent(op, cpLength(oldText.slice(0, start)));
+    const inserted = newText.slice(start, newText.length - end);
+    if (inserted) pushComponent(op, inserted);
+    const deleted = cpLength(oldText.slice(start, oldText.length - end));
+    if (deleted) pushComponent(op, -deleted);
+    if (end) pushComponent(op, cpLength(oldText.slice(oldText.length - end)));
+    return op;
+  }
+
+  function setEditorText(text) {
+    const { selectionStart, selectionEnd } = editor;
+    editor.value = text;
+    editor.setSelectionRange(Math.min(selectionStart, text.length), Math.min(selectionEnd, text.length));
+  }
+
+  // At most one operation is in flight; later typing is diffed once it is acknowledged
+  function sendPending() {
+    if (!collab.ready || collab.outstanding || editor.value === collab.shadow) return;
+    const op = diffOp(collab.shadow, editor.value);
+    collab.outstanding = op;
+    collab.shadow = editor.value;
+    socket.emit('edit', { note_id: noteId, rev: collab.rev, op });
+  }
+
+  function loadDocument(doc) {
+    collab.rev = doc.rev;
+    collab.shadow = doc.content;
+    collab.outstanding = null;
+    collab.ready = true;
+    setEditorText(doc.content);
+  }
+
+  socket.on('doc', loadDocument);
+  socket.on('resync', loadDocument);
+  socket.on('ack', (msg) => {
+    collab.rev = msg.rev;
+    collab.outstanding = null;
+    sendPending();
+  });
+  socket.on('update', (msg) => {
+    if (!collab.ready) return;
+    let remote = msg.op;
+    if (collab.outstanding) [collab.outstanding, remote] = transformOps(collab.outstanding, remote);
+    const local = diffOp(collab.shadow, editor.value);
+    collab.shadow = applyOp(collab.shadow, remote);
+    setEditorText(applyOp(collab.shadow, transformOps(local, remote)[0]));
+    collab.rev = msg.rev;
+  });
+
+  let editTimer;
+  editor.addEventListener('input', () => {
+    clearTimeout(editTimer);
+    editTimer = setTimeout(sendPending, 150);
+  });
+
   // ==============================
   // SPEECH SYNTHESIS
   // ==============================
@@ -82,6 +202,7 @@ document.addEventListener('DOMContentLoaded', async () => {
     dictationRecognition.onresult = (event) => {
       const transcript = event.results[event.results.length - 1][0].transcript;
       editor.value += (editor.value ? " " : "") + transcript;
+      editor.dispatchEvent(new Event('input'));
     };
 
     dictationRecognition.onerror = () => speak("Dictation error occurred.");
@@ -108,7 +229,6 @@ document.addEventListener('DOMContentLoaded', async () => {
     });
     if (res.ok) {
       noteContent.innerHTML = `<pre>${content}</pre>`;
-      socket.emit('edit', { note_id: noteId, content });
       speak("Note saved.");
       logContribution("save", "Updated note content.");
     }
@@ -468,7 +588,7 @@ document.addEventListener('DOMContentLoaded', async () => {
         }
 
         try {
-          const audioUrl = `/notebook/${notebookId}/summary.mp3?ts=${Date.now()}`;
+          const audioUrl = `/notebook/${notebookId}/summary/stream?ts=${Date.now()}`;
           const audioPlayer = new Audio(audioUrl);
           audioPlayer.autoplay = true;
           window.currentSummaryAudio = audioPlayer;
@@ -0,0 +1,98 @@
+import datetime
+import threading
+from collections import OrderedDict
+from database import get_db
+from summarizer import summarize
+from metrics import registry
+from applog import get_logger
+from eventbus import invalidate, on_invalidate
+from config import SUMMARY_CACHE_SIZE
+
+# -----------------------------
+# Extractive summarizer
+# -----------------------------
+SUMMARY_SECONDS = registry.histogram('notebridge_summarizer_seconds', 'Time to summarize a notebook.')
+SUMMARY_CHARS = registry.counter('notebridge_summarizer_chars_total', 'Characters of notebook text summarized.')
+log = get_logger('summaries')
+
+
+def generate_summary(text):
+    with SUMMARY_SECONDS.time():
+        summary = summarize(text)
+    SUMMARY_CHARS.inc(len(text))
+    log.debug('Summary generated', chars=len(text), summary_chars=len(summary))
+    return summary
+
+
+# -----------------------------
+# Notebook summary cache
+# -----------------------------
+# notebook_id -> (fingerprint, summary), least recently used first.
+# Backed by the notebook_summaries table so summaries survive restarts.
+_summary_cache = OrderedDict()
+_summary_lock = threading.Lock()
+
+def notebook_fingerprint(db, notebook_id):
+    """
+    Cheap content fingerprint of a notebook: "<note count>:<latest updated_at>".
+    Answered from the notes index; returns None if the notebook does not exist.
+    """
+    row = db.execute(
+        '''
+        SELECT nb.id, COUNT(n.id) AS note_count, MAX(n.updated_at) AS last_updated
+        FROM notebooks nb LEFT JOIN notes n ON n.notebook_id = nb.id
+        WHERE nb.id=?
+        GROUP BY nb.id
+        ''',
+        (notebook_id,)
+    ).fetchone()
+    if row is None:
+        return None
+    return f"{row['note_count']}:{row['last_updated'] or ''}"
+
+def invalidate_summary(notebook_id):
+    """Forget the in-memory summary of a notebook after one of its notes changed, on every worker."""
+    invalidate('summary', [notebook_id])
+
+def _drop_summaries(notebook_ids):
+    with _summary_lock:
+        for notebook_id in notebook_ids:
+            _summary_cache.pop(notebook_id, None)
+
+on_invalidate('summary', _drop_summaries)
+
+def get_notebook_summary(db, notebook_id, fingerprint):
+    """
+    Summary of all notes in a notebook ('' if they have no content), computed
+    only when the fingerprint differs from the cached one.
+    """
+    with _summary_lock:
+        cached = _summary_cache.get(notebook_id)
+        if cached and cached[0] == fingerprint:
+            _summary_cache.move_to_end(notebook_id)
+            return cached[1]
+
+    row = db.execute(
+        'SELECT summary FROM notebook_summaries WHERE notebook_id=? AND fingerprint=?',
+        (notebook_id, fingerprint)
+    ).fetchone()
+    if row is not None:
+        summary = row['summary']
+    else:
+        notes = db.execute('SELECT title, content FROM notes WHERE notebook_id=?', (notebook_id,)).fetchall()
+        full_text = " ".join(f"{n['title']}. {n['content']}" for n in notes if n['content']).strip()
+        summary = generate_summary(full_text) if full_text else ''
+        wdb = get_db()
+        wdb.execute(
+            'INSERT OR REPLACE INTO notebook_summaries (notebook_id, fingerprint, summary, created_at) '
+            'VALUES (?, ?, ?, ?)',
+            (notebook_id, fingerprint, summary, datetime.datetime.utcnow().isoformat())
+        )
+        wdb.commit()
+
+    with _summary_lock:
+        _summary_cache[notebook_id] = (fingerprint, summary)
+        _summary_cache.move_to_end(notebook_id)
+        while len(_summary_cache) > SUMMARY_CACHE_SIZE:
+            _summary_cache.popitem(last=False)
+    return summary
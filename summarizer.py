@@ -0,0 +1,113 @@
+import math
+import re
+import numpy as np
+from config import SUMMARY_MAX_SENTENCES, SUMMARY_MAX_CHARS
+
+# -----------------------------
+# Vectorized extractive summarizer
+# -----------------------------
+# Text is tokenized once with str.split(); every distinct whitespace-separated
+# chunk gets an integer id and all per-token work after that is NumPy.
+# A sentence ends with a chunk ending in . ! or ? (the old "(?<=[.!?]) +" rule).
+_SENTENCE_END = ('.', '!', '?')
+_EDGE_PUNCT_RE = re.compile(r'^\W+|\W+$')
+# Words this short carry little topic information and are not scored
+MIN_WORD_LENGTH = 4
+
+
+class Document:
+    """
+    A tokenized text: the chunks, their term ids (-1 for unscored words),
+    the sentence of every chunk and where each sentence starts.
+    """
+
+    def __init__(self, text):
+        self.chunks = text.split()
+        index = {chunk: i for i, chunk in enumerate(dict.fromkeys(self.chunks))}
+        chunk_ids = np.fromiter(map(index.__getitem__, self.chunks), dtype=np.int64,
+                                count=len(self.chunks))
+
+        # Per distinct chunk (small) -> per token (large) through fancy indexing
+        terms = {}
+        term_of_chunk = np.empty(len(index), dtype=np.int64)
+        ends_sentence = np.empty(len(index), dtype=bool)
+        for chunk, i in index.items():
+            word = _EDGE_PUNCT_RE.sub('', chunk.lower())
+            term_of_chunk[i] = terms.setdefault(word, len(terms)) if len(word) >= MIN_WORD_LENGTH else -1
+            ends_sentence[i] = chunk.endswith(_SENTENCE_END)
+        self.n_terms = max(len(terms), 1)
+
+        self.term_ids = term_of_chunk[chunk_ids]
+        ends = ends_sentence[chunk_ids]
+        if len(ends):
+            ends[-1] = True
+        self.sentence_ids = np.cumsum(ends) - ends
+        self.sentence_starts = np.concatenate(([0], np.flatnonzero(ends)[:-1] + 1)) if len(ends) else np.zeros(0, np.int64)
+        self.n_sentences = len(self.sentence_starts)
+
+    def sentence(self, i):
+        end = self.sentence_starts[i + 1] if i + 1 < self.n_sentences else len(self.chunks)
+        return ' '.join(self.chunks[self.sentence_starts[i]:end])
+
+    def term_sentence_matrix(self):
+        """Sparse term-sentence count matrix in coordinate form: (rows, cols, counts)."""
+        scored = self.term_ids >= 0
+        keys = self.sentence_ids[scored] * self.n_terms + self.term_ids[scored]
+        pairs, counts = np.unique(keys, return_counts=True)
+        return pairs // self.n_terms, pairs % self.n_terms, counts
+
+
+def score_sentences(doc):
+    """
+    TF-IDF centroid score of every sentence: the cosine similarity between
+    the sentence's TF-IDF vector and the vector of the whole document.
+    """
+    rows, cols, counts = doc.term_sentence_matrix()
+    n = doc.n_sentences
+    if len(rows) == 0:
+        return np.zeros(n)
+    df = np.bincount(cols, minlength=doc.n_terms)
+    idf = np.log((1 + n) / (1 + df)) + 1
+    weights = counts * idf[cols]
+    centroid = np.bincount(cols, weights=weights, minlength=doc.n_terms)
+
+    dot = np.bincount(rows, weights=weights * centroid[cols], minlength=n)
+    norms = np.sqrt(np.bincount(rows, weights=weights ** 2, minlength=n)) * np.linalg.norm(centroid)
+    return np.divide(dot, norms, out=np.zeros(n), where=norms > 0)
+
+
+def summarize(text, max_sentences=SUMMARY_MAX_SENTENCES, max_chars=SUMMARY_MAX_CHARS, ratio=None):
+    """
+    Extract the best-scoring sentences of text, returned in document order.
+    max_sentences caps the number of sentences (ratio, if given, caps it at
+    that fraction of the document instead); max_chars, if non-zero, caps
+    the summary length. Text that already fits is returned unchanged.
+    """
+    doc = Document(text)
+    if ratio is not None:
+        max_sentences = max(1, math.ceil(doc.n_sentences * ratio))
+    if doc.n_sentences <= max_sentences and (not max_chars or len(text) <= max_chars):
+        return text.strip()
+
+    # Stable sort: on equal scores the earlier sentence wins
+    order = np.argsort(-score_sentences(doc), kind='stable')
+    chosen, length = [], 0
+    for i in order:
+        if len(chosen) == max_sentences:
+            break
+        sentence = doc.sentence(i)
+        # length counts the space before the next sentence
+        if max_chars and length + len(sentence) > max_chars:
+            continue
+        chosen.append(i)
+        length += len(sentence) + 1
+    if not chosen and len(order):
+        # Not even one sentence fits: cut the best one at a word boundary
+        return _truncate(doc.sentence(order[0]), max_chars)
+    return ' '.join(doc.sentence(i) for i in sorted(chosen))
+
+
+def _truncate(sentence, max_chars):
+    cut = sentence.rfind(' ', 0, max_chars)
+    cut = cut if cut > 0 else max_chars - 1
+    return sentence[:cut].rstrip() + '…'
@@ -2,9 +2,15 @@ import os
 import unittest
 import tempfile
 import sqlite3
+import re
 from app import app
 import database                     # Import database module to patch DATABASE variable
 from database import get_db, init_db
+import migrations
+import summaries
+from contributions import ContributionsWriter, contributions_writer
+from dashboard import invalidate_dashboard
+from autosave import autosave
 
 
 class NoteBridgeTestCase(unittest.TestCase):
@@ -30,9 +36,31 @@ class NoteBridgeTestCase(unittest.TestCase):
             init_db(db)
 
     def tearDown(self):
+        autosave.flush()
+        contributions_writer.flush()
+        invalidate_dashboard()
+        summaries._summary_cache.clear()
+        database.close_pools()
         os.close(self.db_fd)
         os.unlink(self.db_path)
 
+    def _login(self, username="user1", password="pass1"):
+        self.client.post("/register", data={
+            "username": username, "password": password, "full_name": username
+        })
+        self.client.post("/login", data={"username": username, "password": password})
+
+    def _create_notebook(self, title="NB"):
+        rv = self.client.post("/notebook/create", data={"title": title},
+                              headers={"X-Requested-With": "XMLHttpRequest"})
+        return rv.get_json()["notebook_id"]
+
+    def _create_note(self, notebook_id, title, content):
+        rv = self.client.post("/notebook/note/create", data={
+            "notebook_id": str(notebook_id), "title": title, "content": content
+        })
+        return rv.get_json()["note_id"]
+
     def test_index_page(self):
         rv = self.client.get("/")
         self.assertEqual(rv.status_code, 200)
@@ -111,6 +139,1052 @@ class NoteBridgeTestCase(unittest.TestCase):
         with self.assertRaises(sqlite3.ProgrammingError):
             stored.execute("SELECT 1")
 
+    def test_db_pool_reuses_connections(self):
+        with app.app_context():
+            first = get_db()._conn
+        with app.app_context():
+            db = get_db()
+            self.assertIs(db._conn, first)
+            self.assertEqual(db.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+            self.assertEqual(db.execute("PRAGMA foreign_keys").fetchone()[0], 1)
+
+    def test_db_pool_is_bounded(self):
+        pool = database.ConnectionPool(self.db_path, 2, timeout=0.05)
+        try:
+            first, second = pool.acquire(), pool.acquire()
+            with self.assertRaises(database.PoolTimeout):
+                pool.acquire()
+            conn = first._conn
+            first.close()
+            third = pool.acquire()
+            self.assertIs(third._conn, conn)
+            self.assertEqual(pool._opened, 2)
+            second.close()
+            third.close()
+        finally:
+            pool.close()
+
+    def test_read_db_is_query_only(self):
+        with app.app_context():
+            db = database.get_read_db()
+            self.assertIsNot(db, get_db())
+            with self.assertRaises(sqlite3.OperationalError):
+                db.execute("DELETE FROM users")
+
+    def test_migrations_upgrade_legacy_db(self):
+        with app.app_context():
+            self.assertEqual(migrations.get_version(get_db()), migrations.SCHEMA_VERSION)
+
+        # A database file created before the migration runner existed
+        db = sqlite3.connect(":memory:")
+        try:
+            db.executescript(database.SCHEMA)
+            db.execute("INSERT INTO users (username, password_hash, created_at) VALUES ('u', 'x', 'now')")
+            db.execute("INSERT INTO notebooks (owner_id, title, created_at) VALUES (1, 'nb', 'now')")
+            db.execute("INSERT INTO notes (notebook_id, title, content, created_at) VALUES (1, 't', 'body', 'now')")
+            db.commit()
+            self.assertEqual(migrations.get_version(db), 0)
+            applied = migrations.migrate(db)
+            self.assertEqual(applied, [v for v, _, _ in migrations.MIGRATIONS])
+            self.assertEqual(migrations.get_version(db), migrations.SCHEMA_VERSION)
+            self.assertEqual(migrations.migrate(db), [])
+
+            plan = " ".join(row[3] for row in db.execute(
+                "EXPLAIN QUERY PLAN SELECT * FROM notes WHERE notebook_id=? "
+                "ORDER BY updated_at DESC, created_at DESC", (1,)))
+            self.assertIn("idx_notes_notebook_updated", plan)
+            self.assertEqual(db.execute("SELECT rowid FROM notes_fts WHERE notes_fts MATCH 'body'").fetchall(), [(1,)])
+        finally:
+            db.close()
+
+    def test_upgrade_db_command_migrates_an_existing_file(self):
+        """Existing databases are upgraded by the CLI command, not by importing the app"""
+        database.close_pools()
+        with open(self.db_path, "wb"):
+            pass
+        legacy = sqlite3.connect(self.db_path)
+        legacy.executescript(database.SCHEMA)
+        legacy.close()
+        result = app.test_cli_runner().invoke(args=["upgrade-db"])
+        self.assertIsNone(result.exception)
+        with app.app_context():
+            self.assertEqual(migrations.get_version(get_db()), migrations.SCHEMA_VERSION)
+
+    def test_search_notebooks_fulltext(self):
+        self._login()
+        nb = self._create_notebook()
+        photo = self._create_note(nb, "Biology", "Photosynthesis turns light into chemical energy.")
+        self._create_note(nb, "History", "The printing press spread ideas across Europe.")
+        self._create_note(nb, "Physics", "Light travels fast. Chemical energy is stored.")
+
+        rv = self.client.get("/notebook/search_notebooks?query=photosynth")
+        results = rv.get_json()
+        self.assertEqual([r["note_id"] for r in results], [photo])
+        self.assertIn("<mark>Photosynthesis</mark>", results[0]["snippet"])
+
+        # The note text in a snippet is escaped; only the highlight is markup
+        self._create_note(nb, "Markup", "<b onclick=x>Osmosis</b> & diffusion")
+        snippet = self.client.get("/notebook/search_notebooks?query=osmosis").get_json()[0]["snippet"]
+        self.assertEqual(snippet, "&lt;b onclick=x&gt;<mark>Osmosis</mark>&lt;/b&gt; &amp; diffusion")
+
+        rv = self.client.get('/notebook/search_notebooks?query="chemical energy"')
+        self.assertEqual(len(rv.get_json()), 2)
+        rv = self.client.get('/notebook/search_notebooks?query="energy chemical"')
+        self.assertEqual(rv.get_json(), [])
+
+        rv = self.client.get("/notebook/search_notebooks?query=light&limit=1&offset=1")
+        self.assertEqual(len(rv.get_json()), 1)
+
+        # Edits and deletes are reflected through the sync triggers
+        self.client.put(f"/notebook/note/{photo}", json={"content": "Chlorophyll absorbs red light."})
+        self.assertEqual(self.client.get("/notebook/search_notebooks?query=photosynthesis").get_json(), [])
+        self.client.delete(f"/notebook/note/{photo}")
+        self.assertEqual(self.client.get("/notebook/search_notebooks?query=chlorophyll").get_json(), [])
+
+        # Other users never see these notes
+        self.client.get("/logout")
+        self._login("user2", "pass2")
+        self.assertEqual(self.client.get("/notebook/search_notebooks?query=light").get_json(), [])
+
+    def test_unit_of_work_is_atomic(self):
+        with app.test_request_context():
+            db = get_db()
+            db.execute("INSERT INTO users (username, password_hash, created_at) VALUES ('u', 'x', 'now')")
+            db.execute("INSERT INTO notebooks (owner_id, title, created_at) VALUES (1, 'nb', 'now')")
+            db.commit()
+            with self.assertRaises(RuntimeError):
+                with database.unit_of_work() as uow:
+                    cur = uow.execute("INSERT INTO notes (notebook_id, title, created_at) VALUES (1, 't', 'now')")
+                    database.record_contribution(uow, cur.lastrowid, 1, "Created note", "t")
+                    raise RuntimeError("boom")
+            self.assertEqual(db.execute("SELECT COUNT(*) FROM notes").fetchone()[0], 0)
+            self.assertEqual(db.execute("SELECT COUNT(*) FROM contributions").fetchone()[0], 0)
+
+            with database.unit_of_work() as uow:
+                cur = uow.execute("INSERT INTO notes (notebook_id, title, created_at) VALUES (1, 't', 'now')")
+                database.record_contribution(uow, cur.lastrowid, 1, "Created note", "t")
+            self.assertFalse(db.in_transaction)
+            self.assertEqual(db.execute("SELECT COUNT(*) FROM contributions").fetchone()[0], 1)
+
+            # Through the write-behind writer, a row is only queued if its unit of work commits
+            from contributions import log_contribution
+            self.assertTrue(contributions_writer.running)
+            with self.assertRaises(RuntimeError):
+                with database.unit_of_work() as uow:
+                    log_contribution(uow, 1, 1, "Edited note", "rolled back")
+                    raise RuntimeError("boom")
+            with database.unit_of_work() as uow:
+                log_contribution(uow, 1, 1, "Edited note", "kept")
+            contributions_writer.flush()
+            self.assertEqual([r[0] for r in db.execute("SELECT detail FROM contributions ORDER BY id")], ["t", "kept"])
+
+    def test_contributions_flush_wait_is_bounded(self):
+        """flush(timeout) gives up instead of waiting for a stuck batch"""
+        writer = ContributionsWriter(interval_ms=10)
+        writer.start()
+        try:
+            with writer._write_lock:
+                writer.submit(None, None, "Edited note", "slow")
+                self.assertFalse(writer.flush(timeout=0.05))
+            self.assertTrue(writer.flush(timeout=5))
+            self.assertTrue(writer.flush(timeout=0))       # nothing queued since
+        finally:
+            writer.stop()
+        self.assertEqual(writer.stats()["written"], 1)
+
+    def test_contributions_writer_batches(self):
+        self._login()
+        nb = self._create_notebook()
+        note_id = self._create_note(nb, "Batch", "content")
+        gone_id = self._create_note(nb, "Gone", "content")
+
+        writer = ContributionsWriter(batch_size=50, interval_ms=10)
+        for i in range(120):
+            writer.submit(note_id, 1, "Edited note", f"edit {i}")
+        writer.submit(gone_id, 1, "Edited note", "late")
+        self.client.delete(f"/notebook/note/{gone_id}")
+        writer.flush()
+        self.assertEqual(writer.stats()["queue_depth"], 0)
+        self.assertEqual(writer.stats()["written"], 121)
+
+        rows = self.client.get(f"/notebook/contributions?note_id={note_id}&limit=200").get_json()["items"]
+        self.assertEqual(len(rows), 121)  # 120 edits + "Created note"
+        # A row for a note deleted before the batch landed is kept, detached
+        with app.app_context():
+            late = get_db().execute("SELECT note_id FROM contributions WHERE detail='late'").fetchall()
+        self.assertEqual([tuple(r) for r in late], [(None,)])
+
+    def test_deleting_a_note_keeps_its_contributions(self):
+        """The audit trail outlives the note; writes to a missing note are 404s"""
+        self._login()
+        note_id = self._create_note(self._create_notebook(), "Doomed", "a")
+        self.client.put(f"/notebook/note/{note_id}", json={"content": "b"})
+        self.assertEqual(self.client.delete(f"/notebook/note/{note_id}").status_code, 200)
+        contributions_writer.flush()
+        with app.app_context():
+            rows = get_db().execute("SELECT note_id, action, detail FROM contributions ORDER BY id").fetchall()
+        self.assertEqual([tuple(r) for r in rows], [
+            (None, "Created note", "Title: Doomed"),
+            (None, "Edited note", "Title: Doomed"),
+            (None, "Deleted note", f"Note ID: {note_id}"),
+        ])
+        self.assertEqual(self.client.post(f"/notebook/note/{note_id}/tags", data={"tag": "x"}).status_code, 404)
+        self.assertEqual(self.client.post(f"/notebook/note/{note_id}/comments", json={"content": "hi"}).status_code,
+                         404)
+
+    def test_contributions_feed_pages_and_scopes(self):
+        self._login()
+        nb = self._create_notebook()
+        first = self._create_note(nb, "First", "a")
+        second = self._create_note(nb, "Second", "b")
+        for i in range(3):
+            self.client.put(f"/notebook/note/{first}", json={"content": f"edit {i}"})
+
+        page = self.client.get("/notebook/contributions?limit=2").get_json()
+        self.assertEqual(len(page["items"]), 2)
+        seen = [item["id"] for item in page["items"]]
+        while page["next_before"]:
+            page = self.client.get("/notebook/contributions?limit=2&before=" + page["next_before"]).get_json()
+            seen += [item["id"] for item in page["items"]]
+        self.assertEqual(len(seen), 5)
+        self.assertEqual(seen, sorted(set(seen), reverse=True))
+
+        rv = self.client.get(f"/notebook/contributions?note_id={second}").get_json()
+        self.assertEqual([item["action"] for item in rv["items"]], ["Created note"])
+        rv = self.client.get("/notebook/contributions?action=Edited+note").get_json()
+        self.assertEqual(len(rv["items"]), 3)
+        self.assertEqual(self.client.get("/notebook/contributions?before=bogus").status_code, 400)
+
+        # A private notebook's activity is hidden from other users
+        self.client.get("/logout")
+        self._login("user2", "pass2")
+        self.assertEqual(self.client.get("/notebook/contributions").get_json()["items"], [])
+
+    def test_current_user_uses_session_snapshot(self):
+        self._login()
+        with self.client.session_transaction() as sess:
+            self.assertEqual(sess["user"]["username"], "user1")
+        rv = self.client.get("/get_dashboard_text")
+        self.assertIn("Welcome user1!", rv.get_json()["dashboard_text"])
+
+        # Any change to the users row bumps its session version; the snapshot
+        # is replaced once this worker re-reads the version (AUTH_VERSION_TTL)
+        import auth
+        with app.test_request_context():
+            db = get_db()
+            db.execute("UPDATE users SET full_name='Renamed' WHERE id=1")
+            db.commit()
+            self.assertEqual(db.execute("SELECT session_version FROM users WHERE id=1").fetchone()[0], 1)
+        auth._user_versions.pop(1)
+        rv = self.client.get("/get_dashboard_text")
+        self.assertIn("Welcome Renamed!", rv.get_json()["dashboard_text"])
+
+        with app.test_request_context():
+            self.assertIsNone(auth.current_user())
+
+    def test_dashboard_model_scoping_and_invalidation(self):
+        self._login("owner", "pw")
+        self.client.post("/notebook/create", data={"title": "SharedNB", "is_shared": "1"})
+        self.client.post("/notebook/create", data={"title": "PrivateNB"})
+        self.client.get("/logout")
+
+        self._login("peer", "pw")
+        self._login("stranger", "pw")
+        self.client.get("/logout")
+
+        self._login("peer", "pw")
+        self.assertIn("No groups yet.", self.client.get("/get_dashboard_text").get_json()["dashboard_text"])
+        self.client.post("/groups/create", data={"name": "Study", "member_name[]": ["owner"]})
+        text = self.client.get("/get_dashboard_text").get_json()["dashboard_text"]
+        self.assertIn("Study with 2 members", text)
+
+        from dashboard import get_dashboard_model
+        with app.test_request_context():
+            peer = get_dashboard_model(2)
+            self.assertEqual([nb["title"] for nb in peer["shared_notebooks"]], ["SharedNB"])
+            self.assertEqual(get_dashboard_model(3), {"notebooks": [], "shared_notebooks": [], "groups": []})
+
+    def test_summary_cache_follows_note_writes(self):
+        self._login()
+        nb = self._create_notebook()
+        self.assertEqual(self.client.get(f"/notebook/{nb}/summarize").get_json()["summary"],
+                         "This notebook has no notes.")
+        note = self._create_note(nb, "Cells", "Cells divide. Cells grow. Cells die. Cells repeat.")
+
+        calls = []
+        original = summaries.generate_summary
+        summaries.generate_summary = lambda text: calls.append(text) or original(text)
+        try:
+            first = self.client.get(f"/notebook/{nb}/summarize").get_json()["summary"]
+            self.assertEqual(self.client.get(f"/notebook/{nb}/summarize").get_json()["summary"], first)
+            self.assertEqual(len(calls), 1)
+
+            # Survives a restart through the notebook_summaries table
+            summaries._summary_cache.clear()
+            self.client.get(f"/notebook/{nb}/summarize")
+            self.assertEqual(len(calls), 1)
+
+            self.client.put(f"/notebook/note/{note}", json={"content": "Mitochondria make energy."})
+            summary = self.client.get(f"/notebook/{nb}/summarize").get_json()["summary"]
+            self.assertIn("Mitochondria", summary)
+            self.assertEqual(len(calls), 2)
+        finally:
+            summaries.generate_summary = original
+
+    def test_tts_pool_rejects_when_full(self):
+        from tts import TTSPool, TTSBusy
+        pool = TTSPool(workers=1, max_pending=1)
+        pool._slots.acquire()
+        with self.assertRaises(TTSBusy):
+            pool.submit("hello")
+        self.assertIsNone(pool._executor)
+
+    def test_synthesized_audio_file_is_removed_after_sending(self):
+        from tts import tts_pool
+        self._login()
+        nb_id = self._create_notebook()
+        note_id = self._create_note(nb_id, "Spoken", "Read me aloud.")
+        fd, path = tempfile.mkstemp(suffix=".wav")
+        os.write(fd, b"RIFF....WAVE")
+        os.close(fd)
+        tts_pool.synthesize = lambda *args, **kwargs: path
+        try:
+            resp = self.client.post(f"/note/{note_id}/speak", json={"voice": "female"})
+            self.assertEqual(resp.data, b"RIFF....WAVE")
+            resp.close()
+        finally:
+            del tts_pool.synthesize
+        self.assertFalse(os.path.exists(path))
+
+    def test_failed_or_late_speech_job_removes_its_file(self):
+        from concurrent.futures import Future
+        from tts import TTSPool
+        pool = TTSPool(timeout=0)
+        pool.sleep = lambda s: None
+        paths = []
+        for _ in range(2):
+            fd, path = tempfile.mkstemp(suffix=".wav")
+            os.close(fd)
+            paths.append(path)
+        failed, late = Future(), Future()
+        failed.audio_path, late.audio_path = paths
+        failed.set_exception(RuntimeError("driver crashed"))
+        with self.assertRaises(RuntimeError):
+            pool.wait(failed)
+        late.set_running_or_notify_cancel()
+        with self.assertRaises(TimeoutError):
+            pool.wait(late)
+        self.assertTrue(os.path.exists(paths[1]))
+        late.set_result(paths[1])
+        self.assertFalse(any(os.path.exists(p) for p in paths))
+
+    def test_tts_workers_do_not_import_the_app(self):
+        import tts
+        data = tts._worker_preparation_data("worker")
+        self.assertNotIn("init_main_from_path", data)
+        self.assertNotIn("init_main_from_name", data)
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(1, mp_context=tts._WorkerContext()) as executor:
+            self.assertNotEqual(executor.submit(tts._ping).result(timeout=30), os.getpid())
+
+    def test_split_sentences_for_streaming(self):
+        from tts import split_sentences
+        chunks = split_sentences("First one. Second! Third? " + "word " * 80, max_chars=60)
+        self.assertEqual(chunks[0], "First one.")
+        self.assertTrue(all(len(c) <= 60 for c in chunks))
+        self.assertEqual(" ".join(chunks).split(), ("First one. Second! Third? " + "word " * 80).split())
+
+    def test_speech_stream_concatenates_chunks_in_order(self):
+        import wave
+        from concurrent.futures import Future
+        from tts import SpeechStream
+
+        class InlinePool:
+            timeout = 5
+            sleep = staticmethod(lambda s: None)
+
+            def submit(self, text, voice, rate):
+                fd, path = tempfile.mkstemp(suffix=".wav")
+                os.close(fd)
+                with wave.open(path, "wb") as w:
+                    w.setnchannels(1)
+                    w.setsampwidth(2)
+                    w.setframerate(8000)
+                    w.writeframes(text.encode().ljust(len(text) * 2, b"\0"))
+                future = Future()
+                future.audio_path = path
+                future.set_result(path)
+                return future
+
+            def wait(self, future):
+                return future.result()
+
+        audio = b"".join(SpeechStream(InlinePool(), "Alpha. Beta gamma. Delta."))
+        self.assertTrue(audio.startswith(b"RIFF"))
+        body = audio[44:]
+        self.assertLess(body.index(b"Alpha"), body.index(b"Beta"))
+        self.assertLess(body.index(b"Beta"), body.index(b"Delta"))
+
+    def test_lazy_resource_builds_once_and_remembers_failure(self):
+        """Lazy resources are built on first use, once, and a failure is not retried at once"""
+        import startup
+        calls = []
+
+        def factory():
+            calls.append(1)
+            return object()
+
+        resource = startup.LazyResource("test-ok", factory)
+        self.assertFalse(resource.loaded)
+        self.assertIs(resource.get(), resource.get())
+        self.assertEqual(len(calls), 1)
+        self.assertIn("test-ok", [row["name"] for row in startup.report()])
+
+        def broken():
+            calls.append(1)
+            raise RuntimeError("no java")
+
+        failing = startup.LazyResource("test-broken", broken, retry_after=60)
+        for _ in range(2):
+            with self.assertRaises(RuntimeError):
+                failing.get()
+        self.assertEqual(len(calls), 2)
+
+    def _fake_grammar_tool(self):
+        """LanguageTool stand-in that suggests 'the' for every 'teh'"""
+        class Match:
+            def __init__(self, offset):
+                self.offset, self.errorLength, self.replacements = offset, 3, ["the"]
+
+        class Tool:
+            def __init__(self):
+                self.documents = []
+
+            def check(self, text):
+                self.documents.append(text)
+                return [Match(m.start()) for m in re.finditer("teh", text)]
+
+        class Resource:
+            tool = Tool()
+
+            def get(self):
+                return self.tool
+
+        return Resource()
+
+    def test_grammar_service_batches_and_caches_paragraphs(self):
+        """Concurrent texts share one check; unchanged paragraphs come from the cache"""
+        from grammar import GrammarService
+        resource = self._fake_grammar_tool()
+        service = GrammarService(resource, workers=1, window_ms=200)
+        try:
+            first = service.correct_async("teh cat\n\nsat on teh mat")
+            second = service.correct_async("teh dog")
+            self.assertEqual(first.result(5), "the cat\n\nsat on the mat")
+            self.assertEqual(second.result(5), "the dog")
+            self.assertEqual(len(resource.tool.documents), 1)
+
+            self.assertEqual(service.correct("teh cat\n\nteh end", 5), "the cat\n\nthe end")
+            self.assertEqual(resource.tool.documents[-1], "teh end")
+            self.assertEqual(service.stats()["cache_hits"], 1)
+        finally:
+            service.stop()
+
+    def test_grammar_service_rechecks_paragraphs_failed_by_stop(self):
+        """A paragraph failed by stop() is checked again once the service restarts"""
+        from grammar import GrammarService
+        service = GrammarService(self._fake_grammar_tool(), workers=1, window_ms=0)
+        service.start = lambda: None
+        queued = service.correct_async("teh cat")
+        service.stop()
+        with self.assertRaises(RuntimeError):
+            queued.result(1)
+        del service.start
+        try:
+            self.assertEqual(service.correct("teh cat", 5), "the cat")
+        finally:
+            service.stop()
+
+    def test_add_note_saves_raw_then_corrects_in_place(self):
+        """add_note answers with the raw text stored and rewrites it once corrected"""
+        from broker import event_broker
+        from grammar import grammar_service
+        self._login()
+        nb_id = self._create_notebook()
+        sub = event_broker.subscribe(nb_id)
+        original_tool = grammar_service.tool
+        grammar_service.tool = self._fake_grammar_tool()
+        try:
+            rv = self.client.post(f"/notebook/{nb_id}/add_note", json={"content": "teh plan"})
+            note_id = rv.get_json()["note_id"]
+            event = sub.get(timeout=5)
+        finally:
+            grammar_service.tool = original_tool
+            event_broker.unsubscribe(sub)
+        self.assertEqual(event.data["action"], "note_corrected")
+        with app.app_context():
+            content = get_db().execute("SELECT content FROM notes WHERE id=?", (note_id,)).fetchone()[0]
+        self.assertEqual(content, "the plan")
+
+    def test_summarizer_keeps_document_order_and_limits(self):
+        """Top sentences come back in reading order within the length targets"""
+        from summarizer import summarize
+        text = ("Photosynthesis converts light into chemical energy. The weather was nice. "
+                "Chlorophyll absorbs light for photosynthesis in plants. Lunch was late. "
+                "Plants store chemical energy from photosynthesis as sugar.")
+        summary = summarize(text, max_sentences=2)
+        self.assertEqual(summary, "Photosynthesis converts light into chemical energy. "
+                                  "Plants store chemical energy from photosynthesis as sugar.")
+        self.assertLessEqual(len(summarize(text, max_sentences=5, max_chars=60)), 60)
+        self.assertEqual(summarize("Only one sentence here. And two."), "Only one sentence here. And two.")
+        self.assertEqual(summarize(""), "")
+        # The best sentence alone is over the limit
+        long_first = "Photosynthesis " * 20 + "is long. Short one. Another short one."
+        self.assertEqual(summarize(long_first, max_sentences=1, max_chars=40), "Another short one.")
+        cut = summarize("Photosynthesis " * 20 + "is long.", max_sentences=1, max_chars=40)
+        self.assertLessEqual(len(cut), 40)
+        self.assertTrue(cut.startswith("Photosynthesis Photosynthesis") and cut.endswith("\u2026"))
+
+    def test_event_broker_replays_and_evicts_slow_subscribers(self):
+        """Missed events are replayed by id; a subscriber that stops reading is dropped"""
+        from broker import EventBroker, RESYNC
+        broker = EventBroker(max_queue=2, history=3)
+        first = broker.publish(1, {"n": 1})
+        broker.publish(1, {"n": 2})
+        broker.publish(1, {"n": 3})
+
+        replay = broker.subscribe(1, last_event_id=str(first))
+        self.assertEqual([replay.get(0).data["n"], replay.get(0).data["n"]], [2, 3])
+        self.assertIsNone(replay.get(0))
+
+        broker.publish(1, {"n": 4})
+        broker.publish(1, {"n": 5})
+        broker.publish(1, {"n": 6})    # queue already holds 2: evicted
+        self.assertTrue(replay.closed)
+        self.assertEqual(broker.subscriber_count(1), 0)
+        self.assertEqual(broker.stats()["evicted"], 1)
+
+        stale = broker.subscribe(1, last_event_id=str(first))
+        self.assertEqual(stale.get(0).data, RESYNC)
+
+    def test_event_broker_slims_replay_and_forgets_idle_channels(self):
+        """Replayed events leave out long values; history of an idle channel is dropped after the grace period"""
+        from broker import EventBroker, RESYNC
+        broker = EventBroker(grace=60, replay_max_chars=20)
+        live = broker.subscribe(1)
+        first = broker.publish(1, {"action": "note_updated", "content": "x" * 50})
+        self.assertEqual(live.get(0).data["content"], "x" * 50)
+        replay = broker.subscribe(1, last_event_id=str(first - 1))
+        self.assertEqual(replay.get(0).data, {"action": "note_updated", "omitted": ["content"]})
+
+        broker.grace = 0
+        broker.unsubscribe(live)
+        broker.unsubscribe(replay)
+        self.assertEqual(broker.subscribe(1, last_event_id=str(first - 1)).get(0).data, RESYNC)
+        self.assertNotIn(1, broker._history)
+        self.assertNotIn(1, broker._dropped)
+        self.assertIsNone(broker.subscribe(1, last_event_id=str(first)).get(0))
+        broker.publish(1, {"action": "note_added"})
+        self.assertEqual(broker.subscribe(1, last_event_id=str(first - 1)).get(0).data, RESYNC)
+
+    def test_subscribe_streams_events_with_ids(self):
+        """The SSE endpoint replays from Last-Event-ID and frames events with their id"""
+        from broker import event_broker
+        self._login()
+        nb_id = self._create_notebook()
+        first = event_broker.publish(nb_id, {"action": "note_added", "note_id": 1})
+        second = event_broker.publish(nb_id, {"action": "note_updated", "note_id": 1})
+        rv = self.client.get(f"/notebook/{nb_id}/subscribe", headers={"Last-Event-ID": str(first)},
+                             buffered=False)
+        chunks = iter(rv.response)
+        self.assertTrue(next(chunks).startswith(b"retry:"))
+        self.assertEqual(next(chunks), f'id: {second}\ndata: {{"action": "note_updated", "note_id": 1}}\n\n'.encode())
+        # The open stream does not hold a pooled connection
+        read_pool = database.get_pool(readonly=True)
+        self.assertEqual(read_pool._idle.qsize(), read_pool._opened)
+        rv.close()
+        self.assertEqual(event_broker.subscriber_count(nb_id), 0)
+
+    def test_subscription_waits_cooperatively_when_given_a_sleep(self):
+        from broker import EventBroker
+        broker = EventBroker()
+        naps = []
+        broker.sleep = naps.append
+        sub = broker.subscribe(1)
+        self.assertIsNone(sub.get(timeout=0.01))
+        self.assertTrue(naps)
+        broker.publish(1, {"action": "note_added"})
+        self.assertEqual(sub.get(timeout=1).data, {"action": "note_added"})
+        broker.unsubscribe(sub)
+        self.assertIsNone(sub.get(timeout=None))
+
+    def test_sqlite_event_bus_fans_out_across_workers(self):
+        """Two bus instances on one file stand in for two worker processes"""
+        from broker import EventBroker
+        from eventbus import SQLiteBus, BusClientManager
+        fd, path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        try:
+            worker_a, worker_b = SQLiteBus(path), SQLiteBus(path)
+            broker_b = EventBroker()
+            broker_b.continue_after(worker_b.last_id())
+            worker_b.subscribe("notebook", lambda event_id, p: broker_b.publish(p["notebook_id"], p["event"], event_id))
+            sub = broker_b.subscribe(7)
+            local = []
+            worker_a.subscribe("notebook", lambda event_id, p: local.append(event_id))
+
+            event_id = worker_a.publish("notebook", {"notebook_id": 7, "event": {"action": "note_added"}})
+            self.assertEqual(local, [event_id])
+            self.assertIsNone(sub.get(0))
+            worker_b.poll_once()
+            event = sub.get(0)
+            self.assertEqual((event.id, event.data), (event_id, {"action": "note_added"}))
+            worker_a.poll_once()
+            self.assertEqual(local, [event_id])       # own events are not delivered twice
+
+            manager_a, manager_b = BusClientManager(worker_a), BusClientManager(worker_b)
+            manager_a._publish({"method": "emit", "event": "update", "room": "note_1"})
+            worker_b.poll_once()
+            self.assertEqual(next(manager_b._listen())["room"], "note_1")
+
+            # A worker's handlers see every event in id order, its own and the others'
+            seen = []
+            worker_a.subscribe("order", lambda event_id, p: seen.append(event_id))
+            earlier = worker_b.publish("order", {})
+            later = worker_a.publish("order", {})
+            self.assertEqual(seen, [earlier, later])
+        finally:
+            os.unlink(path)
+            for suffix in ("-wal", "-shm"):
+                if os.path.exists(path + suffix):
+                    os.unlink(path + suffix)
+
+    def test_cache_invalidations_arrive_through_the_event_bus(self):
+        """What a worker does when another one drops a cached dashboard or summary"""
+        import dashboard
+        from eventbus import event_bus
+        dashboard._dashboard_cache[42] = (0.0, {})
+        summaries._summary_cache[42] = ("1:now", "summary")
+        for cache in ("dashboard", "summary"):
+            event_bus.publish("invalidate", {"cache": cache, "keys": [42]})
+        self.assertNotIn(42, dashboard._dashboard_cache)
+        self.assertNotIn(42, summaries._summary_cache)
+
+    def test_collab_transform_converges(self):
+        """Concurrent operations give the same text in either order"""
+        from collab import apply, transform
+        text = "the quick fox"
+        cases = [
+            ([4, "very ", 9], [4, -6, 3]),         # insert inside a deleted word
+            ([13, "!"], [13, "?"]),                # same position: first argument wins
+            ([-4, 9], [2, -5, 6]),                 # overlapping deletes
+        ]
+        for a, b in cases:
+            a2, b2 = transform(a, b)
+            self.assertEqual(apply(apply(text, a), b2), apply(apply(text, b), a2))
+        a2, _ = transform([13, "!"], [13, "?"])
+        self.assertEqual(apply("the quick fox?", a2), "the quick fox!?")
+
+    def test_socket_edits_are_rebased_and_broadcast_as_deltas(self):
+        """Two editors on the same revision both land; each receives only the other's delta"""
+        from app import socketio, LIVE_EDIT_DELIVERIES
+        from collab import documents
+        self._login()
+        nb_id = self._create_notebook()
+        note_id = self._create_note(nb_id, "Shared", "hello world")
+        deliveries = LIVE_EDIT_DELIVERIES.labels().value
+        first = socketio.test_client(app, flask_test_client=self.client)
+        second = socketio.test_client(app, flask_test_client=self.client)
+        for client in (first, second):
+            client.emit("join_note", {"note_id": note_id})
+        doc = [m for m in first.get_received() if m["name"] == "doc"][0]["args"][0]
+        self.assertEqual((doc["rev"], doc["content"]), (0, "hello world"))
+        second.get_received()
+
+        first.emit("edit", {"note_id": note_id, "rev": 0, "op": [5, " there", 6]})
+        second.emit("edit", {"note_id": note_id, "rev": 0, "op": [11, "!"]})
+        got_first = [(m["name"], m["args"][0]) for m in first.get_received()]
+        got_second = [(m["name"], m["args"][0]) for m in second.get_received()]
+        self.assertEqual(got_first, [("ack", {"note_id": note_id, "rev": 1}),
+                                     ("update", {"note_id": note_id, "rev": 2, "op": [17, "!"]})])
+        self.assertEqual(got_second, [("update", {"note_id": note_id, "rev": 1, "op": [5, " there", 6]}),
+                                      ("ack", {"note_id": note_id, "rev": 2})])
+        self.assertEqual(documents.get(note_id).content, "hello there world!")
+        self.assertEqual(LIVE_EDIT_DELIVERIES.labels().value, deliveries + 2)
+
+        second.emit("edit", {"note_id": note_id, "rev": 0, "op": [3, "x"]})   # wrong length
+        self.assertEqual(second.get_received()[0]["name"], "resync")
+        first.disconnect()
+        second.disconnect()
+        self.assertIsNone(documents.get(note_id))
+
+    def test_join_note_requires_a_user_who_can_see_the_note(self):
+        """Anonymous sockets and users outside the notebook are refused the document"""
+        from app import socketio
+        from collab import documents
+        self._login()
+        note_id = self._create_note(self._create_notebook(), "Private", "secret")
+        other = app.test_client()
+        other.post("/register", data={"username": "user2", "password": "pass2", "full_name": "user2"})
+        other.post("/login", data={"username": "user2", "password": "pass2"})
+        for flask_client in (app.test_client(), other):
+            sock = socketio.test_client(app, flask_test_client=flask_client)
+            sock.emit("join_note", {"note_id": note_id})
+            self.assertEqual([(m["name"], m["args"][0]) for m in sock.get_received()],
+                             [("denied", {"note_id": note_id})])
+            sock.disconnect()
+        self.assertIsNone(documents.get(note_id))
+
+    def test_autosave_coalesces_live_edits_until_room_empties(self):
+        """Live edits are held in memory and written once, when the last editor leaves"""
+        from app import socketio
+        from autosave import autosave
+        self._login()
+        nb_id = self._create_notebook()
+        note_id = self._create_note(nb_id, "Live", "abc")
+        editor = socketio.test_client(app, flask_test_client=self.client)
+        editor.emit("join_note", {"note_id": note_id})
+        for rev, op in enumerate([[3, "d"], [4, "e"], [5, "f"]]):
+            editor.emit("edit", {"note_id": note_id, "rev": rev, "op": op})
+        self.assertEqual(autosave.stats()["dirty_notes"], 1)
+
+        def stored():
+            with app.app_context():
+                db = get_db()
+                content = db.execute("SELECT content FROM notes WHERE id=?", (note_id,)).fetchone()[0]
+                edits = db.execute("SELECT COUNT(*) FROM contributions WHERE note_id=? AND detail LIKE 'Live edit%'",
+                                   (note_id,)).fetchone()[0]
+                return content, edits
+
+        self.assertEqual(stored(), ("abc", 0))
+        writes = autosave.stats()["notes_written"]
+        editor.disconnect()
+        contributions_writer.flush()
+        self.assertEqual(stored(), ("abcdef", 1))
+        self.assertEqual(autosave.stats()["notes_written"], writes + 1)
+        self.assertEqual(autosave.stats()["dirty_notes"], 0)
+
+    def test_edits_need_a_joined_session_and_direct_writes_win(self):
+        """A session that never joined cannot edit; a PUT resyncs live editors and autosave keeps it"""
+        from app import socketio
+        from autosave import autosave
+        from collab import documents
+        self._login()
+        note_id = self._create_note(self._create_notebook(), "Live", "abc")
+        editor = socketio.test_client(app, flask_test_client=self.client)
+        stranger = socketio.test_client(app, flask_test_client=self.client)
+        editor.emit("join_note", {"note_id": note_id})
+        stranger.emit("edit", {"note_id": note_id, "rev": 0, "op": [3, "!"]})
+        self.assertEqual(stranger.get_received()[0]["name"], "denied")
+        self.assertEqual(documents.get(note_id).content, "abc")
+
+        editor.emit("edit", {"note_id": note_id, "rev": 0, "op": [3, "d"]})
+        editor.get_received()
+        resp = self.client.put(f"/notebook/note/{note_id}", json={"content": "typed elsewhere"})
+        self.assertEqual(resp.status_code, 200)
+        resync = [m["args"][0] for m in editor.get_received() if m["name"] == "resync"]
+        self.assertEqual(resync, [{"note_id": note_id, "rev": 2, "content": "typed elsewhere"}])
+        editor.emit("edit", {"note_id": note_id, "rev": 1, "op": [3, "x"]})     # made before the resync
+        self.assertEqual(editor.get_received()[0]["name"], "resync")
+        editor.emit("edit", {"note_id": note_id, "rev": 2, "op": [15, "!"]})
+        editor.disconnect()
+        stranger.disconnect()
+        with app.app_context():
+            content = get_db().execute("SELECT content FROM notes WHERE id=?", (note_id,)).fetchone()[0]
+        self.assertEqual(content, "typed elsewhere!")
+
+        # A write the document has not heard about yet is not overwritten
+        from collab import NoteDocument
+        doc = NoteDocument(note_id, "stale")
+        doc.receive(0, [5, "?"])
+        before = autosave.stats()
+        autosave.mark_dirty(doc)
+        autosave.flush()
+        self.assertEqual(autosave.stats()["conflicts"], before["conflicts"] + 1)
+        self.assertEqual(autosave.stats()["notes_written"], before["notes_written"])
+        self.assertEqual(autosave.stats()["edits_coalesced"], before["edits_coalesced"])
+
+    def test_null_content_updates_are_recorded_as_empty(self):
+        """PUT with content null, or a title change of a note with NULL content, stores an empty note"""
+        self._login()
+        nb_id = self._create_notebook()
+        note_id = self._create_note(nb_id, "Nothing yet", "draft")
+        resp = self.client.put(f"/notebook/note/{note_id}", json={"content": None})
+        self.assertEqual(resp.status_code, 200)
+        with app.app_context():
+            db = get_db()
+            self.assertEqual(db.execute("SELECT content FROM notes WHERE id=?", (note_id,)).fetchone()[0], "")
+            db.execute("UPDATE notes SET content=NULL WHERE id=?", (note_id,))
+            db.commit()
+        resp = self.client.put(f"/notebook/note/{note_id}", json={"title": "Renamed"})
+        self.assertEqual(resp.status_code, 200)
+        revisions = self.client.get(f"/notebook/note/{note_id}/revisions").get_json()["revisions"]
+        latest = self.client.get(f"/notebook/note/{note_id}/revisions/{revisions[0]['revision']}").get_json()
+        self.assertEqual((latest["title"], latest["content"]), ("Renamed", ""))
+
+    def test_revision_history_stores_deltas_and_restores(self):
+        """Edits are stored as small deltas; any revision rebuilds, diffs and restores"""
+        import revisions
+        self._login()
+        nb_id = self._create_notebook()
+        body = "".join(f"Line {i} of a long lecture note.\n" for i in range(2000))
+        note_id = self._create_note(nb_id, "History", body)
+        versions = [body]
+        for i in range(40):
+            versions.append(versions[-1].replace(f"Line {i * 37} ", f"Line {i * 37} (edited {i}) ", 1))
+            resp = self.client.put(f"/notebook/note/{note_id}", json={"content": versions[-1]})
+            self.assertEqual(resp.status_code, 200)
+
+        with app.app_context():
+            db = get_db()
+            rows = db.execute("SELECT revision, kind, depth, LENGTH(data) FROM note_revisions "
+                              "WHERE note_id=? ORDER BY revision", (note_id,)).fetchall()
+            self.assertEqual(len(rows), 41)
+            snapshots = [r[0] for r in rows if r[1] == "snapshot"]
+            self.assertEqual(snapshots, list(range(1, 42, revisions.REVISION_SNAPSHOT_EVERY)))
+            self.assertTrue(all(r[3] < 100 for r in rows if r[1] == "delta"))
+            for rev in (1, 2, 25, 26, 41):
+                self.assertEqual(revisions.get_revision(db, note_id, rev)["content"], versions[rev - 1])
+
+        listed = self.client.get(f"/notebook/note/{note_id}/revisions").get_json()["revisions"]
+        self.assertEqual([r["revision"] for r in listed[:2]], [41, 40])
+        diff = self.client.get(f"/notebook/note/{note_id}/revisions/3/diff").get_json()["diff"]
+        self.assertIn("-Line 37 of", diff)
+        self.assertIn("+Line 37 (edited 1) of", diff)
+
+        resp = self.client.post(f"/notebook/note/{note_id}/revisions/2/restore")
+        self.assertEqual(resp.get_json()["revision"], 42)
+        with app.app_context():
+            db = get_db()
+            self.assertEqual(db.execute("SELECT content FROM notes WHERE id=?", (note_id,)).fetchone()[0],
+                             versions[1])
+            # Compaction rebases the chain so what is kept still rebuilds
+            deleted = revisions.compact(db, note_id, max_revisions=10, retention_days=0)
+            db.commit()
+            self.assertEqual(deleted, 32)
+            self.assertEqual(revisions.get_revision(db, note_id, 33)["content"], versions[32])
+            self.assertEqual(revisions.get_revision(db, note_id, 42)["content"], versions[1])
+        self.assertEqual(self.client.get(f"/notebook/note/{note_id}/revisions/5").status_code, 404)
+        with app.app_context():
+            # Within both limits compaction leaves the history alone
+            self.assertEqual(revisions.compact(get_db(), note_id, max_revisions=10, retention_days=30), 0)
+
+        # Users who cannot see the notebook cannot read its history either
+        self.client.get("/logout")
+        self._login("user2", "pass2")
+        for path in ("", "/41", "/41/diff"):
+            self.assertEqual(self.client.get(f"/notebook/note/{note_id}/revisions{path}").status_code, 404)
+        self.assertEqual(self.client.get(f"/notebook/note/{note_id}").status_code, 404)
+
+    def test_metrics_endpoint_reports_requests_and_queries(self):
+        """/metrics exposes per-endpoint latency histograms and SQL statement counts"""
+        from metrics import Registry
+        self._login()
+        nb_id = self._create_notebook()
+        note_id = self._create_note(nb_id, "Measured", "Some text.")
+        for _ in range(3):
+            self.assertEqual(self.client.get(f"/notebook/note/{note_id}").status_code, 200)
+
+        resp = self.client.get("/metrics")
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.content_type.startswith("text/plain; version=0.0.4"))
+        body = resp.get_data(as_text=True)
+        count = re.search(r'^notebridge_http_requests_total\{endpoint="notebook.view_note",method="GET",status="200"\} (\d+)$',
+                          body, re.M)
+        self.assertGreaterEqual(int(count.group(1)), 3)
+        self.assertRegex(body, r'notebridge_http_request_duration_seconds_bucket\{endpoint="notebook.view_note",le="\+Inf"\} \d+')
+        queries = re.search(r'^notebridge_http_request_db_queries_sum\{endpoint="notebook.view_note"\} (\d+)$', body, re.M)
+        self.assertGreater(int(queries.group(1)), 0)
+        self.assertIn("# TYPE notebridge_sse_subscribers gauge", body)
+        # Without METRICS_TOKEN only local scrapers are answered
+        self.assertEqual(self.client.get("/metrics", environ_base={"REMOTE_ADDR": "10.0.0.7"}).status_code, 403)
+
+        registry = Registry()
+        latency = registry.histogram("job_seconds", "Job time.", ("kind",), buckets=(0.1, 1))
+        for value in (0.05, 0.5, 5):
+            latency.labels('a"b').observe(value)
+        registry.collect("depth", "Queue depth.", "gauge", lambda: {"x": 2}, ("queue",))
+        self.assertEqual(registry.render().splitlines()[2:], [
+            'job_seconds_bucket{kind="a\\"b",le="0.1"} 1',
+            'job_seconds_bucket{kind="a\\"b",le="1"} 2',
+            'job_seconds_bucket{kind="a\\"b",le="+Inf"} 3',
+            'job_seconds_sum{kind="a\\"b"} 5.55',
+            'job_seconds_count{kind="a\\"b"} 3',
+            '# HELP depth Queue depth.',
+            '# TYPE depth gauge',
+            'depth{queue="x"} 2',
+        ])
+
+    def test_sql_tracer_flags_repeated_statements_and_full_scans(self):
+        """With the tracer on, a request's statements are summarized in X-SQL-Trace"""
+        from flask import g as flask_g
+        from sqltrace import sql_tracer, normalize_sql, HEADER
+        self.assertEqual(normalize_sql("SELECT * FROM t WHERE a = 'x''y' AND b IN (1, 2,  3)\n AND c=?"),
+                         "SELECT * FROM t WHERE a = ? AND b IN (?...) AND c=?")
+        self._login()
+        nb_id = self._create_notebook()
+        note_id = self._create_note(nb_id, "Traced", "Some text.")
+        self.assertNotIn(HEADER, self.client.get(f"/notebook/note/{note_id}").headers)
+
+        sql_tracer.enabled = True
+        try:
+            header = self.client.get(f"/notebook/note/{note_id}").headers[HEADER]
+            self.assertRegex(header, r"statements=[1-9]\d*; ms=[\d.]+; rows=[1-9]\d*; repeated=0; full_scans=0")
+
+            with app.test_request_context("/traced"):
+                db = get_db()
+                for i in range(6):
+                    db.execute("SELECT title FROM notes WHERE id=?", (note_id + i,)).fetchone()
+                rows = db.execute("SELECT id FROM notes WHERE content LIKE '%text%'").fetchall()
+                self.assertEqual(len(rows), 1)
+                db.executemany("INSERT INTO tags (note_id, tag) VALUES (?, ?)",
+                               ((note_id, tag) for tag in ("a", "b", "c")))
+                self.assertEqual(flask_g._sql_trace.statements[-1].params, [(note_id, "a"), (note_id, "b"), (note_id, "c")])
+                self.assertEqual(db.execute("SELECT COUNT(*) FROM tags WHERE note_id=?", (note_id,)).fetchone()[0], 3)
+                report = flask_g._sql_trace.report(sql_tracer.repeat_threshold)
+                response = sql_tracer.finish(app.response_class("ok"))
+        finally:
+            sql_tracer.enabled = False
+        self.assertEqual(report["statements"], 9)
+        self.assertEqual(report["rows"], 2 + 3 + 1)
+        self.assertEqual(report["repeated"][0]["sql"], "SELECT title FROM notes WHERE id=?")
+        self.assertEqual((report["repeated"][0]["count"], report["repeated"][0]["distinct_params"]), (6, 6))
+        self.assertEqual([s["table"] for s in report["full_scans"]], ["notes"])
+        self.assertIn("repeated=1; full_scans=1", response.headers[HEADER])
+
+    def test_structured_logging_is_queued_with_request_ids(self):
+        """Log records carry fields and the request id, are written off-thread and never block"""
+        import io
+        import json
+        import logging
+        import queue
+        import applog
+        buffer = io.StringIO()
+        old_stream = applog.output_handler.setStream(buffer)
+        old_formatter = applog.output_handler.formatter
+        applog.output_handler.setFormatter(applog.JSONFormatter())
+        try:
+            self._login()
+            resp = self.client.post("/notebook/create", data={"title": "Logged"},
+                                    headers={"X-Requested-With": "XMLHttpRequest", "X-Request-ID": "req-123"})
+            self.assertEqual(resp.headers["X-Request-ID"], "req-123")
+            self.assertEqual(len(self.client.get("/dashboard").headers["X-Request-ID"]), 16)
+            applog.flush()
+        finally:
+            applog.output_handler.setStream(old_stream)
+            applog.output_handler.setFormatter(old_formatter)
+        entries = [json.loads(line) for line in buffer.getvalue().splitlines()]
+        created = [e for e in entries if e["msg"] == "Created notebook"][0]
+        self.assertEqual((created["logger"], created["level"], created["request_id"]),
+                         ("notebridge.notebooks", "INFO", "req-123"))
+        self.assertEqual(created["notebook_id"], resp.get_json()["notebook_id"])
+
+        log = applog.get_logger("test")
+        self.assertEqual([log.sample("edit", 3) for _ in range(7)], [True, False, False, True, False, False, True])
+        handler = applog._NonBlockingQueueHandler(queue.Queue(maxsize=1))
+        for _ in range(3):
+            handler.handle(logging.LogRecord("t", logging.INFO, __file__, 1, "msg", (), None))
+        self.assertEqual(handler.dropped, 2)
+
+    def test_note_and_notebook_reads_answer_conditional_gets(self):
+        """Unchanged pages are answered 304 before rendering; edits, comments and tags change the ETag"""
+        self._login()
+        nb_id = self._create_notebook()
+        note_id = self._create_note(nb_id, "Cached", "First text")
+
+        def revalidate(url):
+            first = self.client.get(url)
+            self.assertEqual(first.status_code, 200)
+            self.assertEqual(first.headers["Cache-Control"], "private, no-cache")
+            self.assertIn("Cookie", first.headers["Vary"])
+            again = self.client.get(url, headers={"If-None-Match": first.headers["ETag"]})
+            self.assertEqual((again.status_code, again.data), (304, b""))
+            self.assertEqual(again.headers["ETag"], first.headers["ETag"])
+            return first.headers["ETag"]
+
+        note_url, notebook_url = f"/notebook/note/{note_id}", f"/notebook/notebook/{nb_id}"
+        text_url = f"/get_notes_text/{note_id}"
+        tags = [revalidate(note_url)]
+        notebook_tags = [revalidate(notebook_url)]
+        text_tag = revalidate(text_url)
+
+        self.client.post(f"/notebook/note/{note_id}/comments", json={"content": "Nice"})
+        tags.append(revalidate(note_url))
+        self.client.post(f"/notebook/note/{note_id}/tags", data={"tag": "exam"})
+        tags.append(revalidate(note_url))
+        # Neither changes the notebook page
+        self.assertEqual(revalidate(notebook_url), notebook_tags[0])
+
+        self.client.put(note_url, json={"title": "Renamed", "content": "Second text"})
+        tags.append(revalidate(note_url))
+        notebook_tags.append(revalidate(notebook_url))
+        self.assertNotEqual(revalidate(text_url), text_tag)
+        self.assertEqual(len(set(tags)), 4)
+        self.assertEqual(len(set(notebook_tags)), 2)
+        resp = self.client.get(note_url, headers={"If-None-Match": tags[0]})
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(b"Second text", resp.data)
+
+        summary = self.client.get(f"/notebook/{nb_id}/summarize")
+        self.assertIn("max-age", summary.headers["Cache-Control"])
+        resp = self.client.get(f"/notebook/{nb_id}/summarize", headers={"If-None-Match": summary.headers["ETag"]})
+        self.assertEqual(resp.status_code, 304)
+
+    def test_responses_are_compressed_by_accept_encoding(self):
+        """Large text bodies, SSE streams and static files are compressed; small or binary ones are not"""
+        import gzip
+        import zlib
+        import compress
+        from broker import event_broker
+        self._login()
+        nb_id = self._create_notebook()
+        note_id = self._create_note(nb_id, "Big", "Lecture notes, compressible. " * 400)
+        url = f"/get_notes_text/{note_id}"
+
+        plain = self.client.get(url)
+        self.assertNotIn("Content-Encoding", plain.headers)
+        self.assertIn("Accept-Encoding", plain.headers["Vary"])
+        resp = self.client.get(url, headers={"Accept-Encoding": "gzip, deflate"})
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(resp.data), plain.data)
+        self.assertLess(len(resp.data), len(plain.data) // 10)
+        self.assertEqual(resp.headers["ETag"], "W/" + plain.headers["ETag"])
+        again = self.client.get(url, headers={"Accept-Encoding": "gzip", "If-None-Match": resp.headers["ETag"]})
+        self.assertEqual(again.status_code, 304)
+        resp = self.client.get(url, headers={"Accept-Encoding": "gzip;q=0.5, deflate"})
+        self.assertEqual(zlib.decompress(resp.data), plain.data)
+        resp = self.client.get(url, headers={"Accept-Encoding": "identity"})
+        self.assertNotIn("Content-Encoding", resp.headers)
+        # Below the size threshold
+        resp = self.client.get(f"/notebook/{nb_id}/summarize", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", resp.headers)
+
+        # SSE: every chunk can be decompressed as soon as it arrives
+        first = event_broker.publish(nb_id, {"action": "note_added", "note_id": note_id})
+        event_broker.publish(nb_id, {"action": "note_updated", "note_id": note_id})
+        rv = self.client.get(f"/notebook/{nb_id}/subscribe",
+                             headers={"Last-Event-ID": str(first), "Accept-Encoding": "gzip"}, buffered=False)
+        self.assertEqual(rv.headers["Content-Encoding"], "gzip")
+        d = zlib.decompressobj(31)
+        chunks = iter(rv.response)
+        self.assertTrue(d.decompress(next(chunks)).startswith(b"retry:"))
+        self.assertIn(b'"action": "note_updated"', d.decompress(next(chunks)))
+        rv.close()
+        self.assertEqual(event_broker.subscriber_count(nb_id), 0)
+
+        # Static files are compressed once and then served from the cache
+        compress.static_cache.clear()
+        with open(os.path.join(app.static_folder, "style.css"), "rb") as f:
+            css = f.read()
+        for _ in range(2):
+            resp = self.client.get("/static/style.css", headers={"Accept-Encoding": "gzip"})
+            self.assertEqual(gzip.decompress(resp.data), css)
+            resp.close()
+        self.assertEqual((compress.static_cache.misses, compress.static_cache.hits), (1, 1))
+        resp = self.client.get("/static/logo.jpg", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", resp.headers)
+        resp.close()
+
 
 if __name__ == "__main__":
     unittest.main()
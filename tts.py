@@ -0,0 +1,258 @@
+import os
+import re
+import struct
+import tempfile
+import threading
+import time
+import wave
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import context, spawn
+from flask import send_file
+from metrics import registry
+from config import (TTS_WORKERS, TTS_MAX_PENDING, TTS_TIMEOUT, TTS_RATE, TTS_CHUNK_CHARS,
+                    TTS_STREAM_LOOKAHEAD)
+from tts_worker import _init_worker, _ping, _synthesize
+
+# -----------------------------
+# Worker process side
+# -----------------------------
+# A spawned child normally re-runs the parent's __main__ (app.py) as
+# __mp_main__ before doing any work. The speech workers only need tts_worker,
+# so their start-up data leaves the main module out.
+_get_preparation_data = spawn.get_preparation_data
+_spawn_lock = threading.Lock()
+
+def _worker_preparation_data(name):
+    data = _get_preparation_data(name)
+    data.pop('init_main_from_name', None)
+    data.pop('init_main_from_path', None)
+    return data
+
+class _WorkerProcess(context.SpawnProcess):
+    @staticmethod
+    def _Popen(process_obj):
+        with _spawn_lock:
+            spawn.get_preparation_data = _worker_preparation_data
+            try:
+                return context.SpawnProcess._Popen(process_obj)
+            finally:
+                spawn.get_preparation_data = _get_preparation_data
+
+class _WorkerContext(context.SpawnContext):
+    Process = _WorkerProcess
+
+
+# -----------------------------
+# Request side
+# -----------------------------
+TTS_JOB_SECONDS = registry.histogram(
+    'notebridge_tts_job_seconds', 'Speech synthesis jobs from submission to completion.', ('outcome',))
+TTS_REJECTED = registry.counter('notebridge_tts_rejected_total', 'Speech jobs refused because the queue was full.')
+
+
+def _outcome(future):
+    if future.cancelled():
+        return 'cancelled'
+    return 'error' if future.exception() is not None else 'ok'
+
+
+class TTSBusy(Exception):
+    """Raised when the synthesis queue is full; callers should answer 503."""
+
+
+class TTSPool:
+    """
+    Pre-warmed pool of text-to-speech worker processes.
+    At most max_pending jobs may be queued or running; further submissions are
+    rejected immediately instead of piling up behind slow synthesis.
+    """
+
+    def __init__(self, workers=TTS_WORKERS, max_pending=TTS_MAX_PENDING, timeout=TTS_TIMEOUT):
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+        # Replaced with socketio.sleep by the app so waiting yields to other greenlets
+        self.sleep = time.sleep
+
+    def start(self, warm=True):
+        """Spawn the worker processes and, if warm, wait until each has an engine."""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=_WorkerContext(),
+                    initializer=_init_worker
+                )
+        if warm:
+            for future in [self._executor.submit(_ping) for _ in range(self.workers)]:
+                future.result(timeout=self.timeout)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, text, voice='male', rate=TTS_RATE, suffix='.wav'):
+        """Queue a synthesis job; returns a future resolving to the audio file path."""
+        if not self._slots.acquire(blocking=False):
+            TTS_REJECTED.inc()
+            raise TTSBusy('speech synthesis queue is full')
+        try:
+            if self._executor is None:
+                self.start(warm=False)
+            tmp_fd, path = tempfile.mkstemp(suffix=suffix)
+            os.close(tmp_fd)
+            try:
+                future = self._executor.submit(_synthesize, text, voice, rate, path)
+            except BrokenProcessPool:
+                # A worker died (e.g. a driver crash); replace the pool once
+                self.shutdown()
+                self.start(warm=False)
+                future = self._executor.submit(_synthesize, text, voice, rate, path)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.audio_path = path
+        submitted = time.perf_counter()
+
+        def done(f):
+            self._slots.release()
+            TTS_JOB_SECONDS.labels(_outcome(f)).observe(time.perf_counter() - submitted)
+
+        future.add_done_callback(done)
+        return future
+
+    def wait(self, future, timeout=None):
+        """Wait for a job without blocking the event loop; raises TimeoutError when late."""
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        while not future.done():
+            if time.monotonic() >= deadline:
+                # A job already running cannot be cancelled; drop its file when it ends
+                future.cancel()
+                future.add_done_callback(lambda f: _remove(f.audio_path))
+                raise TimeoutError('speech synthesis timed out')
+            self.sleep(0.02)
+        try:
+            return future.result()
+        except BaseException:
+            _remove(future.audio_path)
+            raise
+
+    def synthesize(self, text, voice='male', rate=TTS_RATE, suffix='.wav', timeout=None):
+        """Render text to an audio file in a worker and return its path."""
+        return self.wait(self.submit(text, voice, rate, suffix), timeout)
+
+
+tts_pool = TTSPool()
+
+
+# -----------------------------
+# Sentence-streamed audio
+# -----------------------------
+_SENTENCE_RE = re.compile(r'(?<=[.!?])\s+')
+
+def split_sentences(text, max_chars=TTS_CHUNK_CHARS):
+    """
+    Split text into speakable chunks in reading order. The first chunk is a
+    single sentence so playback can start quickly; later short sentences are
+    merged up to max_chars and overlong ones are cut at word boundaries.
+    """
+    chunks = []
+    for sentence in _SENTENCE_RE.split(text.strip()):
+        sentence = ' '.join(sentence.split())
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(' ', 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            chunks.append(sentence[:cut])
+            sentence = sentence[cut:].strip()
+        if not sentence:
+            continue
+        if len(chunks) > 1 and len(chunks[-1]) + len(sentence) < max_chars:
+            chunks[-1] += ' ' + sentence
+        else:
+            chunks.append(sentence)
+    return chunks
+
+def _wav_stream_header(channels, sample_width, frame_rate):
+    """RIFF/WAVE header with unknown (maximum) length, as used for live streams."""
+    block_align = channels * sample_width
+    return (b'RIFF' + struct.pack('<I', 0xFFFFFFFF) + b'WAVE'
+            + b'fmt ' + struct.pack('<IHHIIHH', 16, 1, channels, frame_rate,
+                                    frame_rate * block_align, block_align, sample_width * 8)
+            + b'data' + struct.pack('<I', 0xFFFFFFFF))
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def send_audio(path, mimetype):
+    """send_file a synthesized file and delete it once the response is closed."""
+    try:
+        response = send_file(path, mimetype=mimetype, as_attachment=False)
+    except Exception:
+        _remove(path)
+        raise
+    # Served through the response's own iterator, so closing it runs the
+    # callback; that happens after the file was closed, so Windows allows it
+    response.direct_passthrough = False
+    response.call_on_close(lambda: _remove(path))
+    return response
+
+class SpeechStream:
+    """
+    Iterable of WAV bytes for text synthesized sentence by sentence.
+    Up to `lookahead` chunks are rendered ahead of the one being sent; the
+    first job is submitted on construction so a full queue raises TTSBusy
+    before any response has started.
+    """
+
+    def __init__(self, pool, text, voice='male', rate=TTS_RATE, lookahead=TTS_STREAM_LOOKAHEAD):
+        self.pool = pool
+        self.chunks = split_sentences(text)
+        self.voice = voice
+        self.rate = rate
+        self.lookahead = max(lookahead, 1)
+        self._pending = []
+        self._next = 0
+        if self.chunks:
+            self._submit_next(block=False)
+
+    def _submit_next(self, block=True):
+        deadline = time.monotonic() + self.pool.timeout
+        while True:
+            try:
+                future = self.pool.submit(self.chunks[self._next], self.voice, self.rate)
+                break
+            except TTSBusy:
+                if not block or time.monotonic() >= deadline:
+                    raise
+                self.pool.sleep(0.05)
+        self._pending.append(future)
+        self._next += 1
+
+    def __iter__(self):
+        header_sent = False
+        try:
+            while self._pending or self._next < len(self.chunks):
+                while self._next < len(self.chunks) and len(self._pending) < self.lookahead:
+                    self._submit_next()
+                path = self.pool.wait(self._pending.pop(0))
+                try:
+                    with wave.open(path, 'rb') as wav:
+                        if not header_sent:
+                            yield _wav_stream_header(wav.getnchannels(), wav.getsampwidth(), wav.getframerate())
+                            header_sent = True
+                        yield wav.readframes(wav.getnframes())
+                finally:
+                    _remove(path)
+        finally:
+            # Client went away or a chunk failed: drop the work still queued
+            for future in self._pending:
+                future.cancel()
+                future.add_done_callback(lambda f: _remove(f.audio_path))
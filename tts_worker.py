@@ -0,0 +1,33 @@
+"""
+Entry module for the text-to-speech worker processes.
+Workers import only this module, never app.py, so starting one does not run
+the web app's start-up (database upgrade, background threads, exit hooks).
+"""
+import os
+
+# Each worker process owns one pyttsx3 engine for its whole life, so the
+# driver start-up and voice enumeration happen once per process, not per request.
+_engine = None
+_voices = {}
+
+def _init_worker():
+    global _engine
+    import pyttsx3
+    _engine = pyttsx3.init()
+    for v in _engine.getProperty('voices'):
+        name = (v.name or '').lower()
+        if 'female' in name:
+            _voices.setdefault('female', v.id)
+        if 'male' in name:
+            _voices.setdefault('male', v.id)
+
+def _ping():
+    return os.getpid()
+
+def _synthesize(text, voice, rate, path):
+    if voice in _voices:
+        _engine.setProperty('voice', _voices[voice])
+    _engine.setProperty('rate', rate)
+    _engine.save_to_file(text, path)
+    _engine.runAndWait()
+    return path